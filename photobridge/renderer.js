@@ -167,6 +167,7 @@ document.getElementById('start').addEventListener('click', async () => {
                 } else if (parsedData.type === 'log') {
                     log(parsedData.message);
                 }
+                // Other message types (e.g. 'metric') are for tooling and are ignored here
             } catch (e) {
                 // If the message isn't JSON, treat it as a regular log message
                 log(data);
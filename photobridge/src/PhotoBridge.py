@@ -1,104 +1,401 @@
 import os
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import hashlib
 import json
-import re
-import shutil
-import subprocess
+import multiprocessing
+import multiprocessing.connection
+import queue
+import signal
+import struct
 import sys
+import threading
+import time
 from collections import defaultdict
 from pathlib import Path
+import assembly
+import dedup
+import events
+import exiftool_pool
+import inventory
+import journal
 import macos_heic_to_jpg
+import manifest
+import metadata_table
+import metrics
+import motion_photo
+import native_metadata
+import pipeline
+import scheduler
+import server
+import transfer
+import watcher
+import xmp
+from exiftool_pool import ExifToolError, ExifToolResult, get_pool
 
-def emit_progress(message: str, percentage: float):
-    print(json.dumps({"type": "progress", "message": message, "percentage": percentage}))
+PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.heic']
+VIDEO_EXTENSIONS = ['.mov', '.mp4']
+MIME_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.heic': 'image/heic',
+              '.heif': 'image/heif', '.mov': 'video/quicktime', '.mp4': 'video/mp4'}
+METADATA_TAGS = [
+    "-FilePath", "-FileName", "-BaseName", "-ContentIdentifier",
+    "-CreateDate", "-LivePhotoVideoIndex", "-RuntimeScale"
+]
+EXTRACT_BATCH_SIZE = 500
+
+# Where events go instead of stdout, e.g. a --serve job's event list; per thread and asyncio task
+_event_sink = contextvars.ContextVar('event_sink', default=None)
+# Otherwise, from the command line, they go through an events.Emitter (any thread); print is for library use
+_default_sink = None
+
+def emit_event(message: dict):
+    sink = _event_sink.get()
+    if sink is not None:
+        sink(message)
+        return
+    write_event(message)
+
+def write_event(message: dict):
+    if _default_sink is not None:
+        _default_sink(message)
+        return
+    print(json.dumps(message))
     sys.stdout.flush()
 
+@contextlib.contextmanager
+def progress_range(low: float, high: float):
+    """Maps the progress events emitted on this thread from 0-100 onto low-high, for a run within a run."""
+    outer = _event_sink.get() or write_event
+    
+    def sink(message: dict):
+        if message.get('type') == 'progress':
+            message = dict(message, percentage=low + (high - low) * message.get('percentage', 0) / 100)
+        outer(message)
+    
+    token = _event_sink.set(sink)
+    try:
+        yield
+    finally:
+        _event_sink.reset(token)
+
+def emit_progress(message: str, percentage: float):
+    emit_event({"type": "progress", "message": message, "percentage": percentage})
+
 def emit_log(message: str):
-    print(json.dumps({"type": "log", "message": message}))
-    sys.stdout.flush()
+    emit_event({"type": "log", "message": message})
+
+def emit_metric(name: str, **fields):
+    emit_event({"type": "metric", "name": name, **fields})
+
+class Cancellation:
+    """
+    Progress for a run that has work in flight: a --serve cancel raised by a progress event is held back, so
+    the run can stop taking new work and settle what it already started before raise_if_requested() raises it.
+    """
+    
+    def __init__(self):
+        self.error = None
+    
+    @property
+    def requested(self) -> bool:
+        return self.error is not None
+    
+    def progress(self, message: str, percentage: float):
+        if self.requested:
+            return
+        try:
+            emit_progress(message, percentage)
+        except server.JobCancelled as e:
+            self.error = e
+    
+    def raise_if_requested(self):
+        if self.requested:
+            raise self.error
 
-def extract_metadata_batch(directory: str, recurse: bool = False) -> dict:
-    script_dir = Path(__file__).resolve().parent
-    exiftool_exec_path = script_dir.parent / 'exiftool' / 'exiftool'
+def extract_metadata_batch(directory: str, recurse: bool = False, native: bool = True) -> dict:
+    if native:
+        if os.path.isfile(directory):
+            return extract_metadata_files([directory])
+        return extract_metadata_files(list(iter_media_paths(directory, recurse)))
     
-    exiftool_pull_data = [
-        str(exiftool_exec_path), "-json", "-FilePath", "-FileName",
-        "-BaseName", "-ContentIdentifier", "-CreateDate",
-        "-LivePhotoVideoIndex", "-RuntimeScale"
-    ]
+    exiftool_pull_data = ["-json"] + METADATA_TAGS
     if recurse:
         exiftool_pull_data.append("-r")
     exiftool_pull_data.append(directory)
     
-    result = subprocess.run(exiftool_pull_data, capture_output=True, text=True)
+    try:
+        result = get_pool().execute(exiftool_pull_data)
+    except (ExifToolError, ValueError) as e:
+        emit_log(f"Metadata extraction failed: {e}")
+        return {}
     if not result.stdout.strip():
         return {}
         
     exif_data = json.loads(result.stdout)
     return {item["FilePath"]: item for item in exif_data}
 
+def extract_metadata_files(paths: list, native: bool = True) -> dict:
+    return {record["FilePath"]: record for _, record in iter_metadata(paths, native) if record is not None}
+
+def lookup_cache(path: str, cache: manifest.Manifest | None, counts: dict, stats: dict | None = None) -> tuple:
+    """
+    Returns (stat, record): the cached record, None if the file still has to be read, or False if it is to be
+    left alone (it is gone, or it is a Motion Photo an earlier run produced).
+    """
+    stat = stats.get(path) if stats else None
+    if not cache:
+        return stat, None
+    if stat is None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, False
+    if cache.is_output(path, stat):
+        counts['skipped_outputs'] += 1
+        return stat, False
+    cached = cache.cached_metadata(path, stat)
+    if cached is not None:
+        counts['cached'] += 1
+    return stat, cached
+
+def read_native_metadata(path: str) -> dict | None:
+    try:
+        with metrics.stage('extract_native'):
+            record = native_metadata.read_metadata(path)
+    except (native_metadata.UnsupportedFile, OSError):
+        # Only files the native readers can't handle pay for exiftool
+        metrics.count('files_extracted_exiftool')
+        return None
+    metrics.count('files_extracted_native')
+    return record
+
+def iter_metadata(paths, native: bool = True, cache: manifest.Manifest | None = None, counts: dict | None = None,
+                  stats: dict | None = None):
+    """
+    Yields (path, record) for every path as soon as its record is read, or (path, None) if there is none.
+    Files the native readers can't handle are sent to exiftool EXTRACT_BATCH_SIZE at a time.
+    stats ({path: os.stat_result}, e.g. from an inventory) saves the cache lookups a stat call per file.
+    """
+    if counts is None:
+        counts = {}
+    for name in ('cached', 'extracted', 'skipped_outputs'):
+        counts.setdefault(name, 0)
+    fallback = []
+    for path in paths:
+        stat, record = lookup_cache(path, cache, counts, stats)
+        if record is not None:
+            yield path, record if record is not False else None
+            continue
+        
+        counts['extracted'] += 1
+        if native:
+            record = read_native_metadata(path)
+        else:
+            metrics.count('files_extracted_exiftool')
+        if record is None:
+            fallback.append((path, stat))
+            if len(fallback) >= EXTRACT_BATCH_SIZE:
+                yield from extract_with_exiftool(fallback, cache)
+                fallback = []
+            continue
+        if cache:
+            cache.store_metadata(path, stat, record)
+        yield path, record
+    yield from extract_with_exiftool(fallback, cache)
+    if cache:
+        cache.commit()
+
+def extract_with_exiftool(pending: list, cache: manifest.Manifest | None = None):
+    if not pending:
+        return
+    records = {}
+    try:
+        with metrics.stage('extract_exiftool'):
+            result = get_pool().execute(["-json"] + METADATA_TAGS + [path for path, _ in pending])
+        if result.stdout.strip():
+            records = {item["FilePath"]: item for item in json.loads(result.stdout)}
+    except (ExifToolError, ValueError) as e:
+        emit_log(f"Metadata extraction failed: {e}")
+    for path, stat in pending:
+        # exiftool reports the resolved FilePath
+        record = records.get(path) or records.get(os.path.realpath(path))
+        if record is not None and cache:
+            cache.store_metadata(path, stat, record)
+        yield path, record
+    if cache:
+        cache.commit()
+
+def iter_media_paths(directory: str, recurse: bool = False):
+    return iter(inventory.scan(directory, recurse).paths(PHOTO_EXTENSIONS + VIDEO_EXTENSIONS))
+
 def get_date_part(create_date: str) -> str:
     if not create_date or not create_date.strip():
         return ""
     parts = create_date.strip().split()
     return parts[0] if parts else ""
 
-def group_files_by_contentidentifier(files: list) -> dict:
+def group_files_by_contentidentifier(files: list, date_window: float = 0.0) -> dict:
+    """
+    Groups files by ContentIdentifier; a video without one joins the first photo with its stem and CreateDate
+    day or, with date_window (hours), the photo nearest in time within that many hours of it.
+    """
     groups = defaultdict(list)
-    photos = [f for f in files if f['type'] == 'photo']
+    table = metadata_table.MetadataTable.from_files(files, times=date_window > 0)
+    for file, key in zip(files, table.group_keys(date_window * 3600)):
+        groups[key].append(file)
+    return groups
+
+class StreamingGrouper:
+    """
+    group_files_by_contentidentifier for files that arrive one at a time: a group is handed out as soon as it
+    holds a photo and a video, so muxing can start while the rest of the tree is still being read.
+    """
     
-    for file in files:
+    def __init__(self, date_window: float = 0.0):
+        self.window_seconds = date_window * 3600
+        self.groups = defaultdict(list)
+        self.photo_index = {}
+        self.waiting_videos = defaultdict(list)   # (stem, date) -> untagged videos seen before their photo
+        self.dispatched = {}                      # group key -> members already handed out
+    
+    def add(self, file: dict) -> list:
+        """Files in, (group key, group files) out for every group that just became a pair."""
+        ready = []
+        for key, member in self._place(file):
+            self.groups[key].append(member)
+            if key in ('unmatched_videos', 'no_identifier') or key in self.dispatched:
+                continue
+            group_files = self.groups[key]
+            if any(f['type'] == 'photo' for f in group_files) and any(f['type'] == 'video' for f in group_files):
+                self.dispatched[key] = len(group_files)
+                ready.append((key, list(group_files)))
+        return ready
+    
+    def finish(self):
+        """
+        Yields whatever never became a pair, plus files that joined a group after it was handed out.
+        Unmatched videos come last under 'unmatched_videos'.
+        """
+        for videos in self.waiting_videos.values():
+            self.groups['unmatched_videos'].extend(videos)
+        self.waiting_videos.clear()
+        unmatched = self.groups.pop('unmatched_videos', [])
+        for key, group_files in self.groups.items():
+            rest = group_files[self.dispatched.get(key, 0):]
+            if rest:
+                yield key, rest
+        if unmatched:
+            yield 'unmatched_videos', unmatched
+    
+    def discard(self, paths: set):
+        """Forgets these files (muxed, or given up on), so a long-running grouper only holds what is pending."""
+        for key in list(self.groups):
+            group_files = self.groups[key]
+            kept = [f for f in group_files if f['path'] not in paths]
+            if len(kept) == len(group_files):
+                continue
+            if not kept:
+                del self.groups[key]
+                self.dispatched.pop(key, None)
+                continue
+            if key in self.dispatched:
+                self.dispatched[key] -= sum(f['path'] in paths for f in group_files[:self.dispatched[key]])
+            self.groups[key] = kept
+        for stem_date in list(self.waiting_videos):
+            self.waiting_videos[stem_date] = [f for f in self.waiting_videos[stem_date] if f['path'] not in paths]
+            if not self.waiting_videos[stem_date]:
+                del self.waiting_videos[stem_date]
+        for index_key, photo in list(self.photo_index.items()):
+            if photo['path'] in paths:
+                del self.photo_index[index_key]
+    
+    def _photo_key(self, photo: dict):
+        return photo['metadata'].get('ContentIdentifier') or (
+            get_date_part(photo['metadata'].get('CreateDate', '')), Path(photo['path']).stem)
+    
+    def _place(self, file: dict) -> list:
         content_identifier = file['metadata'].get('ContentIdentifier')
+        date_part = get_date_part(file['metadata'].get('CreateDate', ''))
+        stem = Path(file['path']).stem
         
-        if content_identifier:
-            groups[content_identifier].append(file)
-        elif file['type'] == 'video':
-            video_filename = Path(file['path']).stem
-            pattern = re.compile(rf'^{re.escape(video_filename)}(_\d+)?$')
-            matching_photos = [
-                p for p in photos 
-                if pattern.match(Path(p['path']).stem)
-            ]
-            
-            matched = False
-            for photo in matching_photos:
-                video_date = get_date_part(file['metadata'].get('CreateDate', ''))
-                photo_date = get_date_part(photo['metadata'].get('CreateDate', ''))
-                
-                if video_date and photo_date and video_date == photo_date:
-                    pid = photo['metadata'].get('ContentIdentifier')
-                    if pid:
-                        groups[pid].append(file)
-                    else:
-                        groups[(video_date, Path(photo['path']).stem)].append(file)
-                    matched = True
-                    break
-            
-            if not matched:
-                groups['unmatched_videos'].append(file)
-        else:
-            date_part = get_date_part(file['metadata'].get('CreateDate', ''))
-            if date_part:
-                groups[(date_part, Path(file['path']).stem)].append(file)
-            else:
-                groups['no_identifier'].append(file)
-                
-    return groups
+        if file['type'] == 'video':
+            if content_identifier:
+                return [(content_identifier, file)]
+            if not date_part:
+                return [('unmatched_videos', file)]
+            photo = self.photo_index.get((stem, date_part)) or self._nearest_photo(stem, file)
+            if photo:
+                return [(self._photo_key(photo), file)]
+            self.waiting_videos[(stem, date_part)].append(file)
+            return []
+        
+        if not date_part:
+            return [(content_identifier or 'no_identifier', file)]
+        key = content_identifier or (date_part, stem)
+        placed = [(key, file)]
+        # Same index as MetadataTable.photo_index; the first photo to claim a (stem, date) takes the videos
+        # waiting on it, then, with a date window, waiting videos close enough in time
+        _, base_stem = metadata_table.split_stem(file['path'])
+        for index_stem in [stem] + ([base_stem] if base_stem else []):
+            if (index_stem, date_part) not in self.photo_index:
+                self.photo_index[(index_stem, date_part)] = file
+                placed.extend((key, video) for video in self.waiting_videos.pop((index_stem, date_part), []))
+                placed.extend((key, video) for video in self._videos_near(index_stem, file))
+        return placed
+    
+    def _seconds(self, file: dict) -> int:
+        return metadata_table.parse_create_date(file['metadata'].get('CreateDate', ''))[1]
+    
+    def _nearest_photo(self, stem: str, video: dict) -> dict | None:
+        seconds = self._seconds(video)
+        if not self.window_seconds or seconds == metadata_table.NO_SECONDS:
+            return None
+        nearest = None
+        for day in metadata_table.days_around(seconds, self.window_seconds):
+            photo = self.photo_index.get((stem, day))
+            if photo and self._seconds(photo) != metadata_table.NO_SECONDS:
+                distance = abs(self._seconds(photo) - seconds)
+                if distance <= self.window_seconds and (nearest is None or distance < nearest[0]):
+                    nearest = (distance, photo)
+        return nearest[1] if nearest else None
+    
+    def _videos_near(self, stem: str, photo: dict) -> list:
+        seconds = self._seconds(photo)
+        if not self.window_seconds or seconds == metadata_table.NO_SECONDS:
+            return []
+        claimed = []
+        for day in metadata_table.days_around(seconds, self.window_seconds):
+            waiting = self.waiting_videos.get((stem, day), [])
+            near = [video for video in waiting if self._seconds(video) != metadata_table.NO_SECONDS
+                    and abs(self._seconds(video) - seconds) <= self.window_seconds]
+            if near:
+                claimed.extend(near)
+                self.waiting_videos[(stem, day)] = [video for video in waiting if video not in near]
+                if not self.waiting_videos[(stem, day)]:
+                    del self.waiting_videos[(stem, day)]
+        return claimed
+
+def get_presentation_timestamp_us(photo_metadata: dict) -> int:
+    live_photo_video_index = int(photo_metadata.get("LivePhotoVideoIndex", 0))
+    run_time_scale = int(photo_metadata.get("RunTimeScale", 1))
+    if run_time_scale == 0:
+        run_time_scale = 1
+    return int((live_photo_video_index / run_time_scale) * 1000000)
 
-def add_xmp_metadata(photo_metadata: dict, motion_photo_path: str, video_offset: int):
+def add_xmp_metadata(photo_metadata: dict, motion_photo_path: str, video_offset: int,
+                     source_path: str | None = None, container_items: list | None = None) -> ExifToolResult:
     try:
-        live_photo_video_index = int(photo_metadata.get("LivePhotoVideoIndex", 0))
-        run_time_scale = int(photo_metadata.get("RunTimeScale", 1))
-        if run_time_scale == 0:
-            run_time_scale = 1
-        presentation_timestamp_us = int((live_photo_video_index / run_time_scale) * 1000000)
-        
-        script_dir = Path(__file__).resolve().parent
-        config_file_path = script_dir.parent / 'exiftool' / 'google_camera.config'
-        exiftool_exec_path = script_dir.parent / 'exiftool' / 'exiftool'
+        presentation_timestamp_us = get_presentation_timestamp_us(photo_metadata)
         
-        exiftool_add_metadata = [
-            str(exiftool_exec_path), '-config', str(config_file_path),
-            '-overwrite_original', '-m', '-q',
+        # With a source path exiftool writes the tagged copy itself (-o) instead of rewriting in place
+        if source_path:
+            write_mode = ['-o', motion_photo_path]
+        else:
+            write_mode = ['-overwrite_original']
+        exiftool_add_metadata = write_mode + [
+            '-m', '-q',
             '-XMP-GCamera:MicroVideo=1',
             '-XMP-GCamera:MicroVideoVersion=1',
             f'-XMP-GCamera:MicroVideoOffset={video_offset}',
@@ -106,98 +403,591 @@ def add_xmp_metadata(photo_metadata: dict, motion_photo_path: str, video_offset:
             '-XMP-GCamera:MotionPhoto=1',
             '-XMP-GCamera:MotionPhotoVersion=1',
             f'-XMP-GCamera:MotionPhotoPresentationTimestampUs={presentation_timestamp_us}',
-            motion_photo_path
         ]
-        subprocess.run(exiftool_add_metadata, capture_output=True, text=True)
-    except Exception:
-        pass
+        if container_items:
+            # exiftool's own GContainer tables; same namespaces as xmp.container_directory_elements
+            items = ','.join(f'{{Item={{Mime={mime},Semantic={semantic},Length={length},Padding={padding}}}}}'
+                             for mime, semantic, length, padding in container_items)
+            exiftool_add_metadata.append(f'-XMP-GContainer:ContainerDirectory=[{items}]')
+        exiftool_add_metadata.append(source_path or motion_photo_path)
+        return get_pool().execute(exiftool_add_metadata)
+    except (ExifToolError, ValueError) as e:
+        return ExifToolResult(returncode=1, stdout='', stderr=str(e))
 
-def create_motion_photo(photo_path: str, video_path: str, metadata: dict, output_dir: str) -> bool:
+def build_native_header(photo_path: str, photo_metadata: dict, video_offset: int, log=emit_log,
+                        container_items: list | None = None) -> tuple | None:
+    extension = Path(photo_path).suffix.lower()
+    if extension in ['.jpg', '.jpeg']:
+        build = assembly.build_jpeg_header
+    elif extension in ['.heic', '.heif']:
+        build = assembly.build_heif_header
+    else:
+        return None
+    elements = xmp.motion_photo_elements(video_offset, get_presentation_timestamp_us(photo_metadata))
+    if container_items:
+        elements += xmp.container_directory_elements(container_items)
     try:
-        photo_p = Path(photo_path)
-        base_name = f"{photo_p.stem}.MP"
-        extension = photo_p.suffix
-        
-        motion_photo_path = Path(output_dir) / f"{base_name}{extension}"
-        motion_photo_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        video_filesize = os.path.getsize(video_path)
-        
-        # Step 1: Copy clean image to destination first
-        shutil.copyfile(photo_path, motion_photo_path)
-        
-        # Step 2: Inject XMP metadata into the clean photo file FIRST (prevents ISO container parsing errors on HEIC)
-        add_xmp_metadata(metadata, str(motion_photo_path), video_filesize)
-        
-        # Step 3: Append raw video bytes to the tagged photo
-        with open(motion_photo_path, "ab") as outfile, open(video_path, "rb") as video:
-            outfile.write(video.read())
-            
+        return build(photo_path, elements)
+    except (ValueError, SyntaxError, struct.error) as e:
+        log(f"Native XMP write failed for {photo_path}, falling back to exiftool: {e}")
+        return None
+
+def get_container_items(photo_path: str, video_path: str, video_size: int) -> list:
+    # Lengths come from the sizes alone: the photo is the primary item, the video is appended whole after it
+    return [(MIME_TYPES.get(Path(photo_path).suffix.lower(), 'image/jpeg'), 'Primary', 0, 0),
+            (MIME_TYPES.get(Path(video_path).suffix.lower(), 'video/quicktime'), 'MotionPhoto', video_size, 0)]
+
+def get_motion_photo_path(photo_path: str, output_dir: str) -> Path:
+    photo_p = Path(photo_path)
+    base_name = f"{photo_p.stem}.MP"
+    extension = photo_p.suffix
+    return Path(output_dir) / f"{base_name}{extension}"
+
+def tag_motion_photo(photo_path: str, video_path: str, metadata: dict, output_dir: str, log=emit_log,
+                     motion_photo_version: int = 1) -> dict | None:
+    """
+    First half of create_motion_photo: the tagged photo header, worked out natively, or a tagged copy of the
+    photo written by exiftool. Returns what append_motion_photo needs to finish the file, None if tagging failed.
+    """
+    motion_photo_path = get_motion_photo_path(photo_path, output_dir)
+    motion_photo_path.parent.mkdir(parents=True, exist_ok=True)
+    # Written under a temp name and renamed into place, so a .MP file on disk is always a finished one
+    plan = {'photo': photo_path, 'video': video_path, 'output': str(motion_photo_path),
+            'temp': transfer.temp_path(str(motion_photo_path))}
+    
+    video_filesize = os.path.getsize(video_path)
+    
+    # JPEG/HEIC: only the header is built here, the rest of the photo and the video are streamed in one pass later
+    container_items = get_container_items(photo_path, video_path, video_filesize) if motion_photo_version >= 2 else None
+    header = build_native_header(photo_path, metadata, video_filesize, log, container_items)
+    if header is not None:
+        plan['header'], plan['resume_offset'] = header
+        return plan
+    
+    # Step 1: Have exiftool write a tagged copy of the clean photo FIRST (prevents ISO container parsing errors on HEIC)
+    Path(plan['temp']).unlink(missing_ok=True)
+    with metrics.stage('xmp_write_exiftool'):
+        result = add_xmp_metadata(metadata, plan['temp'], video_filesize, source_path=photo_path,
+                                  container_items=container_items)
+    if result.returncode != 0:
+        log(f"exiftool failed on {motion_photo_path} (status {result.returncode}): {result.stderr.strip()}")
+        Path(plan['temp']).unlink(missing_ok=True)
+        return None
+    return plan
+
+def append_motion_photo(plan: dict):
+    try:
+        if 'header' in plan:
+            with metrics.stage('native_write'):
+                assembly.write_motion_photo(plan['header'], plan['photo'], plan['resume_offset'], plan['video'],
+                                            plan['temp'])
+        else:
+            # Step 2: Stream raw video bytes onto the end of the tagged photo
+            with metrics.stage('video_append'):
+                assembly.append_video(plan['temp'], plan['video'])
+        with metrics.stage('fsync'):
+            transfer.commit(plan['temp'], plan['output'])
+    except BaseException:
+        Path(plan['temp']).unlink(missing_ok=True)
+        raise
+
+def create_motion_photo(photo_path: str, video_path: str, metadata: dict, output_dir: str, log=emit_log,
+                        motion_photo_version: int = 1) -> bool:
+    try:
+        plan = tag_motion_photo(photo_path, video_path, metadata, output_dir, log, motion_photo_version)
+        if plan is None:
+            return False
+        append_motion_photo(plan)
         return True
     except Exception:
         return False
 
-def process_directory(directory: str, recurse: bool, output_dir: str, heic_conversion: bool):
-    emit_progress("Extracting metadata...", 10)
-    metadata_by_path = extract_metadata_batch(directory, recurse)
-    
-    emit_progress("Processing files...", 20)
-    files = []
-    for file_path, metadata in metadata_by_path.items():
-        ext = Path(file_path).suffix.lower()
-        if ext in ['.jpg', '.jpeg', '.png', '.heic']:
-            files.append({'path': file_path, 'metadata': metadata, 'type': 'photo'})
-        elif ext in ['.mov', '.mp4']:
-            files.append({'path': file_path, 'metadata': metadata, 'type': 'video'})
-            
-    emit_progress("Grouping files...", 40)
-    groups = group_files_by_contentidentifier(files)
-    
-    total_groups = len([k for k in groups.keys() if k != 'unmatched_videos'])
-    processed_groups = 0
+def get_group_pair(group_files: list) -> tuple:
+    photos = [f for f in group_files if f['type'] == 'photo']
+    videos = [f for f in group_files if f['type'] == 'video']
+    if not (photos and videos):
+        return None, None
+    return photos[0], videos[0]
+
+def mux_group(group_files: list, output_dir: str, existing_output: str | None = None,
+              motion_photo_version: int = 1, fingerprint: bool = False) -> dict | None:
+    # Runs on a worker: logs are collected and handed back so the parent can emit them in group order
+    photo, video = get_group_pair(group_files)
+    if photo is None:
+        return None
+    if existing_output:
+        return {'success': True, 'logs': [f"Already muxed into {existing_output}, skipping"], 'reused': True}
     
-    for group_key, group_files in groups.items():
-        if group_key == 'unmatched_videos':
-            continue
+    logs = []
+    # Whatever the pair records is handed back too: process workers can't reach the parent's collector
+    with metrics.capture() as recorded:
+        start = time.perf_counter()
+        success = create_motion_photo(photo['path'], video['path'], photo['metadata'], output_dir, logs.append,
+                                      motion_photo_version)
+        metrics.observe('pair', time.perf_counter() - start)
+        result = {'success': success, 'logs': logs, 'reused': False}
+        if success and fingerprint:
+            # For the dedup index, hashed here while the pair is still in the page cache
+            result['fingerprint'] = pair_fingerprint(photo, video)
+    result['metrics'] = recorded.snapshot()
+    return result
+
+def pair_fingerprint(photo: dict, video: dict) -> dict | None:
+    try:
+        return dedup.fingerprint(photo['path'], video['path'], photo['metadata'].get('ContentIdentifier'))
+    except OSError:
+        return None
+
+def link_duplicate(existing_output: str, photo_path: str, output_dir: str) -> str:
+    """Hard links (or, across filesystems, copies) an identical Motion Photo to where this pair's would go."""
+    target = str(get_motion_photo_path(photo_path, output_dir).absolute())
+    if os.path.exists(target) and os.path.samefile(existing_output, target):
+        return target
+    temp = transfer.temp_path(target)
+    try:
+        # Through a temp name, so a different file already at target is replaced atomically
+        os.link(existing_output, temp)
+        transfer.commit(temp, target)
+        metrics.count('transfer_hardlink')
+    except OSError as e:
+        if e.errno not in transfer.LINK_FALLBACK_ERRNOS:
+            raise
+        transfer.transfer(existing_output, target, keep_source=True)
+    return target
+
+def find_duplicate(dedup_index: dedup.DedupIndex | None, dedup_mode: str | None, group_files: list,
+                   output_dir: str) -> str | None:
+    """The Motion Photo already made from this exact pair, hard linked into output_dir with dedup_mode hardlink."""
+    photo, video = get_group_pair(group_files)
+    if dedup_index is None or photo is None:
+        return None
+    try:
+        existing_output = dedup_index.find(photo['path'], video['path'], photo['metadata'].get('ContentIdentifier'))
+        if existing_output and dedup_mode == 'hardlink':
+            target = link_duplicate(existing_output, photo['path'], output_dir)
+            if target != existing_output:
+                emit_log(f"Hard linked {target} to {existing_output}")
+            existing_output = target
+    except OSError as e:
+        emit_log(f"Dedup lookup failed for {photo['path']}: {e}")
+        return None
+    return existing_output
+
+def open_dedup_index(dedup_mode: str | None, output_dir: str) -> dedup.DedupIndex | None:
+    return dedup.DedupIndex(os.path.join(output_dir, dedup.INDEX_NAME)) if dedup_mode else None
+
+def close_dedup_index(dedup_index: dedup.DedupIndex | None, dedup_mode: str | None):
+    if dedup_index is None:
+        return
+    counts = dedup_index.counts
+    verb = 'hard linked' if dedup_mode == 'hardlink' else 'skipped'
+    emit_log(f"Dedup: {counts['hits']} identical pairs {verb}, {counts['recorded']} new pairs recorded, "
+             f"{counts['rejected']} sampled matches rejected by the full hash, {counts['stale']} stale entries dropped")
+    dedup_index.close()
+
+def emit_phase(phase: str, start: float, **fields) -> float:
+    now = time.perf_counter()
+    emit_metric('phase', phase=phase, seconds=round(now - start, 4), **fields)
+    return now
+
+def emit_metrics_summary(wall_seconds: float) -> dict:
+    summary = metrics.summarize(metrics.process_metrics(), wall_seconds)
+    for name, stage in summary['stages'].items():
+        emit_metric('stage', stage=name, **stage)
+    for name, histogram in summary['latency'].items():
+        emit_metric('latency', stage=name, **histogram)
+    emit_metric('counters', **summary['counters'])
+    emit_metric('throughput', wall_seconds=summary['wall_seconds'],
+                **{key: value for key, value in summary.items() if key.endswith('_per_second')})
+    return summary
+
+def process_directory(directory: str, recurse: bool, output_dir: str, heic_conversion: bool,
+                      jobs: int = 1, executor_kind: str = 'thread', manifest_path: str | None = None,
+                      files: inventory.Inventory | None = None, date_window: float = 0.0,
+                      run_journal: journal.Journal | None = None, motion_photo_version: int = 1,
+                      dedup_mode: str | None = None, read_files: list | None = None, leftovers: list | None = None):
+    """
+    With read_files (path/metadata/type dicts, e.g. the leftovers of --shards), those are grouped as they are,
+    without a scan or metadata extraction. With leftovers, files that never paired are collected there
+    instead of being muxed or moved, for a --shards parent to reconcile.
+    """
+    cache = manifest.Manifest(manifest_path) if manifest_path else None
+    dedup_index = open_dedup_index(dedup_mode, output_dir)
+    cancellation = Cancellation()
+    try:
+        cancellation.progress("Scanning files...", 5)
+        cancellation.raise_if_requested()
+        phase_start = time.perf_counter()
+        counts = {}
+        if read_files is not None:
+            paths = [f['path'] for f in read_files]
+            records = ((f['path'], f['metadata']) for f in read_files)
+        else:
+            if files is None:
+                files = inventory.scan(directory, recurse)
+            paths = files.paths(PHOTO_EXTENSIONS + VIDEO_EXTENSIONS)
+            records = iter_metadata(paths, cache=cache, counts=counts, stats=files.stats())
+        phase_start = emit_phase('scan', phase_start, files=len(paths))
+        total_files = max(len(paths), 1)
+        # Every file counts twice towards 10-95%: once when its metadata is read, once when it's muxed or moved
+        done = {'read': 0, 'settled': 0}
+        
+        def percentage() -> float:
+            return 10 + 85 * (done['read'] + done['settled']) / (2 * total_files)
+        
+        grouper = StreamingGrouper(date_window)
+        unmatched_videos = []
+        
+        def group_tasks():
+            extract_start = time.perf_counter()
+            for path, metadata in records:
+                done['read'] += 1
+                cancellation.progress(f"Extracting metadata ({done['read']} of {len(paths)} files)...", percentage())
+                if cancellation.requested:
+                    # No new groups; the ones already handed out are settled before the cancel is raised
+                    return
+                if metadata is None:
+                    done['settled'] += 1
+                    continue
+                file_type = 'photo' if Path(path).suffix.lower() in PHOTO_EXTENSIONS else 'video'
+                with metrics.stage('group'):
+                    ready = grouper.add({'path': path, 'metadata': metadata, 'type': file_type})
+                for _, group_files in ready:
+                    yield group_task(group_files)
             
-        processed_groups += 1
-        progress = 40 + (processed_groups / max(total_groups, 1) * 50)
-        emit_progress(f"Processing group {processed_groups} of {total_groups}...", progress)
+            # Muxing overlaps extraction, so this is the wall time until the last record arrived
+            emit_phase('extract', extract_start, files=len(paths))
+            if cache and counts:
+                emit_log(f"Metadata cache: {counts['cached']} cached, {counts['extracted']} extracted, "
+                         f"{counts['skipped_outputs']} previous outputs skipped")
+            for group_key, group_files in grouper.finish():
+                if leftovers is not None:
+                    leftovers.extend(group_files)
+                elif group_key == 'unmatched_videos':
+                    unmatched_videos.extend(group_files)
+                elif not cancellation.requested:
+                    yield group_task(group_files)
         
-        photos = [f for f in group_files if f['type'] == 'photo']
-        videos = [f for f in group_files if f['type'] == 'video']
+        def group_task(group_files: list) -> tuple:
+            photo, video = get_group_pair(group_files)
+            existing_output = cache.existing_output(photo['path'], video['path']) if cache and photo else None
+            if not existing_output:
+                existing_output = find_duplicate(dedup_index, dedup_mode, group_files, output_dir)
+            if not existing_output:
+                plan_group(run_journal, group_files, output_dir)
+            return group_files, output_dir, existing_output, motion_photo_version, dedup_index is not None
         
-        if photos and videos:
-            photo = photos[0]
-            video = videos[0]
-            if create_motion_photo(photo['path'], video['path'], photo['metadata'], output_dir):
-                for f in group_files:
-                    Path(f['path']).unlink(missing_ok=True)
-        else:
-            for f in group_files:
-                dest_path = Path(output_dir) / Path(f['path']).name
-                Path(f['path']).rename(dest_path)
-                emit_log(f"Moved unmatched photo to: {dest_path}")
+        processed_groups = 0
+        with scheduler.make_executor(jobs, executor_kind, exiftool_pool.configure_pool, (1,)) as executor:
+            for (group_files, *_), result, error in scheduler.run_ordered(executor, mux_group, group_tasks(),
+                                                                          jobs * 4):
+                processed_groups += 1
+                done['settled'] += len(group_files)
+                cancellation.progress(f"Processing group {processed_groups}...", percentage())
                 
-    emit_progress("Processing unmatched files...", 95)
-    for video in groups.get('unmatched_videos', []):
-        dest_path = Path(output_dir) / Path(video['path']).name
-        Path(video['path']).rename(dest_path)
-        emit_log(f"Moved unmatched video to: {dest_path}")
+                if error is not None:
+                    emit_log(f"Failed to process group {processed_groups}: {error}")
+                    if run_journal:
+                        run_journal.abandon(group_files[0]['path'])
+                else:
+                    settle_group(group_files, result, output_dir, cache, run_journal, dedup_index)
+        phase_start = emit_phase('mux', phase_start, groups=processed_groups)
+        cancellation.raise_if_requested()
         
+        cancellation.progress("Processing unmatched files...", percentage())
+        cancellation.raise_if_requested()
+        move_to_output(unmatched_videos, output_dir, cache, 'video', run_journal)
+        emit_phase('unmatched', phase_start, files=len(unmatched_videos))
+    finally:
+        close_dedup_index(dedup_index, dedup_mode)
+        if cache:
+            cache.close()
     emit_progress("Complete!", 100)
 
-def process_individual_files(photo_path: str, video_path: str, output_dir: str):
-    photo_metadata = extract_metadata_batch(photo_path)
-    video_metadata = extract_metadata_batch(video_path)
-    
+def settle_group(group_files: list, result: dict | None, output_dir: str, cache: manifest.Manifest | None,
+                 run_journal: journal.Journal | None = None, dedup_index: dedup.DedupIndex | None = None):
+    if result is None:
+        move_to_output(group_files, output_dir, cache, 'photo', run_journal)
+        return
+    if 'metrics' in result:
+        metrics.process_metrics().merge(result['metrics'])
+    for message in result['logs']:
+        emit_log(message)
+    if not result['success']:
+        if run_journal:
+            run_journal.abandon(group_files[0]['path'])
+        return
+    # Sources go only after the worker has fsynced the Motion Photo
+    if run_journal:
+        run_journal.commit(group_files[0]['path'])
+    if cache and not result['reused']:
+        record_motion_photo(cache, group_files, output_dir)
+    if dedup_index and result.get('fingerprint'):
+        record_fingerprint(dedup_index, group_files, output_dir, result['fingerprint'])
+    with metrics.stage('file_moves'):
+        for f in group_files:
+            Path(f['path']).unlink(missing_ok=True)
+            if cache:
+                cache.forget(f['path'])
+    if run_journal:
+        run_journal.done(group_files[0]['path'])
+
+def plan_group(run_journal: journal.Journal | None, group_files: list, output_dir: str):
+    """Journals a pair before anything of its Motion Photo is written."""
+    photo, _ = get_group_pair(group_files)
+    if run_journal and photo is not None:
+        run_journal.plan([f['path'] for f in group_files], str(get_motion_photo_path(photo['path'], output_dir)))
+
+def move_to_output(files: list, output_dir: str, cache: manifest.Manifest | None, kind: str,
+                   run_journal: journal.Journal | None = None):
+    for f in files:
+        dest_path, strategy = move_file(f['path'], output_dir, run_journal)
+        record_move(cache, f['path'], dest_path, strategy, kind)
+
+def move_file(path: str, output_dir: str, run_journal: journal.Journal | None = None) -> tuple:
+    dest_path = Path(output_dir) / Path(path).name
+    if run_journal:
+        run_journal.plan([path], str(dest_path), kind='move')
+    with metrics.stage('file_moves'):
+        strategy = transfer.transfer(path, str(dest_path))
+    if run_journal:
+        run_journal.done(path)
+    return dest_path, strategy
+
+def record_move(cache: manifest.Manifest | None, path: str, dest_path: Path, strategy: str, kind: str):
+    if cache:
+        # Only a rename keeps the inode the cached metadata is keyed on
+        if strategy == 'rename':
+            cache.moved(path, str(dest_path.absolute()))
+        else:
+            cache.forget(path)
+    via = '' if strategy == 'rename' else f" ({strategy})"
+    emit_log(f"Moved unmatched {kind} to: {dest_path}{via}")
+
+def pipeline_limits(jobs: int, spec: str | None = None) -> dict:
+    # pair stays single: it owns the grouper
+    defaults = {'extract': jobs, 'exiftool': min(jobs, 16), 'tag': jobs, 'append': jobs, 'cleanup': jobs}
+    return pipeline.parse_limits(spec, defaults)
+
+def process_directory_pipeline(directory: str, recurse: bool, output_dir: str, limits: dict,
+                               manifest_path: str | None = None, files: inventory.Inventory | None = None,
+                               date_window: float = 0.0, run_journal: journal.Journal | None = None,
+                               motion_photo_version: int = 1, dedup_mode: str | None = None,
+                               leftovers: list | None = None):
+    """
+    process_directory as an asyncio pipeline: scan -> extract -> exiftool fallback -> pair -> tag -> append ->
+    cleanup, connected by bounded queues. Every stage keeps its own worker count (limits), so exiftool, CPU
+    and disk work overlap, and the queues keep memory flat however large the tree is.
+    """
+    cache = manifest.Manifest(manifest_path) if manifest_path else None
+    dedup_index = open_dedup_index(dedup_mode, output_dir)
+    cancellation = Cancellation()
+    try:
+        cancellation.progress("Scanning files...", 5)
+        cancellation.raise_if_requested()
+        phase_start = time.perf_counter()
+        if files is None:
+            files = inventory.scan(directory, recurse)
+        paths = files.paths(PHOTO_EXTENSIONS + VIDEO_EXTENSIONS)
+        stats = files.stats()
+        phase_start = emit_phase('scan', phase_start, files=len(paths))
+        total_files = max(len(paths), 1)
+        done = {'read': 0, 'settled': 0, 'groups': 0}
+        counts = {'cached': 0, 'extracted': 0, 'skipped_outputs': 0}
+        grouper = StreamingGrouper(date_window)
+        fallback = []
+        
+        def percentage() -> float:
+            return 10 + 85 * (done['read'] + done['settled']) / (2 * total_files)
+        
+        def file_read(settled: bool):
+            done['read'] += 1
+            done['settled'] += settled
+            cancellation.progress(f"Extracting metadata ({done['read']} of {len(paths)} files)...", percentage())
+        
+        # Once cancelled, the stages up to tag drop what reaches them; pairs already being written go on to cleanup
+        async def extract(stage, path):
+            if cancellation.requested:
+                return
+            # Manifest lookups stay on the event loop thread: sqlite connections can't be shared with the workers
+            stat, record = lookup_cache(path, cache, counts, stats)
+            if record is False:
+                file_read(settled=True)
+                return
+            if record is None:
+                counts['extracted'] += 1
+                record = await stage.run(read_native_metadata, path)
+                if record is not None and cache:
+                    cache.store_metadata(path, stat, record)
+            await stage.emit((path, stat, record))
+        
+        async def exiftool_batch(stage, batch):
+            records = await stage.run(lambda: list(extract_with_exiftool(batch)))
+            for (path, stat), (_, record) in zip(batch, records):
+                if record is not None and cache:
+                    cache.store_metadata(path, stat, record)
+                await stage.emit((path, stat, record))
+        
+        async def exiftool(stage, item):
+            path, stat, record = item
+            if record is not None:
+                await stage.emit(item)
+                return
+            if cancellation.requested:
+                return
+            fallback.append((path, stat))
+            if len(fallback) >= EXTRACT_BATCH_SIZE:
+                batch = fallback[:]
+                fallback.clear()
+                await exiftool_batch(stage, batch)
+        
+        async def exiftool_flush(stage):
+            if fallback and not cancellation.requested:
+                await exiftool_batch(stage, fallback[:])
+        
+        async def pair(stage, item):
+            path, _, record = item
+            file_read(settled=record is None)
+            if record is None or cancellation.requested:
+                return
+            file_type = 'photo' if Path(path).suffix.lower() in PHOTO_EXTENSIONS else 'video'
+            with metrics.stage('group'):
+                ready = grouper.add({'path': path, 'metadata': record, 'type': file_type})
+            for _, group_files in ready:
+                await stage.emit({'files': group_files})
+        
+        async def pair_flush(stage):
+            emit_phase('extract', extract_start, files=len(paths))
+            if cache:
+                cache.commit()
+                emit_log(f"Metadata cache: {counts['cached']} cached, {counts['extracted']} extracted, "
+                         f"{counts['skipped_outputs']} previous outputs skipped")
+            if cancellation.requested:
+                return
+            for group_key, group_files in grouper.finish():
+                if leftovers is not None:
+                    leftovers.extend(group_files)
+                    continue
+                await stage.emit({'files': group_files, 'unmatched': group_key == 'unmatched_videos'})
+        
+        async def find_duplicate_async(stage, photo, video) -> str | None:
+            # As find_duplicate, with the hashing on the stage's threads and the sqlite on this one
+            try:
+                key = await stage.run(dedup.pair_key, photo['path'], video['path'],
+                                      photo['metadata'].get('ContentIdentifier'))
+                candidates = dedup_index.candidates(key)
+                if not candidates:
+                    return None
+                hashes = await stage.run(dedup.full_hashes, photo['path'], video['path'])
+                existing_output = dedup_index.confirm(candidates, hashes)
+                if existing_output and dedup_mode == 'hardlink':
+                    target = await stage.run(link_duplicate, existing_output, photo['path'], output_dir)
+                    if target != existing_output:
+                        emit_log(f"Hard linked {target} to {existing_output}")
+                    existing_output = target
+            except OSError as e:
+                emit_log(f"Dedup lookup failed for {photo['path']}: {e}")
+                return None
+            return existing_output
+        
+        async def tag(stage, job):
+            if cancellation.requested:
+                return
+            photo, video = get_group_pair(job['files'])
+            if photo is not None and not job.get('unmatched'):
+                existing_output = cache.existing_output(photo['path'], video['path']) if cache else None
+                if not existing_output and dedup_index:
+                    existing_output = await find_duplicate_async(stage, photo, video)
+                if existing_output:
+                    job['result'] = {'success': True, 'logs': [f"Already muxed into {existing_output}, skipping"],
+                                     'reused': True}
+                else:
+                    job['logs'] = []
+                    job['start'] = time.perf_counter()
+                    try:
+                        await stage.run(plan_group, run_journal, job['files'], output_dir)
+                        job['plan'] = await stage.run(tag_motion_photo, photo['path'], video['path'],
+                                                      photo['metadata'], output_dir, job['logs'].append,
+                                                      motion_photo_version)
+                    except Exception:
+                        job['plan'] = None
+            await stage.emit(job)
+        
+        async def append(stage, job):
+            if 'plan' in job:
+                success = job['plan'] is not None
+                if success:
+                    try:
+                        await stage.run(append_motion_photo, job['plan'])
+                    except Exception:
+                        success = False
+                metrics.observe('pair', time.perf_counter() - job['start'])
+                job['result'] = {'success': success, 'logs': job['logs'], 'reused': False}
+                if success and dedup_index:
+                    job['result']['fingerprint'] = await stage.run(pair_fingerprint, *get_group_pair(job['files']))
+            await stage.emit(job)
+        
+        async def cleanup(stage, job):
+            moves = job.get('unmatched') or job.get('result') is None
+            if moves and cancellation.requested:
+                return
+            if not job.get('unmatched'):
+                done['groups'] += 1
+            if moves:
+                # Moves to another volume are full copies, so they run on the stage's threads
+                kind = 'video' if job.get('unmatched') else 'photo'
+                for f in job['files']:
+                    dest_path, strategy = await stage.run(move_file, f['path'], output_dir, run_journal)
+                    record_move(cache, f['path'], dest_path, strategy, kind)
+            else:
+                settle_group(job['files'], job['result'], output_dir, cache, run_journal, dedup_index)
+            done['settled'] += len(job['files'])
+            cancellation.progress(f"Processing group {done['groups']}...", percentage())
+        
+        stages = [
+            pipeline.Stage('extract', extract, limits['extract']),
+            pipeline.Stage('exiftool', exiftool, limits['exiftool'], flush=exiftool_flush),
+            pipeline.Stage('pair', pair, flush=pair_flush),
+            pipeline.Stage('tag', tag, limits['tag']),
+            pipeline.Stage('append', append, limits['append']),
+            pipeline.Stage('cleanup', cleanup, limits['cleanup']),
+        ]
+        extract_start = time.perf_counter()
+        asyncio.run(pipeline.run_stages(paths, stages))
+        emit_phase('mux', phase_start, groups=done['groups'])
+        cancellation.raise_if_requested()
+    finally:
+        close_dedup_index(dedup_index, dedup_mode)
+        if cache:
+            cache.close()
+    emit_progress("Complete!", 100)
+
+def record_fingerprint(dedup_index: dedup.DedupIndex, group_files: list, output_dir: str, fingerprint: dict):
+    photo, _ = get_group_pair(group_files)
+    try:
+        dedup_index.record(str(get_motion_photo_path(photo['path'], output_dir).absolute()), fingerprint)
+    except OSError:
+        pass
+
+def record_motion_photo(cache: manifest.Manifest, group_files: list, output_dir: str):
+    photo, video = get_group_pair(group_files)
+    try:
+        cache.record_output(photo['path'], os.stat(photo['path']), video['path'], os.stat(video['path']),
+                            str(get_motion_photo_path(photo['path'], output_dir).absolute()))
+        cache.commit()
+    except OSError:
+        pass
+
+def process_individual_files(photo_path: str, video_path: str, output_dir: str, date_window: float = 0.0,
+                             motion_photo_version: int = 1):
+    # Both files in one extraction call
     files = []
-    for file_path, metadata in photo_metadata.items():
-        files.append({'path': file_path, 'metadata': metadata, 'type': 'photo'})
-    for file_path, metadata in video_metadata.items():
-        files.append({'path': file_path, 'metadata': metadata, 'type': 'video'})
+    for file_path, metadata in iter_metadata([photo_path, video_path]):
+        if metadata is not None:
+            files.append({'path': file_path, 'metadata': metadata,
+                          'type': 'photo' if file_path == photo_path else 'video'})
         
-    groups = group_files_by_contentidentifier(files)
+    groups = group_files_by_contentidentifier(files, date_window)
     
     for group_key, group_files in groups.items():
         photos = [f for f in group_files if f['type'] == 'photo']
@@ -206,15 +996,560 @@ def process_individual_files(photo_path: str, video_path: str, output_dir: str):
         if photos and videos:
             photo = photos[0]
             video = videos[0]
-            if create_motion_photo(photo['path'], video['path'], photo['metadata'], output_dir):
+            if create_motion_photo(photo['path'], video['path'], photo['metadata'], output_dir,
+                                   motion_photo_version=motion_photo_version):
                 for f in group_files:
                     Path(f['path']).unlink(missing_ok=True)
         else:
             for f in group_files:
                 dest_path = Path(output_dir) / Path(f['path']).name
-                Path(f['path']).rename(dest_path)
+                transfer.transfer(f['path'], str(dest_path))
+
+def emit_result(**fields):
+    emit_event({"type": "result", **fields})
+
+def read_pairs(lines):
+    """Yields (photo, video, output_dir, error) for each line of a JSON Lines pair list."""
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            photo, video = entry['photo'], entry['video']
+        except (ValueError, KeyError, TypeError):
+            yield None, None, None, f"line {line_number}: expected {{\"photo\": ..., \"video\": ...}}"
+            continue
+        if not Path(photo).is_file() or not Path(video).is_file():
+            yield photo, video, None, f"line {line_number}: photo or video not found"
+            continue
+        yield os.path.abspath(photo), os.path.abspath(video), entry.get('output'), None
+
+def mux_pair(photo_path: str, video_path: str, photo_metadata: dict, output_dir: str, error: str | None,
+             motion_photo_version: int = 1) -> dict:
+    if error is not None:
+        return {'success': False, 'logs': [], 'error': error}
+    files = [{'path': photo_path, 'metadata': photo_metadata, 'type': 'photo'},
+             {'path': video_path, 'metadata': {}, 'type': 'video'}]
+    return mux_group(files, output_dir, None, motion_photo_version)
+
+def process_pairs(pair_lines, output_dir: str | None, jobs: int = 1, executor_kind: str = 'thread',
+                  heic_backend=None, motion_photo_version: int = 1):
+    """
+    Muxes explicit photo/video pairs, one JSON object per line ({"photo": ..., "video": ..., "output": ...}),
+    without grouping them. Metadata for all of them is read in one batched pass, the pairs share one worker pool,
+    and a {"type": "result"} line is written per pair, in input order.
+    """
+    pairs = list(read_pairs(pair_lines))
+    if heic_backend is not None:
+        heic_photos = [photo for photo, _, _, error in pairs if error is None and photo.lower().endswith('.heic')]
+        converted = macos_heic_to_jpg.convert_files(heic_photos, jobs, heic_backend, emit_log)
+        pairs = [(converted.get(photo) or photo, video, output, error) for photo, video, output, error in pairs]
+    
+    # Only the photos' metadata matters here: it carries the still frame's presentation timestamp
+    photos = list(dict.fromkeys(photo for photo, _, _, error in pairs if error is None))
+    metadata_stream = iter_metadata(photos)
+    records = {}
+    
+    def photo_metadata(photo_path: str) -> dict:
+        # Records arrive in input order (exiftool fallbacks a batch later), so this only reads ahead a little
+        while photo_path not in records:
+            path, record = next(metadata_stream, (photo_path, None))
+            records[path] = record
+        return records.pop(photo_path) or {}
+    
+    cancellation = Cancellation()
+    
+    def pair_tasks():
+        for photo, video, output, error in pairs:
+            if cancellation.requested:
+                # Pairs already handed out still get their sources removed and a result line
+                return
+            metadata = photo_metadata(photo) if error is None else {}
+            yield (photo, video, metadata, output or output_dir or str(Path(photo or '.').parent), error,
+                   motion_photo_version)
+    
+    succeeded = 0
+    with scheduler.make_executor(jobs, executor_kind, exiftool_pool.configure_pool, (1,)) as executor:
+        for index, ((photo, video, _, pair_output, _, _), result, error) in enumerate(
+                scheduler.run_ordered(executor, mux_pair, pair_tasks(), jobs * 4), 1):
+            cancellation.progress(f"Processing pair {index} of {len(pairs)}...", 100 * index / max(len(pairs), 1))
+            if error is not None:
+                result = {'success': False, 'logs': [], 'error': str(error)}
+            if 'metrics' in result:
+                metrics.process_metrics().merge(result['metrics'])
+            for message in result['logs']:
+                emit_log(message)
+            output = None
+            if result['success']:
+                succeeded += 1
+                output = str(get_motion_photo_path(photo, pair_output).absolute())
+                with metrics.stage('file_moves'):
+                    Path(photo).unlink(missing_ok=True)
+                    Path(video).unlink(missing_ok=True)
+            elif 'error' not in result:
+                result['error'] = result['logs'][-1] if result['logs'] else "Muxing failed"
+            emit_result(photo=photo, video=video, output=output, success=result['success'],
+                        **({'error': result['error']} if not result['success'] else {}))
+    emit_log(f"Muxed {succeeded} of {len(pairs)} pairs")
+    cancellation.raise_if_requested()
+    emit_progress("Complete!", 100)
+
+def motion_photo_paths(path: str, recurse: bool) -> list:
+    if not Path(path).is_dir():
+        return [path]
+    return [p for p in inventory.scan(path, recurse).paths() if motion_photo.is_motion_photo_name(p)]
+
+def check_motion_photos(path: str, recurse: bool, output_dir: str | None = None, extract: bool = False,
+                        jobs: int = 1, executor_kind: str = 'thread') -> int:
+    """
+    Verifies (or, with extract, splits back into photo and video) a Motion Photo or every *.MP.* in a tree,
+    in parallel, with a {"type": "result"} line per file. Returns the number that failed.
+    """
+    paths = motion_photo_paths(path, recurse)
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+    check = motion_photo.extract if extract else motion_photo.inspect
+    failed = 0
+    with scheduler.make_executor(jobs, executor_kind) as executor:
+        for index, ((file_path, *_), info, error) in enumerate(
+                scheduler.run_ordered(executor, check, ((p, output_dir) if extract else (p,) for p in paths),
+                                      jobs * 4), 1):
+            emit_progress(f"Checking Motion Photo {index} of {len(paths)}...", 100 * index / max(len(paths), 1))
+            errors = [str(error)] if error is not None else info['errors']
+            if errors:
+                failed += 1
+                emit_result(path=file_path, success=False, error='; '.join(errors))
+                continue
+            fields = {key: info[key] for key in ('format', 'version', 'video_start', 'video_size', 'xmp_offset')}
+            if extract:
+                fields.update(photo=info['photo_path'], video=info['video_path'])
+            emit_result(path=file_path, success=True, **fields)
+    verb = 'Extracted' if extract else 'Verified'
+    emit_log(f"{verb} {len(paths) - failed} of {len(paths)} Motion Photos; {failed} corrupt or mis-offset")
+    emit_progress("Complete!", 100)
+    return failed
+
+def finish_profile(profiler, profile_path: str, summary: dict):
+    profiler.disable()
+    if profile_path.endswith('.json'):
+        metrics.process_metrics().write_chrome_trace(profile_path)
+    elif profile_path:
+        profiler.dump_stats(profile_path)
+    # stderr, so the JSON protocol on stdout stays machine-readable
+    print(metrics.format_table(summary), file=sys.stderr)
+
+def shard_of(path: str, shards: int) -> int:
+    """
+    A Live Photo's photo and video share a stem, so they share a shard. The pairs that don't (a photo with a
+    _N suffix, a ContentIdentifier across different names) are left over by both shards and paired afterwards.
+    """
+    stem, _ = metadata_table.split_stem(path)
+    # Not crc32: its low bits hardly vary across IMG_0001, IMG_0002, ...
+    digest = hashlib.blake2b(stem.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shards
+
+def exit_with_parent():
+    # A shard whose parent is gone would only block on a queue nobody reads; its journal covers the rest
+    multiprocessing.connection.wait([multiprocessing.parent_process().sentinel])
+    os._exit(1)
+
+def run_shard(index: int, entries: list, directory: str, recurse: bool, output_dir: str, jobs: int,
+              executor_kind: str, use_pipeline: bool, stage_jobs: str | None, date_window: float, journal_path: str,
+              motion_photo_version: int, shard_events):
+    """
+    One --shards worker process: extracts, groups and muxes its share of the files ((path, stat) entries) and
+    hands back what it couldn't pair. Its events, from any thread, go to the parent through shard_events.
+    """
+    global _default_sink
+    _default_sink = lambda message: shard_events.put(('event', index, message))
+    threading.Thread(target=exit_with_parent, name='parent-watch', daemon=True).start()
+    try:
+        exiftool_pool.configure_pool(min(jobs, 16))
+        files = inventory.Inventory(directory, recurse)
+        for path, stat in entries:
+            files.add(path, stat)
+        leftovers = []
+        run_journal = journal.Journal(journal_path)
+        try:
+            if use_pipeline:
+                process_directory_pipeline(directory, recurse, output_dir, pipeline_limits(jobs, stage_jobs), None,
+                                           files, date_window, run_journal, motion_photo_version,
+                                           leftovers=leftovers)
+            else:
+                process_directory(directory, recurse, output_dir, False, jobs, executor_kind, None, files,
+                                  date_window, run_journal, motion_photo_version, leftovers=leftovers)
+        finally:
+            # Kept until the whole run is done: its finished Motion Photos matter to a --resume
+            run_journal.close()
+        shard_events.put(('done', index, leftovers, metrics.process_metrics().snapshot()))
+    except Exception as e:
+        shard_events.put(('failed', index, f"{type(e).__name__}: {e}"))
+
+def process_directory_sharded(directory: str, recurse: bool, output_dir: str, files: inventory.Inventory,
+                              shards: int, jobs: int, executor_kind: str = 'thread', use_pipeline: bool = False,
+                              stage_jobs: str | None = None, date_window: float = 0.0,
+                              run_journal: journal.Journal | None = None, motion_photo_version: int = 1):
+    """
+    --shards: the media files are split by a hash of their stem, and each shard is extracted, grouped and muxed
+    by a process of its own, with jobs divided between them. Whatever a shard couldn't pair, such as a photo and
+    a video with the same ContentIdentifier but different names, comes back with its metadata and is grouped
+    again here, all together, so the pairs come out as a single-process run makes them.
+    """
+    paths = files.paths(PHOTO_EXTENSIONS + VIDEO_EXTENSIONS)
+    partitions = [[] for _ in range(shards)]
+    for path in paths:
+        partitions[shard_of(path, shards)].append((path, files.get(path).stat))
+    shard_jobs = max(1, jobs // shards)
+    # Not forked: the parent has threads (the event emitter, exiftool readers) whose locks a fork would copy
+    context = multiprocessing.get_context('spawn')
+    shard_events = context.Queue()
+    workers = {
+        index: context.Process(target=run_shard, name=f'shard-{index}', args=(
+            index, entries, directory, recurse, output_dir, shard_jobs, executor_kind, use_pipeline, stage_jobs,
+            date_window, journal.shard_path(run_journal.path, index), motion_photo_version, shard_events))
+        for index, entries in enumerate(partitions) if entries
+    }
+    emit_log(f"Processing {len(paths)} files in {len(workers)} shards of {shard_jobs} jobs each")
+    progress = dict.fromkeys(workers, 0.0)
+    leftovers = []
+    failed = []
+    running = set(workers)
+    try:
+        for worker in workers.values():
+            worker.start()
+        while running:
+            try:
+                kind, index, *payload = shard_events.get(timeout=1.0)
+            except queue.Empty:
+                # A shard that returned has always reported; one that died (killed, crashed) never will
+                for index in list(running):
+                    if workers[index].exitcode not in (None, 0):
+                        running.discard(index)
+                        failed.append(f"shard {index} exited with status {workers[index].exitcode}")
+                continue
+            if kind == 'event':
+                message = payload[0]
+                if message.get('type') == 'progress':
+                    # Overall progress is the shards' weighted by their file counts, up to 90%
+                    progress[index] = message.get('percentage', 0)
+                    overall = sum(progress[i] * len(partitions[i]) for i in progress) / max(len(paths), 1)
+                    emit_progress(f"Shard {index + 1} of {len(workers)}: {message.get('message', '')}", 0.9 * overall)
+                elif message.get('type') == 'metric':
+                    emit_event(dict(message, shard=index))
+                else:
+                    emit_event(message)
+            elif kind == 'done':
+                leftovers.extend(payload[0])
+                metrics.process_metrics().merge(payload[1])
+                running.discard(index)
+            else:
+                failed.append(f"shard {index}: {payload[0]}")
+                running.discard(index)
+    finally:
+        for worker in workers.values():
+            if running and worker.is_alive():
+                worker.terminate()
+            worker.join()
+    if failed:
+        # Unpaired files may have partners in a failed shard: nothing is moved, --resume picks it up
+        raise RuntimeError(f"{len(failed)} of {len(workers)} shards failed: {'; '.join(failed)}")
+    
+    order = {path: position for position, path in enumerate(paths)}
+    leftovers.sort(key=lambda f: order.get(f['path'], len(order)))
+    emit_log(f"Reconciling {len(leftovers)} files the shards couldn't pair on their own")
+    with progress_range(90, 100):
+        process_directory(directory, recurse, output_dir, False, jobs, executor_kind, None, None, date_window,
+                          run_journal, motion_photo_version, read_files=leftovers)
+
+def run_directory(directory: str, recurse: bool, output_dir: str, jobs: int, executor_kind: str = 'thread',
+                  manifest_path: str | None = None, heic: bool = False, heic_backend=None,
+                  use_pipeline: bool = False, stage_jobs: str | None = None, date_window: float = 0.0,
+                  resume: bool = False, motion_photo_version: int = 1, dedup_mode: str | None = None,
+                  shards: int = 0):
+    journal_path = os.path.join(output_dir, journal.JOURNAL_NAME)
+    shard_journals = journal.shard_paths(journal_path)
+    finished = set()
+    if os.path.exists(journal_path) or shard_journals:
+        # Settled with or without --resume: the new journal replaces this one, and unsettled, its temp files
+        # would stay behind and the sources left by half-removed groups be moved as unmatched
+        counts = {'completed': 0, 'rolled_back': 0}
+        recovered = set()
+        for path in ([journal_path] if os.path.exists(journal_path) else []) + shard_journals:
+            recovered_outputs, recovered_counts = journal.recover(path)
+            recovered |= recovered_outputs
+            for key in counts:
+                counts[key] += recovered_counts[key]
+        if resume:
+            finished = recovered
+            emit_log(f"Resuming: {counts['completed']} interrupted groups completed, {counts['rolled_back']} "
+                     f"rolled back, {len(finished)} finished Motion Photos skipped")
+        else:
+            emit_log(f"Found the journal of an interrupted run in {output_dir}: {counts['completed']} interrupted "
+                     f"groups completed, {counts['rolled_back']} rolled back; starting over "
+                     f"(--resume also skips its {len(recovered)} finished Motion Photos)")
+    run_journal = journal.Journal(journal_path, finished)
+    # What they finished is carried in the new journal; left behind, they'd be recovered again later
+    for path in shard_journals:
+        os.unlink(path)
+    
+    # One walk of the tree, kept up to date by the renames and conversions below
+    with metrics.stage('inventory'):
+        files = inventory.scan(directory, recurse)
+    for path in files.paths():
+        # Motion Photos written into the tree being processed aren't inputs
+        if os.path.abspath(path) in finished:
+            files.remove(path)
+    if heic:
+        with metrics.stage('heic_conversion'):
+            macos_heic_to_jpg.check_directory_for_duplicates(directory, recurse, files)
+            macos_heic_to_jpg.convert_directory(directory, jobs, heic_backend, emit_log, recurse, files)
+        
+    try:
+        if shards > 1:
+            process_directory_sharded(directory, recurse, output_dir, files, shards, jobs, executor_kind,
+                                      use_pipeline, stage_jobs, date_window, run_journal, motion_photo_version)
+        elif use_pipeline:
+            process_directory_pipeline(directory, recurse, output_dir, pipeline_limits(jobs, stage_jobs),
+                                       manifest_path, files, date_window, run_journal, motion_photo_version,
+                                       dedup_mode)
+        else:
+            process_directory(directory, recurse, output_dir, heic, jobs, executor_kind, manifest_path, files,
+                              date_window, run_journal, motion_photo_version, dedup_mode)
+    except BaseException:
+        # Left in place for --resume
+        run_journal.close()
+        raise
+    run_journal.close(finished=True)
+    for path in journal.shard_paths(journal_path):
+        os.unlink(path)
+
+def watch_directory(directory: str, recurse: bool, output_dir: str, jobs: int = 1, settle_seconds: float = 2.0,
+                    orphan_seconds: float = 300.0, poll_interval: float = 1.0, polling: bool = False, stop=None,
+                    date_window: float = 0.0, motion_photo_version: int = 1):
+    """
+    Muxes Live Photos as they land in directory. A file is read once its size and mtime have held still for
+    settle_seconds; it then waits in the same kind of StreamingGrouper a --dir run uses, and its group is muxed
+    as soon as it holds a photo and a video. Files still unpaired after orphan_seconds go the unmatched way.
+    Runs until stop() returns true (or forever).
+    """
+    source = watcher.make_watcher(directory, recurse, poll_interval, polling)
+    emit_log(f"Watching {directory} for new Live Photos ({source.name})")
+    grouper = StreamingGrouper(date_window)
+    candidates = {}   # path -> ((size, mtime_ns), time it last changed)
+    pending = {}      # path -> (time it was grouped, file)
+    produced = set()  # our own outputs in the watched tree, until the change that reports them comes in
+    in_flight = {}    # future -> group files
+    root = os.path.abspath(directory)
+    
+    def expect(path: str):
+        # Outputs outside what the watcher reports would never be seen, so never dropped again
+        parent = os.path.dirname(path)
+        if parent == root or (recurse and parent.startswith(root + os.sep)):
+            produced.add(path)
+    
+    def consider(path: str):
+        path = os.path.abspath(path)
+        if path in produced:
+            # Each output lands once, with a single rename into place; after that it is an ordinary file
+            produced.discard(path)
+            return
+        if (Path(path).suffix.lower() in PHOTO_EXTENSIONS + VIDEO_EXTENSIONS
+                and not Path(path).name.startswith('.') and path not in pending):
+            candidates.setdefault(path, (None, 0.0))
+    
+    for path in inventory.scan(directory, recurse).paths():
+        consider(path)
+    
+    with scheduler.make_executor(jobs) as executor:
+        try:
+            while not (stop and stop()):
+                for path in source.changes(min(poll_interval, settle_seconds / 2)):
+                    consider(path)
+                now = time.monotonic()
+                
+                stable = []
+                for path, (key, since) in list(candidates.items()):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        del candidates[path]
+                        continue
+                    current = (stat.st_size, stat.st_mtime_ns)
+                    if current != key:
+                        candidates[path] = (current, now)
+                    elif now - since >= settle_seconds:
+                        del candidates[path]
+                        stable.append(path)
+                
+                for path, metadata in iter_metadata(stable):
+                    if metadata is None:
+                        emit_log(f"No metadata in {path}, leaving it where it is")
+                        continue
+                    file_type = 'photo' if Path(path).suffix.lower() in PHOTO_EXTENSIONS else 'video'
+                    file = {'path': path, 'metadata': metadata, 'type': file_type}
+                    pending[path] = (now, file)
+                    for _, group_files in grouper.add(file):
+                        paths = {f['path'] for f in group_files}
+                        grouper.discard(paths)
+                        for grouped in paths:
+                            pending.pop(grouped, None)
+                        expect(motion_photo_output(group_files, output_dir))
+                        in_flight[executor.submit(mux_group, group_files, output_dir, None,
+                                                  motion_photo_version)] = group_files
+                
+                for future in [f for f in in_flight if f.done()]:
+                    group_files = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                        settle_group(group_files, result, output_dir, None)
+                    except Exception as e:
+                        result = None
+                        emit_log(f"Failed to process {group_files[0]['path']}: {e}")
+                    if not (result and result['success']):
+                        # No Motion Photo landed, so no change is coming to drop it on
+                        produced.discard(motion_photo_output(group_files, output_dir))
+                
+                orphans = [file for grouped_at, file in pending.values() if now - grouped_at >= orphan_seconds]
+                for file in orphans:
+                    del pending[file['path']]
+                    grouper.discard({file['path']})
+                    dest_path, strategy = move_file(file['path'], output_dir)
+                    if str(dest_path.absolute()) != file['path']:
+                        expect(str(dest_path.absolute()))
+                    record_move(None, file['path'], dest_path, strategy, file['type'])
+        finally:
+            source.close()
+
+def motion_photo_output(group_files: list, output_dir: str) -> str:
+    return str(get_motion_photo_path(get_group_pair(group_files)[0]['path'], output_dir).absolute())
+
+def check_job(spec: dict) -> str | None:
+    if spec.get('dir'):
+        if not Path(spec['dir']).is_dir():
+            return f"not a directory: {spec['dir']}"
+    elif not isinstance(spec.get('pairs'), list):
+        return "a job needs \"dir\" or a \"pairs\" list"
+    try:
+        pipeline_limits(int(spec.get('jobs') or 1), spec.get('stage_jobs'))
+        if float(spec.get('date_window') or 0) < 0:
+            return "date_window can't be negative"
+        if int(spec.get('motion_photo_version') or 1) not in (1, 2):
+            return "motion_photo_version is 1 or 2"
+        if spec.get('dedup') not in (None, 'skip', 'hardlink'):
+            return "dedup is skip or hardlink"
+        if int(spec.get('shards') or 0) > 1 and (spec.get('manifest') or spec.get('dedup')):
+            return "shards can't be combined with manifest or dedup"
+    except (TypeError, ValueError) as e:
+        return str(e)
+    return None
+
+def run_job(spec: dict, emit):
+    """
+    Runs one --serve job, {"dir": ...} or {"pairs": [{"photo": ..., "video": ...}, ...]} plus the CLI options
+    by name (recurse, output, jobs, executor, manifest, heic, heic_backend, heic_command, pipeline, stage_jobs,
+    date_window, resume, motion_photo_version, dedup, shards). Its events go to emit instead of stdout.
+    """
+    token = _event_sink.set(emit)
+    try:
+        jobs = int(spec.get('jobs') or scheduler.default_jobs())
+        heic = bool(spec.get('heic'))
+        heic_backend = (macos_heic_to_jpg.get_backend(spec.get('heic_backend', 'auto'), spec.get('heic_command'))
+                        if heic else None)
+        output_dir = spec.get('output')
+        if output_dir:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+        version = int(spec.get('motion_photo_version') or 1)
+        if spec.get('dir'):
+            run_directory(spec['dir'], bool(spec.get('recurse')), output_dir or spec['dir'], jobs,
+                          spec.get('executor', 'thread'), spec.get('manifest'), heic, heic_backend,
+                          bool(spec.get('pipeline')), spec.get('stage_jobs'), float(spec.get('date_window') or 0),
+                          bool(spec.get('resume')), version, spec.get('dedup'), int(spec.get('shards') or 0))
+        else:
+            process_pairs((json.dumps(pair) for pair in spec['pairs']), output_dir, jobs,
+                          spec.get('executor', 'thread'), heic_backend, version)
+    finally:
+        _event_sink.reset(token)
+
+def exit_on_sigterm():
+    # A plain kill still runs the cleanup: sockets, watches and the exiftool workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+def run_served_job(spec: dict, emit):
+    """run_job for --serve, after replacing any exiftool worker that died while the server sat between jobs."""
+    pool = exiftool_pool.get_pool()
+    restarted = pool.health_check().count(False)
+    if restarted:
+        token = _event_sink.set(emit)
+        try:
+            emit_log(f"Restarted {restarted} exiftool worker(s) ({pool.spawn_count} started since launch)")
+        finally:
+            _event_sink.reset(token)
+    run_job(spec, emit)
+
+def serve(address: str, max_jobs: int):
+    job_server = server.JobServer(run_served_job, max_jobs, check_job)
+    # Perl start-up and config parsing are paid once here, not per job
+    exiftool_pool.get_pool().warm()
+    
+    def ready(httpd):
+        emit_log(f"Serving on {address} ({max_jobs} concurrent jobs)")
+    
+    exit_on_sigterm()
+    try:
+        server.serve(address, job_server, ready)
+    except KeyboardInterrupt:
+        pass
+
+@contextlib.contextmanager
+def event_output(path: str | None, progress_rate: float):
+    """Routes events through a coalescing events.Emitter, to stdout or an NDJSON file at path."""
+    global _default_sink
+    stream = open(path, 'w') if path else sys.stdout
+    emitter = events.Emitter(stream, progress_rate)
+    _default_sink = emitter.emit
+    try:
+        yield emitter
+    finally:
+        _default_sink = None
+        emitter.close()
+        if path:
+            stream.close()
 
 def main(args):
+    profiler = None
+    if args.profile is not None:
+        metrics.enable_tracing()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    
+    if args.verify or args.extract:
+        if not Path(args.verify or args.extract).exists():
+            sys.exit(1)
+        failed = check_motion_photos(args.verify or args.extract, args.recurse, args.output, bool(args.extract),
+                                     args.jobs, args.executor)
+        # Non-zero on any bad file, so a batch script can gate on it
+        if failed:
+            sys.exit(1)
+        return
+    exiftool_pool.configure_pool(min(args.jobs, 16))
+    if args.serve:
+        serve(args.serve, args.serve_jobs)
+        return
+    if args.watch:
+        if not Path(args.watch).is_dir():
+            sys.exit(1)
+        if args.output:
+            Path(args.output).mkdir(parents=True, exist_ok=True)
+        exit_on_sigterm()
+        try:
+            watch_directory(args.watch, args.recurse, args.output or args.watch, args.jobs, args.watch_settle,
+                            args.watch_timeout, polling=args.watch_polling, date_window=args.date_window,
+                            motion_photo_version=args.motion_photo_version)
+        except KeyboardInterrupt:
+            pass
+        return
+    heic_backend = macos_heic_to_jpg.get_backend(args.heic_backend, args.heic_command) if args.heic else None
     out_dir = args.output
     if out_dir:
         Path(out_dir).mkdir(parents=True, exist_ok=True)
@@ -228,11 +1563,15 @@ def main(args):
         if not has_files:
             sys.exit(1)
             
-        if args.heic:
-            macos_heic_to_jpg.check_directory_for_duplicates(args.dir, args.recurse)
-            macos_heic_to_jpg.convert_directory(args.dir)
-            
-        process_directory(args.dir, args.recurse, out_dir or args.dir, args.heic)
+        run_directory(args.dir, args.recurse, out_dir or args.dir, args.jobs, args.executor, args.manifest,
+                      args.heic, heic_backend, args.pipeline, args.stage_jobs, args.date_window, args.resume,
+                      args.motion_photo_version, args.dedup, args.shards)
+        
+    elif args.pairs:
+        if args.pairs != '-' and not Path(args.pairs).is_file():
+            sys.exit(1)
+        with contextlib.nullcontext(sys.stdin) if args.pairs == '-' else open(args.pairs) as pair_lines:
+            process_pairs(pair_lines, out_dir, args.jobs, args.executor, heic_backend, args.motion_photo_version)
         
     elif args.photo and args.video:
         if not Path(args.photo).is_file() or not Path(args.video).is_file():
@@ -240,11 +1579,16 @@ def main(args):
             
         photo_path = args.photo
         if args.heic and photo_path.lower().endswith('.heic'):
-            photo_path = macos_heic_to_jpg.convert_file(args.photo) or photo_path
+            photo_path = macos_heic_to_jpg.convert_file(args.photo, heic_backend) or photo_path
             
-        process_individual_files(photo_path, args.video, out_dir or str(Path(args.photo).parent))
+        process_individual_files(photo_path, args.video, out_dir or str(Path(args.photo).parent), args.date_window,
+                                 args.motion_photo_version)
     else:
         sys.exit(1)
+    
+    summary = emit_metrics_summary(time.perf_counter() - start)
+    if profiler:
+        finish_profile(profiler, args.profile, summary)
 
 if __name__ == '__main__':
     import argparse
@@ -255,4 +1599,44 @@ if __name__ == '__main__':
     parser.add_argument('--output', type=str)
     parser.add_argument('--recurse', action='store_true')
     parser.add_argument('--heic', action='store_true')
-    main(parser.parse_args())
\ No newline at end of file
+    parser.add_argument('--jobs', type=int, default=scheduler.default_jobs())
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--manifest', type=str)
+    parser.add_argument('--profile', nargs='?', const='', metavar='PATH')
+    parser.add_argument('--heic-backend', choices=['auto', 'sips', 'pillow-heif', 'heif-convert'], default='auto')
+    parser.add_argument('--heic-command', type=str)
+    parser.add_argument('--pairs', type=str, metavar='FILE')
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--serve', nargs='?', const=server.DEFAULT_ADDRESS, metavar='ADDRESS')
+    parser.add_argument('--serve-jobs', type=int, default=2)
+    parser.add_argument('--watch', type=str, metavar='DIR')
+    parser.add_argument('--watch-settle', type=float, default=2.0, metavar='SECONDS')
+    parser.add_argument('--watch-timeout', type=float, default=300.0, metavar='SECONDS')
+    parser.add_argument('--watch-polling', action='store_true')
+    parser.add_argument('--stage-jobs', type=str, metavar='STAGE=N,...')
+    parser.add_argument('--date-window', type=float, default=0.0, metavar='HOURS')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--motion-photo-version', type=int, choices=[1, 2], default=1)
+    parser.add_argument('--dedup', choices=['skip', 'hardlink'])
+    parser.add_argument('--progress-rate', type=float, default=events.PROGRESS_RATE, metavar='N')
+    parser.add_argument('--events-file', type=str, metavar='PATH')
+    parser.add_argument('--verify', type=str, metavar='PATH')
+    parser.add_argument('--extract', type=str, metavar='PATH')
+    parser.add_argument('--shards', type=int, default=0, metavar='N')
+    parsed_args = parser.parse_args()
+    if parsed_args.date_window < 0:
+        parser.error("--date-window can't be negative")
+    if parsed_args.serve:
+        try:
+            server.check_address(parsed_args.serve)
+        except ValueError as e:
+            parser.error(f"--serve: {e}")
+    if parsed_args.shards > 1 and (parsed_args.manifest or parsed_args.dedup):
+        # Both are sqlite files one process writes at a time, and a shard holds its write lock for long stretches
+        parser.error("--shards can't be combined with --manifest or --dedup")
+    try:
+        pipeline_limits(parsed_args.jobs, parsed_args.stage_jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    with event_output(parsed_args.events_file, parsed_args.progress_rate):
+        main(parsed_args)
\ No newline at end of file
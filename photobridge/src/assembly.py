@@ -0,0 +1,143 @@
+import errno
+import os
+
+import heif_xmp
+import jpeg_xmp
+import metrics
+
+CHUNK_SIZE = 1 << 20
+
+# Errors that mean "this syscall can't handle these two fds", not "the copy failed"
+UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF}
+
+_kernel_copy_supported = {
+    'copy_file_range': hasattr(os, 'copy_file_range'),
+    'sendfile': hasattr(os, 'sendfile'),
+}
+
+def _kernel_copy(name: str, src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    if not _kernel_copy_supported[name]:
+        return 0
+    copied = 0
+    while copied < count:
+        try:
+            if name == 'copy_file_range':
+                n = os.copy_file_range(src_fd, dst_fd, min(count - copied, 1 << 30), offset + copied)
+            else:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, min(count - copied, 1 << 30))
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS or copied:
+                raise
+            if e.errno == errno.ENOSYS:
+                _kernel_copy_supported[name] = False
+            return 0
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+def _write_all(fd: int, data) -> int:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+    return len(data)
+
+def _buffered_copy(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    copied = 0
+    while copied < count:
+        chunk = os.pread(src_fd, min(CHUNK_SIZE, count - copied), offset + copied)
+        if not chunk:
+            break
+        copied += _write_all(dst_fd, chunk)
+    return copied
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int, methods: list | None = None) -> int:
+    """
+    Appends count bytes of src (from offset) at dst's current position without buffering the payload.
+    methods, if given, collects the names of the methods that moved the bytes.
+    """
+    copied = 0
+    for name in ('copy_file_range', 'sendfile', 'stream'):
+        if copied >= count:
+            break
+        if name == 'stream':
+            moved = _buffered_copy(src_fd, dst_fd, offset + copied, count - copied)
+        else:
+            moved = _kernel_copy(name, src_fd, dst_fd, offset + copied, count - copied)
+        if moved and methods is not None:
+            methods.append(name)
+        copied += moved
+    if copied != count:
+        raise OSError(errno.EIO, f'short copy: {copied} of {count} bytes')
+    return copied
+
+def append_file(dst_fd: int, src_path: str, offset: int = 0) -> int:
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        copied = copy_range(src_fd, dst_fd, offset, os.fstat(src_fd).st_size - offset)
+    finally:
+        os.close(src_fd)
+    metrics.count('bytes_read', copied)
+    return copied
+
+def build_jpeg_header(photo_path: str, elements: list) -> tuple:
+    """Returns the tagged JPEG header and the offset in the photo where its untouched remainder starts."""
+    with open(photo_path, 'rb') as photo, metrics.stage('xmp_header'):
+        return jpeg_xmp.build_tagged_header(photo, elements)
+
+def build_heif_header(photo_path: str, elements: list) -> tuple:
+    """Same as build_jpeg_header for HEIC/HEIF: everything up to the rewritten meta box, plus the XMP item."""
+    with open(photo_path, 'rb') as photo, metrics.stage('xmp_header'):
+        return heif_xmp.build_tagged_header(photo, os.fstat(photo.fileno()).st_size, elements)
+
+def assemble_jpeg_motion_photo(photo_path: str, video_path: str, output_path: str, elements: list) -> int:
+    """
+    Writes tagged JPEG header, the untouched remainder of the photo, then the video, in one pass.
+    Returns the number of bytes written.
+    """
+    header, resume_offset = build_jpeg_header(photo_path, elements)
+    return write_motion_photo(header, photo_path, resume_offset, video_path, output_path)
+
+def assemble_heif_motion_photo(photo_path: str, video_path: str, output_path: str, elements: list) -> int:
+    """Same as assemble_jpeg_motion_photo for HEIC/HEIF: rewritten meta box, then the media data as-is."""
+    header, resume_offset = build_heif_header(photo_path, elements)
+    return write_motion_photo(header, photo_path, resume_offset, video_path, output_path)
+
+def write_motion_photo(header: bytes, photo_path: str, resume_offset: int, video_path: str, output_path: str) -> int:
+    dst_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        written = _write_all(dst_fd, header)
+        written += append_file(dst_fd, photo_path, resume_offset)
+        written += append_file(dst_fd, video_path)
+        with metrics.stage('fsync'):
+            os.fsync(dst_fd)
+    finally:
+        os.close(dst_fd)
+    metrics.count('bytes_written', written)
+    return written
+
+def append_video(output_path: str, video_path: str) -> int:
+    # Not O_APPEND: copy_file_range refuses append-mode destinations
+    dst_fd = os.open(output_path, os.O_WRONLY)
+    try:
+        os.lseek(dst_fd, 0, os.SEEK_END)
+        written = append_file(dst_fd, video_path)
+        with metrics.stage('fsync'):
+            os.fsync(dst_fd)
+    finally:
+        os.close(dst_fd)
+    metrics.count('bytes_written', written)
+    return written
+
+def fsync_directory(path: str):
+    try:
+        dir_fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
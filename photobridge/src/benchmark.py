@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import corpus
+import PhotoBridge
+
+def synthetic_entries(count: int, missing_identifier_ratio: float = 0.3, seed: int = 0) -> list:
+    """Metadata records shaped like extract_metadata_batch output, roughly half photos and half videos."""
+    rng = random.Random(seed)
+    files = []
+    pairs = count // 2
+    for i in range(pairs):
+        date = f"2024:{1 + i % 12:02d}:{1 + i % 28:02d} 10:00:00"
+        stem = f"IMG_{i:07d}"
+        if i % 17 == 0:
+            stem += "_1"
+        content_identifier = f"CID-{i:07d}"
+        photo_metadata = {'CreateDate': date, 'ContentIdentifier': content_identifier}
+        video_metadata = {'CreateDate': date}
+        if rng.random() >= missing_identifier_ratio:
+            video_metadata['ContentIdentifier'] = content_identifier
+        elif rng.random() < 0.5:
+            del photo_metadata['ContentIdentifier']
+        video_stem = stem[:-2] if stem.endswith("_1") else stem
+        files.append({'path': f"/import/{stem}.JPG", 'metadata': photo_metadata, 'type': 'photo'})
+        files.append({'path': f"/import/{video_stem}.MOV", 'metadata': video_metadata, 'type': 'video'})
+    rng.shuffle(files)
+    return files
+
+def bench_grouping(sizes: list) -> list:
+    results = []
+    for size in sizes:
+        files = synthetic_entries(size)
+        start = time.perf_counter()
+        groups = PhotoBridge.group_files_by_contentidentifier(files)
+        elapsed = time.perf_counter() - start
+        result = {
+            'stage': 'group_files_by_contentidentifier',
+            'entries': size,
+            'groups': len(groups),
+            'seconds': round(elapsed, 4),
+            'entries_per_second': round(size / max(elapsed, 1e-9)),
+        }
+        results.append(result)
+    return results
+
+def percentile(values: list, fraction: float) -> float:
+    # Nearest-rank, so p99 of a small run is an observed latency rather than an interpolation
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def stage_result(stage: str, seconds: float, items: int, unit: str, latencies: list | None = None, **extra) -> dict:
+    result = {
+        'stage': stage,
+        unit: items,
+        'seconds': round(seconds, 4),
+        f'{unit}_per_second': round(items / max(seconds, 1e-9), 1),
+    }
+    if latencies is not None:
+        result['p50_ms'] = round(percentile(latencies, 0.50) * 1000, 3)
+        result['p99_ms'] = round(percentile(latencies, 0.99) * 1000, 3)
+    result.update(extra)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def bench_extract(paths: list) -> tuple:
+    metadata_by_path = {}
+    latencies = []
+    start = last = time.perf_counter()
+    for path, record in PhotoBridge.iter_metadata(paths):
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        if record is not None:
+            metadata_by_path[path] = record
+    elapsed = time.perf_counter() - start
+    return stage_result('extract_metadata', elapsed, len(paths), 'files', latencies), metadata_by_path
+
+def bench_group(metadata_by_path: list, date_window: float = 0.0) -> tuple:
+    files = [{'path': path, 'metadata': metadata,
+              'type': 'photo' if Path(path).suffix.lower() in PhotoBridge.PHOTO_EXTENSIONS else 'video'}
+             for path, metadata in metadata_by_path.items()]
+    start = time.perf_counter()
+    groups = PhotoBridge.group_files_by_contentidentifier(files, date_window)
+    elapsed = time.perf_counter() - start
+    pairs = [PhotoBridge.get_group_pair(group_files) for key, group_files in groups.items() if key != 'unmatched_videos']
+    pairs = [(photo, video) for photo, video in pairs if photo is not None]
+    return stage_result('group_files_by_contentidentifier', elapsed, len(files), 'files', groups=len(groups),
+                        pairs=len(pairs)), pairs
+
+def bench_mux(pairs: list, output_dir: str) -> dict:
+    latencies = []
+    failures = 0
+    total_bytes = 0
+    start = time.perf_counter()
+    for photo, video in pairs:
+        began = time.perf_counter()
+        if not PhotoBridge.create_motion_photo(photo['path'], video['path'], photo['metadata'], output_dir,
+                                               log=lambda message: None):
+            failures += 1
+        latencies.append(time.perf_counter() - began)
+        total_bytes += os.path.getsize(photo['path']) + os.path.getsize(video['path'])
+    elapsed = time.perf_counter() - start
+    return stage_result('create_motion_photo', elapsed, len(pairs), 'pairs', latencies, failures=failures,
+                        mb_per_second=round(total_bytes / (1 << 20) / max(elapsed, 1e-9), 1))
+
+def bench_end_to_end(corpus_dir: str, output_dir: str, pairs: int, jobs: int, date_window: float = 0.0) -> dict:
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        PhotoBridge.process_directory(corpus_dir, False, output_dir, False, jobs, date_window=date_window)
+    elapsed = time.perf_counter() - start
+    produced = sum(1 for name in os.listdir(output_dir) if '.MP.' in name)
+    return stage_result('end_to_end', elapsed, pairs, 'pairs', jobs=jobs, motion_photos=produced)
+
+def bench_pipeline(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='photobridge-bench-', dir=args.workdir)
+    try:
+        corpus_dir = os.path.join(workdir, 'corpus')
+        start = time.perf_counter()
+        written = corpus.generate_corpus(corpus_dir, args.pairs, args.photo_format, args.photo_size, args.video_size,
+                                         args.missing_identifier_ratio, args.rollover_ratio, args.seed)
+        generated = time.perf_counter() - start
+        paths = sorted(PhotoBridge.iter_media_paths(corpus_dir))
+
+        stages = []
+        extract, metadata_by_path = bench_extract(paths)
+        stages.append(extract)
+        group, pairs = bench_group(metadata_by_path, args.date_window)
+        stages.append(group)
+        mux_dir = os.path.join(workdir, 'mux')
+        os.makedirs(mux_dir)
+        stages.append(bench_mux(pairs, mux_dir))
+
+        # End to end consumes its input, so it runs on a fresh copy
+        e2e_dir = os.path.join(workdir, 'e2e')
+        e2e_output = os.path.join(workdir, 'e2e-output')
+        shutil.copytree(corpus_dir, e2e_dir)
+        os.makedirs(e2e_output)
+        stages.append(bench_end_to_end(e2e_dir, e2e_output, args.pairs, args.jobs, args.date_window))
+        return {
+            'corpus': {
+                'pairs': len(written),
+                # corpus.py rolls a video an hour past its photo's midnight
+                'expected_pairs': sum(w['expect_pair'] or args.date_window >= 1 for w in written),
+                'photo_format': args.photo_format,
+                'photo_size': args.photo_size,
+                'video_size': args.video_size,
+                'missing_identifier_ratio': args.missing_identifier_ratio,
+                'rollover_ratio': args.rollover_ratio,
+                'date_window': args.date_window,
+                'seed': args.seed,
+                'generate_seconds': round(generated, 3),
+            },
+            'stages': stages,
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on a synthetic Live Photo corpus')
+    parser.add_argument('--pairs', type=int, default=200)
+    parser.add_argument('--photo-format', choices=['jpeg', 'heic', 'mixed'], default='jpeg')
+    parser.add_argument('--photo-size', type=int, default=2_000_000)
+    parser.add_argument('--video-size', type=int, default=3_000_000)
+    parser.add_argument('--missing-identifier-ratio', type=float, default=0.1)
+    parser.add_argument('--rollover-ratio', type=float, default=0.02)
+    parser.add_argument('--date-window', type=float, default=0.0, help='--date-window (hours) for grouping')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1, help='--jobs for the end-to-end run')
+    parser.add_argument('--workdir', type=str, help='where the corpus is written (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='keep the corpus and outputs')
+    parser.add_argument('--sizes', type=int, nargs='+', help='also time grouping alone on this many synthetic records')
+    parser.add_argument('--output', type=str, help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = bench_pipeline(args)
+    if args.sizes:
+        report['grouping_scaling'] = bench_grouping(args.sizes)
+    report['python'] = sys.version.split()[0]
+    report['platform'] = sys.platform
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,189 @@
+import argparse
+import datetime
+import json
+import os
+import plistlib
+import random
+import struct
+import sys
+
+import isobmff
+from native_metadata import QUICKTIME_EPOCH_OFFSET
+
+# Baseline JPEG (8x8 grey) cut into what goes before and after the entropy-coded data
+JPEG_HEAD = bytes.fromhex(
+    'ffd8ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c'
+    '30313434341f27393d38323c2e333432ffc0000b080008000801011100ffc4001f0000010501010101010100000000000000000102030405'
+    '060708090a0bffc400b5100002010303020403050504040000017d01020300041105122131410613516107227114328191a1082342b1c115'
+    '52d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a535455565758595a636465666768696a73747576'
+    '7778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9'
+    'dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00'
+)
+JPEG_TAIL = bytes.fromhex('fbd3ffd9')
+
+CONTENT_IDENTIFIER_KEY = b'com.apple.quicktime.content.identifier'
+CREATION_DATE_KEY = b'com.apple.quicktime.creationdate'
+MAKE_KEY = b'com.apple.quicktime.make'
+MODEL_KEY = b'com.apple.quicktime.model'
+
+def _ifd(entries: list, start: int) -> bytes:
+    """TIFF IFD at offset start from (tag, type, count, value bytes), with out-of-line values right behind it."""
+    entries = sorted(entries)
+    out = struct.pack('>H', len(entries))
+    tail = b''
+    tail_start = start + 2 + 12 * len(entries) + 4
+    for tag, value_type, count, value in entries:
+        if len(value) <= 4:
+            out += struct.pack('>HHI', tag, value_type, count) + value.ljust(4, b'\x00')
+        else:
+            out += struct.pack('>HHII', tag, value_type, count, tail_start + len(tail))
+            tail += value + (b'\x00' if len(value) % 2 else b'')
+    return out + b'\x00\x00\x00\x00' + tail
+
+def _ascii(tag: int, text: str) -> tuple:
+    value = text.encode('ascii') + b'\x00'
+    return (tag, 2, len(value), value)
+
+def apple_makernote(content_identifier: str | None, video_index: int, run_time_scale: int) -> bytes:
+    run_time = plistlib.dumps({'flags': 1, 'value': 52843000000000, 'timescale': run_time_scale, 'epoch': 0},
+                              fmt=plistlib.FMT_BINARY)
+    entries = [(0x0001, 9, 1, struct.pack('>i', 14)), (0x0003, 7, len(run_time), run_time),
+               (0x0017, 9, 1, struct.pack('>i', video_index))]
+    if content_identifier:
+        entries.append(_ascii(0x0011, content_identifier))
+    # Offsets in the Apple MakerNote are relative to its own start
+    header = b'Apple iOS\x00' + b'\x00\x01' + b'MM'
+    return header + _ifd(entries, len(header))
+
+def exif_tiff(create_date: str, content_identifier: str | None, video_index: int, run_time_scale: int,
+              model: str = 'iPhone 15 Pro') -> bytes:
+    maker_note = apple_makernote(content_identifier, video_index, run_time_scale)
+    ifd0_entries = [_ascii(0x010F, 'Apple'), _ascii(0x0110, model), _ascii(0x0131, '17.4'),
+                    (0x8769, 4, 1, b'\x00\x00\x00\x00')]
+    ifd0 = _ifd(ifd0_entries, 8)
+    exif_offset = 8 + len(ifd0)
+    ifd0_entries[-1] = (0x8769, 4, 1, struct.pack('>I', exif_offset))
+    ifd0 = _ifd(ifd0_entries, 8)
+    exif_ifd = _ifd([_ascii(0x9003, create_date), _ascii(0x9004, create_date), _ascii(0x9010, '-07:00'),
+                     (0x927C, 7, len(maker_note), maker_note)], exif_offset)
+    return b'MM\x00*' + struct.pack('>I', 8) + ifd0 + exif_ifd
+
+def make_jpeg(create_date: str, content_identifier: str | None, video_index: int = 0,
+              run_time_scale: int = 1000000000, size: int = 0, rng: random.Random | None = None) -> bytes:
+    exif = b'Exif\x00\x00' + exif_tiff(create_date, content_identifier, video_index, run_time_scale)
+    app1 = b'\xFF\xE1' + struct.pack('>H', len(exif) + 2) + exif
+    # Scan data stands in for the compressed image; 0xFF is avoided so it can't look like a marker
+    scan_size = max(size - len(JPEG_HEAD) - len(app1) - len(JPEG_TAIL), 0)
+    scan = (rng or random).randbytes(scan_size).replace(b'\xFF', b'\xFE')
+    return JPEG_HEAD[:2] + app1 + JPEG_HEAD[2:] + scan + JPEG_TAIL
+
+def make_heic(create_date: str, content_identifier: str | None, video_index: int = 0,
+              run_time_scale: int = 1000000000, size: int = 0, rng: random.Random | None = None) -> bytes:
+    exif = b'\x00\x00\x00\x06' + b'Exif\x00\x00' + exif_tiff(create_date, content_identifier, video_index,
+                                                             run_time_scale)
+    image = (rng or random).randbytes(max(size - len(exif) - 600, 16))
+    ftyp = isobmff.make_box(b'ftyp', b'heic' + b'\x00\x00\x00\x00' + b'mif1MiHEmiafheic')
+    iinf = isobmff.make_full_box(b'iinf', 0, 0, struct.pack('>H', 2)
+                                 + isobmff.build_infe(isobmff.ItemInfo(1, b'hvc1'))
+                                 + isobmff.build_infe(isobmff.ItemInfo(2, b'Exif')))
+    boxes = (isobmff.make_full_box(b'hdlr', 0, 0, b'\x00' * 4 + b'pict' + b'\x00' * 13)
+             + isobmff.make_full_box(b'pitm', 0, 0, struct.pack('>H', 1)))
+    trailer = (iinf + isobmff.make_full_box(b'iref', 0, 0, isobmff.make_box(b'cdsc', struct.pack('>HHH', 2, 1, 1)))
+               + isobmff.make_box(b'iprp', isobmff.make_box(b'ipco', isobmff.make_full_box(
+                   b'ispe', 0, 0, struct.pack('>II', 4032, 3024)))
+                   + isobmff.make_full_box(b'ipma', 0, 0, struct.pack('>IHBB', 1, 1, 1, 0x81))))
+
+    def meta(data_start: int) -> bytes:
+        iloc = isobmff.build_iloc(isobmff.ItemLocationTable(1, 4, 4, 0, 0, [
+            isobmff.ItemLocation(1, extents=[(0, data_start, len(image))]),
+            isobmff.ItemLocation(2, extents=[(0, data_start + len(image), len(exif))]),
+        ]))
+        return isobmff.make_full_box(b'meta', 0, 0, boxes + iloc + trailer)
+
+    # The meta size doesn't depend on the offsets it stores (fixed 4-byte fields), so one sizing pass is enough
+    data_start = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(data_start) + isobmff.make_box(b'mdat', image + exif)
+
+def _mdta_metadata(values: list) -> bytes:
+    keys = b''.join(isobmff.make_box(b'mdta', key) for key, _ in values)
+    items = b''.join(
+        isobmff.make_box(struct.pack('>I', index), isobmff.make_box(b'data', struct.pack('>II', 1, 0) + value.encode()))
+        for index, (_, value) in enumerate(values, start=1))
+    return isobmff.make_box(b'meta', isobmff.make_full_box(b'hdlr', 0, 0, b'\x00' * 4 + b'mdta' + b'\x00' * 13)
+                            + isobmff.make_full_box(b'keys', 0, 0, struct.pack('>I', len(values)) + keys)
+                            + isobmff.make_box(b'ilst', items))
+
+def make_mov(create_date: str, content_identifier: str | None, size: int = 0,
+             rng: random.Random | None = None) -> bytes:
+    moment = datetime.datetime.strptime(create_date, '%Y:%m:%d %H:%M:%S')
+    seconds = int((moment - datetime.datetime(1970, 1, 1)).total_seconds()) + QUICKTIME_EPOCH_OFFSET
+    mvhd = isobmff.make_full_box(b'mvhd', 0, 0, struct.pack('>IIII', seconds, seconds, 600, 1800)
+                                 + struct.pack('>IH', 0x10000, 0x100) + b'\x00' * 10
+                                 + struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+                                 + b'\x00' * 24 + struct.pack('>I', 3))
+    values = [(MAKE_KEY, 'Apple'), (MODEL_KEY, 'iPhone 15 Pro'),
+              (CREATION_DATE_KEY, moment.strftime('%Y-%m-%dT%H:%M:%S-0700'))]
+    if content_identifier:
+        values.append((CONTENT_IDENTIFIER_KEY, content_identifier))
+    head = isobmff.make_box(b'ftyp', b'qt  ' + b'\x00\x00\x00\x00' + b'qt  ')
+    head += isobmff.make_box(b'wide', b'') + isobmff.make_box(b'moov', mvhd + _mdta_metadata(values))
+    return head + isobmff.make_box(b'mdat', (rng or random).randbytes(max(size - len(head) - 8, 0)))
+
+def generate_corpus(directory: str, pairs: int, photo_format: str = 'jpeg', photo_size: int = 2_000_000,
+                    video_size: int = 3_000_000, missing_identifier_ratio: float = 0.1,
+                    rollover_ratio: float = 0.02, seed: int = 0) -> list:
+    """
+    Writes IMG_nnnn photo + MOV pairs shaped like an Image Capture import and returns what was written.
+    A missing_identifier_ratio share of videos has no ContentIdentifier (paired by name and date instead);
+    a rollover_ratio share of those also has its date pushed past midnight, which only a date window pairs up.
+    photo_format is 'jpeg', 'heic' or 'mixed'.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    start = datetime.datetime(2024, 6, 1, 9, 0, 0)
+    written = []
+    for i in range(pairs):
+        taken = start + datetime.timedelta(minutes=7 * i)
+        photo_date = taken.strftime('%Y:%m:%d %H:%M:%S')
+        video_date = photo_date
+        content_identifier = f'{rng.getrandbits(128):032X}'
+        video_identifier = content_identifier
+        expect_pair = True
+        if rng.random() < missing_identifier_ratio:
+            video_identifier = None
+            if rng.random() < rollover_ratio / max(missing_identifier_ratio, 1e-9):
+                video_date = (taken.replace(hour=23, minute=59) + datetime.timedelta(hours=1)).strftime(
+                    '%Y:%m:%d %H:%M:%S')
+                photo_date = taken.replace(hour=23, minute=59).strftime('%Y:%m:%d %H:%M:%S')
+                expect_pair = False
+
+        extension = photo_format if photo_format != 'mixed' else rng.choice(['jpeg', 'heic'])
+        make_photo = make_heic if extension == 'heic' else make_jpeg
+        photo_path = os.path.join(directory, f'IMG_{i:04d}.{"HEIC" if extension == "heic" else "JPG"}')
+        video_path = os.path.join(directory, f'IMG_{i:04d}.MOV')
+        video_index = rng.randrange(500_000_000, 2_000_000_000)
+        with open(photo_path, 'wb') as f:
+            f.write(make_photo(photo_date, content_identifier, video_index, 1000000000, photo_size, rng))
+        with open(video_path, 'wb') as f:
+            f.write(make_mov(video_date, video_identifier, video_size, rng))
+        written.append({'photo': photo_path, 'video': video_path, 'content_identifier': content_identifier,
+                        'video_has_identifier': video_identifier is not None, 'expect_pair': expect_pair})
+    return written
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description='Write a synthetic Live Photo corpus')
+    parser.add_argument('directory')
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--photo-format', choices=['jpeg', 'heic', 'mixed'], default='jpeg')
+    parser.add_argument('--photo-size', type=int, default=2_000_000)
+    parser.add_argument('--video-size', type=int, default=3_000_000)
+    parser.add_argument('--missing-identifier-ratio', type=float, default=0.1)
+    parser.add_argument('--rollover-ratio', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    written = generate_corpus(args.directory, args.pairs, args.photo_format, args.photo_size, args.video_size,
+                              args.missing_identifier_ratio, args.rollover_ratio, args.seed)
+    print(json.dumps({'pairs': len(written), 'expected_pairs': sum(w['expect_pair'] for w in written)}))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import manifest
+import metrics
+
+INDEX_NAME = '.photobridge-dedup'
+SAMPLE_SIZE = 64 * 1024
+CHUNK_SIZE = 1 << 20
+DIGEST_SIZE = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (
+    output_path TEXT PRIMARY KEY,
+    output_size INTEGER NOT NULL,
+    output_mtime_ns INTEGER NOT NULL,
+    output_inode INTEGER NOT NULL,
+    pair_key TEXT NOT NULL,
+    photo_hash TEXT NOT NULL,
+    video_hash TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pairs_by_key ON pairs (pair_key);
+"""
+
+def sample_hash(path: str) -> str:
+    """BLAKE2b of the size and three SAMPLE_SIZE chunks (start, middle, end): cheap, and only a candidate match."""
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(size.to_bytes(8, 'little'))
+        for offset in sorted({0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)}):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+    metrics.count('dedup_bytes_hashed', min(size, 3 * SAMPLE_SIZE))
+    return digest.hexdigest()
+
+def full_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+            metrics.count('dedup_bytes_hashed', len(chunk))
+    return digest.hexdigest()
+
+def pair_key(photo_path: str, video_path: str, content_identifier: str | None) -> str:
+    return f"{sample_hash(photo_path)}:{sample_hash(video_path)}:{content_identifier or ''}"
+
+def full_hashes(photo_path: str, video_path: str) -> tuple:
+    return full_hash(photo_path), full_hash(video_path)
+
+def fingerprint(photo_path: str, video_path: str, content_identifier: str | None) -> dict:
+    """Everything the index stores about a pair; run where the pair was just read, so the bytes are cached."""
+    photo_hash, video_hash = full_hashes(photo_path, video_path)
+    return {'pair_key': pair_key(photo_path, video_path, content_identifier),
+            'photo_hash': photo_hash, 'video_hash': video_hash}
+
+class DedupIndex:
+    """Motion Photos already made, by the content of the photo and video they came from, wherever those were."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.counts = {'hits': 0, 'rejected': 0, 'stale': 0, 'recorded': 0}
+
+    def candidates(self, key: str) -> list:
+        """(output_path, photo_hash, video_hash) for every Motion Photo on record with this key that's unchanged."""
+        rows = self.db.execute(
+            "SELECT output_path, output_size, output_mtime_ns, output_inode, photo_hash, video_hash FROM pairs "
+            "WHERE pair_key = ?", (key,)
+        ).fetchall()
+        found = []
+        for output_path, size, mtime_ns, inode, photo_hash, video_hash in rows:
+            try:
+                unchanged = manifest.file_key(os.stat(output_path)) == (size, mtime_ns, inode)
+            except OSError:
+                unchanged = False
+            if unchanged:
+                found.append((output_path, photo_hash, video_hash))
+            else:
+                self.counts['stale'] += 1
+                self.db.execute("DELETE FROM pairs WHERE output_path = ?", (output_path,))
+        return found
+
+    def confirm(self, candidates: list, hashes: tuple) -> str | None:
+        """The candidate whose inputs had these full (photo, video) hashes; sampled hashes alone can collide."""
+        for output_path, photo_hash, video_hash in candidates:
+            if (photo_hash, video_hash) == hashes:
+                self.counts['hits'] += 1
+                return output_path
+        self.counts['rejected'] += 1
+        return None
+
+    def find(self, photo_path: str, video_path: str, content_identifier: str | None) -> str | None:
+        """The Motion Photo made from byte-identical inputs, if there is one."""
+        candidates = self.candidates(pair_key(photo_path, video_path, content_identifier))
+        if not candidates:
+            return None
+        return self.confirm(candidates, full_hashes(photo_path, video_path))
+
+    def record(self, output_path: str, fingerprint: dict):
+        self.db.execute(
+            "INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(output_path), *manifest.file_key(os.stat(output_path)), fingerprint['pair_key'],
+             fingerprint['photo_hash'], fingerprint['video_hash'], time.time()),
+        )
+        self.counts['recorded'] += 1
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+
+PROGRESS_RATE = 10.0
+FLUSH_SECONDS = 0.1
+BATCH_LINES = 256
+
+class Emitter:
+    """
+    The event stream on its way to stdout (or a file), in the same one-JSON-object-per-line schema. Progress
+    events are coalesced to at most progress_rate a second: a newer one replaces one still waiting, and one
+    at 100% always goes out. Everything else is kept, in order, and written in batches: when BATCH_LINES are
+    waiting or, from a background thread, every flush_seconds, so a quiet run still shows its last lines.
+    progress_rate 0 writes every event as it comes, as print used to.
+    """
+
+    def __init__(self, stream, progress_rate: float = PROGRESS_RATE, flush_seconds: float = FLUSH_SECONDS):
+        self.stream = stream
+        self.progress_interval = 1 / progress_rate if progress_rate > 0 else 0.0
+        self.immediate = progress_rate <= 0
+        self.lock = threading.Lock()
+        self.lines = []
+        self.waiting_progress = None
+        self.last_progress = float('-inf')
+        self.counts = {'events': 0, 'progress_coalesced': 0, 'lines': 0, 'writes': 0}
+        self.closed = threading.Event()
+        self.thread = None
+        if not self.immediate:
+            self.thread = threading.Thread(target=self._flush_every, args=(flush_seconds,), name='events',
+                                           daemon=True)
+            self.thread.start()
+
+    def emit(self, message: dict):
+        with self.lock:
+            self.counts['events'] += 1
+            if message.get('type') == 'progress':
+                if self.waiting_progress is not None:
+                    self.counts['progress_coalesced'] += 1
+                    self.waiting_progress = None
+                now = time.monotonic()
+                if now - self.last_progress < self.progress_interval and message.get('percentage', 0) < 100:
+                    self.waiting_progress = message
+                    return
+                self.last_progress = now
+            self.lines.append(json.dumps(message))
+            if self.immediate or len(self.lines) >= BATCH_LINES:
+                self._write()
+
+    def _release_progress(self, force: bool = False):
+        if self.waiting_progress is not None and (
+                force or time.monotonic() - self.last_progress >= self.progress_interval):
+            self.lines.append(json.dumps(self.waiting_progress))
+            self.waiting_progress = None
+            self.last_progress = time.monotonic()
+
+    def _write(self):
+        if not self.lines:
+            return
+        self.stream.write('\n'.join(self.lines) + '\n')
+        self.stream.flush()
+        self.counts['lines'] += len(self.lines)
+        self.counts['writes'] += 1
+        self.lines.clear()
+
+    def _flush_every(self, seconds: float):
+        while not self.closed.wait(seconds):
+            with self.lock:
+                self._release_progress()
+                self._write()
+
+    def flush(self):
+        with self.lock:
+            self._release_progress(force=True)
+            self._write()
+
+    def close(self) -> dict:
+        """Writes what is left and a closing {"type": "metric", "name": "events"} line with the counts."""
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self._release_progress(force=True)
+            summary = dict(self.counts, lines=self.counts['lines'] + len(self.lines) + 1,
+                           writes=self.counts['writes'] + 1)
+            self.lines.append(json.dumps({'type': 'metric', 'name': 'events', **summary}))
+            self._write()
+        return summary
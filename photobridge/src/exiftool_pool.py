@@ -0,0 +1,216 @@
+import atexit
+import itertools
+import os
+import queue
+import selectors
+import subprocess
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import metrics
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+EXIFTOOL_PATH = SCRIPT_DIR.parent / 'exiftool' / 'exiftool'
+CONFIG_PATH = SCRIPT_DIR.parent / 'exiftool' / 'google_camera.config'
+
+@dataclass
+class ExifToolResult:
+    returncode: int
+    stdout: str
+    stderr: str
+
+class ExifToolError(Exception):
+    pass
+
+class ExifToolWorker:
+    """One long-lived `exiftool -stay_open True -@ -` process with the config loaded once."""
+
+    def __init__(self, exiftool_path: Path = EXIFTOOL_PATH, config_path: Path | None = CONFIG_PATH):
+        self.exiftool_path = exiftool_path
+        self.config_path = config_path
+        self.process = None
+        self.spawn_count = 0
+        self._sequence = itertools.count(1)
+
+    def start(self):
+        command = [str(self.exiftool_path)]
+        if self.config_path:
+            command += ['-config', str(self.config_path)]
+        command += ['-stay_open', 'True', '-@', '-']
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self.spawn_count += 1
+        metrics.count('exiftool_spawns')
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def health_check(self) -> bool:
+        if not self.is_alive():
+            return False
+        try:
+            return self.execute(['-ver']).returncode == 0
+        except ExifToolError:
+            return False
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def execute(self, args: list) -> ExifToolResult:
+        lines = [str(arg) for arg in args]
+        if any('\n' in line for line in lines):
+            raise ValueError('exiftool arguments cannot contain newlines')
+        if not self.is_alive():
+            self.start()
+
+        n = next(self._sequence)
+        stdout_sentinel = f'{{ready{n}}}'.encode()
+        stderr_sentinel = f'{{status{n}}}'.encode()
+        lines += ['-echo4', f'${{status}}{{status{n}}}', f'-execute{n}']
+
+        try:
+            self.process.stdin.write(('\n'.join(lines) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+            stdout, stderr = self._read_until(stdout_sentinel, stderr_sentinel)
+        except (OSError, ValueError) as e:
+            self.stop()
+            raise ExifToolError(f'exiftool worker failed: {e}') from e
+
+        stderr, _, status = stderr[:-len(stderr_sentinel)].rpartition(b'\n')
+        if not status.strip().isdigit():
+            stderr, status = stderr + status, b'1'
+        return ExifToolResult(
+            returncode=int(status),
+            stdout=stdout[:-len(stdout_sentinel)].decode('utf-8', errors='replace'),
+            stderr=stderr.decode('utf-8', errors='replace'),
+        )
+
+    def _read_until(self, stdout_sentinel: bytes, stderr_sentinel: bytes) -> tuple:
+        buffers = {self.process.stdout: bytearray(), self.process.stderr: bytearray()}
+        sentinels = {self.process.stdout: stdout_sentinel + b'\n', self.process.stderr: stderr_sentinel + b'\n'}
+        pending = set(buffers)
+        with selectors.DefaultSelector() as selector:
+            for stream in buffers:
+                selector.register(stream, selectors.EVENT_READ)
+            while pending:
+                for key, _ in selector.select():
+                    stream = key.fileobj
+                    chunk = os.read(stream.fileno(), 65536)
+                    if not chunk:
+                        raise OSError('exiftool exited unexpectedly')
+                    buffers[stream] += chunk
+                    if buffers[stream].endswith(sentinels[stream]):
+                        pending.discard(stream)
+                        selector.unregister(stream)
+        stdout = bytes(buffers[self.process.stdout])[:-1]
+        stderr = bytes(buffers[self.process.stderr])[:-1]
+        return stdout, stderr
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write(b'-stay_open\nFalse\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        finally:
+            for stream in (self.process.stdin, self.process.stdout, self.process.stderr):
+                stream.close()
+            self.process = None
+
+class ExifToolPool:
+    """A bounded set of warm exiftool workers shared by every metadata read and write."""
+
+    def __init__(self, size: int | None = None, exiftool_path: Path = EXIFTOOL_PATH,
+                 config_path: Path | None = CONFIG_PATH):
+        self.size = size or min(4, os.cpu_count() or 1)
+        self.workers = [ExifToolWorker(exiftool_path, config_path) for _ in range(self.size)]
+        self._idle = queue.LifoQueue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self._closed = False
+
+    def execute(self, args: list) -> ExifToolResult:
+        if self._closed:
+            raise ExifToolError('exiftool pool is closed')
+        worker = self._idle.get()
+        try:
+            try:
+                return worker.execute(args)
+            except ExifToolError:
+                # A crashed worker gets one fresh process before the job is reported as failed
+                worker.restart()
+                return worker.execute(args)
+        finally:
+            self._idle.put(worker)
+
+    def health_check(self) -> list:
+        """Replaces workers that died or stopped answering; one bool per worker, False where it was restarted."""
+        workers = [self._idle.get() for _ in self.workers]
+        results = []
+        try:
+            for worker in workers:
+                # A worker never started is left for its first job to start
+                healthy = worker.process is None or worker.health_check()
+                if not healthy:
+                    worker.restart()
+                results.append(healthy)
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+        return results
+
+    def warm(self):
+        """Starts every worker now instead of on first use, for long-running callers such as --serve."""
+        workers = [self._idle.get() for _ in self.workers]
+        try:
+            for worker in workers:
+                if not worker.is_alive():
+                    worker.start()
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    @property
+    def spawn_count(self) -> int:
+        return sum(worker.spawn_count for worker in self.workers)
+
+    def close(self):
+        self._closed = True
+        for worker in self.workers:
+            worker.stop()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ExifToolPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExifToolPool()
+            atexit.register(_pool.close)
+        return _pool
+
+def configure_pool(size: int):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ExifToolPool(size)
+        atexit.register(_pool.close)
+
+def _forget_inherited_pool():
+    # A forked child must not talk to the parent's exiftool pipes
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_inherited_pool)
@@ -0,0 +1,135 @@
+import struct
+
+import isobmff
+import xmp
+
+XMP_CONTENT_TYPE = 'application/rdf+xml'
+
+# Top-level boxes holding absolute file offsets other than iloc's, which this editor doesn't rewrite
+UNSUPPORTED_TOP_LEVEL = {b'moov', b'moof'}
+
+def _children(payload: bytes, start: int) -> list:
+    """[(type, box start, payload start, end)] for the boxes of an in-memory payload."""
+    children = []
+    box_start = start
+    for box_type, payload_start, end in isobmff.iter_payload_boxes(payload, start):
+        children.append((box_type, box_start, payload_start, end))
+        box_start = end
+    return children
+
+def _is_xmp_item(item: isobmff.ItemInfo) -> bool:
+    return item.item_type == b'mime' and item.content_type == XMP_CONTENT_TYPE
+
+def _add_infe(iinf: bytes, item: isobmff.ItemInfo) -> bytes:
+    version = iinf[0]
+    count_size = 2 if version == 0 else 4
+    count = int.from_bytes(iinf[4:4 + count_size], 'big') + 1
+    if count > 0xFFFF:
+        version = 1
+    entries = iinf[4 + count_size:]
+    count_bytes = count.to_bytes(2 if version == 0 else 4, 'big')
+    return isobmff.make_full_box(b'iinf', version, 0, count_bytes + entries + isobmff.build_infe(item))
+
+def _add_reference(iref: bytes | None, reference_type: bytes, from_id: int, to_id: int) -> bytes:
+    version = iref[0] if iref else 0
+    entries = iref[4:] if iref else b''
+    if version == 0 and max(from_id, to_id) > 0xFFFF:
+        # Widen every existing reference to 32-bit item IDs
+        widened = b''
+        for box_type, start, end in isobmff.iter_payload_boxes(entries):
+            from_item, count = struct.unpack_from('>HH', entries, start)
+            to_items = struct.unpack_from(f'>{count}H', entries, start + 4)
+            widened += isobmff.make_box(box_type, struct.pack(f'>IH{count}I', from_item, count, *to_items))
+        entries = widened
+        version = 1
+    id_format = 'H' if version == 0 else 'I'
+    reference = isobmff.make_box(reference_type, struct.pack(f'>{id_format}H{id_format}', from_id, 1, to_id))
+    return isobmff.make_full_box(b'iref', version, 0, entries + reference)
+
+def _primary_item(pitm: bytes) -> int:
+    return struct.unpack_from('>H' if pitm[0] == 0 else '>I', pitm, 4)[0]
+
+def _shift_locations(locations: list, boundary: int, delta: int) -> list:
+    # Everything stored in the file at or after the old meta end moves by delta
+    shifted = []
+    for loc in locations:
+        extents = loc.extents
+        if loc.construction_method == 0 and loc.data_reference_index == 0:
+            extents = [(index, offset + delta if loc.base_offset + offset >= boundary else offset, length)
+                       for index, offset, length in extents]
+        shifted.append(isobmff.ItemLocation(loc.item_id, loc.construction_method, loc.data_reference_index,
+                                            loc.base_offset, extents))
+    return shifted
+
+def build_tagged_header(f, file_size: int, elements: list) -> tuple:
+    """
+    Returns (header, resume_offset): everything up to the meta box, a rewritten meta carrying the merged XMP
+    item, and an mdat with the XMP packet. The original bytes from resume_offset on follow unchanged.
+    """
+    boxes = list(isobmff.iter_boxes(f, 0, file_size))
+    if not boxes or boxes[0].type != b'ftyp':
+        raise ValueError('Not an ISO-BMFF file (missing ftyp box)')
+    meta = next((box for box in boxes if box.type == b'meta'), None)
+    if meta is None:
+        raise ValueError('HEIF file without meta box')
+    for box in boxes:
+        if box.type in UNSUPPORTED_TOP_LEVEL:
+            raise ValueError(f'HEIF files with a {box.type.decode("latin-1")} box are not supported')
+        if box.type == b'mdat' and box.offset < meta.offset:
+            raise ValueError('HEIF files with media data before the meta box are not supported')
+
+    payload = isobmff.read_payload(f, meta)
+    children = _children(payload, 4)
+    raw = {box_type: payload[payload_start:end] for box_type, _, payload_start, end in children}
+    if b'iinf' not in raw or b'iloc' not in raw or b'pitm' not in raw:
+        raise ValueError('HEIF meta box without iinf, iloc or pitm')
+    items = isobmff.parse_iinf(raw[b'iinf'])
+    table = isobmff.parse_iloc(raw[b'iloc'])
+    locations = {loc.item_id: loc for loc in table.items}
+
+    existing = next((item for item in items if _is_xmp_item(item)), None)
+    root = xmp.empty_packet()
+    if existing is not None and existing.item_id in locations:
+        root = xmp.parse_packet(isobmff.read_item(f, locations[existing.item_id], raw.get(b'idat', b'')))
+    packet, _, _ = xmp.serialize_packet(xmp.merge_properties(root, elements))
+
+    if existing is not None:
+        xmp_id = existing.item_id
+        new_boxes = {}
+    else:
+        xmp_id = max([item.item_id for item in items] + [loc.item_id for loc in table.items]) + 1
+        new_boxes = {
+            b'iinf': _add_infe(raw[b'iinf'], isobmff.ItemInfo(xmp_id, b'mime', '', XMP_CONTENT_TYPE)),
+            b'iref': _add_reference(raw.get(b'iref'), b'cdsc', xmp_id, _primary_item(raw[b'pitm'])),
+        }
+    kept_locations = [loc for loc in table.items if loc.item_id != xmp_id]
+    xmp_box = isobmff.make_box(b'mdat', packet)
+
+    # iloc's size depends on the offsets it stores, and those depend on the new meta size: iterate until stable
+    meta_size = meta.size
+    for _ in range(4):
+        delta = meta_size + len(xmp_box) - meta.size
+        xmp_location = isobmff.ItemLocation(xmp_id, 0, 0, 0, [(0, meta.offset + meta_size + 8, len(packet))])
+        new_boxes[b'iloc'] = isobmff.build_iloc(isobmff.ItemLocationTable(
+            table.version, table.offset_size, table.length_size, table.base_offset_size, table.index_size,
+            _shift_locations(kept_locations, meta.end, delta) + [xmp_location],
+        ))
+        new_meta = _rebuild_meta(payload, children, new_boxes)
+        if len(new_meta) == meta_size:
+            break
+        meta_size = len(new_meta)
+    else:
+        raise ValueError('Could not settle the HEIF item layout')
+
+    f.seek(0)
+    prefix = f.read(meta.offset)
+    return prefix + new_meta + xmp_box, meta.end
+
+def _rebuild_meta(payload: bytes, children: list, new_boxes: dict) -> bytes:
+    out = bytearray(payload[:4])
+    for box_type, box_start, _, end in children:
+        out += new_boxes[box_type] if box_type in new_boxes else payload[box_start:end]
+    for box_type, box in new_boxes.items():
+        if box_type not in {child[0] for child in children}:
+            out += box
+    return isobmff.make_box(b'meta', bytes(out))
@@ -0,0 +1,90 @@
+import os
+from dataclasses import dataclass
+
+@dataclass
+class FileEntry:
+    path: str
+    stem: str
+    extension: str     # lower-case, with the dot
+    stat: os.stat_result
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(self.path)
+
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+
+    @property
+    def inode(self) -> int:
+        return self.stat.st_ino
+
+def make_entry(path: str, stat: os.stat_result | None = None) -> FileEntry:
+    stem, extension = os.path.splitext(os.path.basename(path))
+    return FileEntry(path, stem, extension.lower(), stat or os.stat(path))
+
+class Inventory:
+    """
+    Every regular file under a directory, from one os.scandir walk. The duplicate check, HEIC conversion and
+    metadata extraction all read it instead of walking the tree again, and keep it current as they rename files.
+    """
+
+    def __init__(self, root: str, recurse: bool):
+        self.root = root
+        self.recurse = recurse
+        self.entries = {}   # path -> FileEntry, in walk order
+
+    def paths(self, extensions: list | None = None) -> list:
+        if extensions is None:
+            return list(self.entries)
+        return [path for path, entry in self.entries.items() if entry.extension in extensions]
+
+    def stats(self) -> dict:
+        return {path: entry.stat for path, entry in self.entries.items()}
+
+    def get(self, path: str) -> FileEntry | None:
+        return self.entries.get(path)
+
+    def add(self, path: str, stat: os.stat_result | None = None) -> FileEntry:
+        entry = make_entry(path, stat)
+        self.entries[path] = entry
+        return entry
+
+    def remove(self, path: str):
+        self.entries.pop(path, None)
+
+    def renamed(self, old_path: str, new_path: str):
+        # rename() keeps the inode and timestamps, so only the name-derived fields change
+        entry = self.entries.pop(old_path, None)
+        if entry is not None:
+            self.entries[new_path] = make_entry(new_path, entry.stat)
+
+def scan(directory: str, recurse: bool = False) -> Inventory:
+    """
+    Walks directory once. Hidden directories are skipped and subdirectories are only entered with recurse,
+    the same traversal exiftool -r used to do; entries are in sorted order per directory.
+    """
+    root = os.path.abspath(directory)
+    inventory = Inventory(root, recurse)
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as iterator:
+                children = sorted(iterator, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for child in children:
+            try:
+                if child.is_dir(follow_symlinks=True):
+                    if recurse and not child.name.startswith('.'):
+                        subdirectories.append(child.path)
+                elif child.is_file(follow_symlinks=True):
+                    inventory.add(child.path, child.stat(follow_symlinks=True))
+            except OSError:
+                continue
+        # Depth-first in name order, like os.walk
+        pending.extend(reversed(subdirectories))
+    return inventory
@@ -0,0 +1,241 @@
+import struct
+from dataclasses import dataclass, field
+
+# Boxes whose payload is just more boxes
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'udta', b'iprp', b'ipco', b'dinf'}
+
+@dataclass
+class Box:
+    type: bytes
+    offset: int        # file offset of the box header
+    header_size: int
+    size: int          # full box size including header
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def payload_size(self) -> int:
+        return self.size - self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+def iter_boxes(f, start: int, end: int):
+    """Yields the boxes between start and end by seeking from header to header; payloads are never read."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack('>Q', large)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ValueError(f'Invalid {box_type!r} box size {size} at offset {offset}')
+        yield Box(box_type, offset, header_size, size)
+        offset += size
+
+def find_box(f, start: int, end: int, box_type: bytes) -> Box | None:
+    for box in iter_boxes(f, start, end):
+        if box.type == box_type:
+            return box
+    return None
+
+def read_payload(f, box: Box) -> bytes:
+    f.seek(box.payload_offset)
+    data = f.read(box.payload_size)
+    if len(data) != box.payload_size:
+        raise ValueError(f'Truncated {box.type!r} box')
+    return data
+
+def iter_payload_boxes(data: bytes, start: int = 0):
+    """Same as iter_boxes, for a payload already in memory. Yields (type, payload_start, payload_end)."""
+    offset = start
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise ValueError(f'Invalid {box_type!r} box size {size}')
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+def _read_uint(data: bytes, offset: int, size: int) -> tuple:
+    if size == 0:
+        return 0, offset
+    return int.from_bytes(data[offset:offset + size], 'big'), offset + size
+
+@dataclass
+class ItemInfo:
+    item_id: int
+    item_type: bytes
+    name: str = ''
+    content_type: str = ''
+
+@dataclass
+class ItemLocation:
+    item_id: int
+    construction_method: int = 0
+    data_reference_index: int = 0
+    base_offset: int = 0
+    extents: list = field(default_factory=list)   # [(index, offset, length)]
+
+@dataclass
+class ItemLocationTable:
+    version: int
+    offset_size: int
+    length_size: int
+    base_offset_size: int
+    index_size: int
+    items: list
+
+def parse_iinf(payload: bytes) -> list:
+    version = payload[0]
+    offset = 4
+    if version == 0:
+        count = struct.unpack_from('>H', payload, offset)[0]
+        offset += 2
+    else:
+        count = struct.unpack_from('>I', payload, offset)[0]
+        offset += 4
+    items = []
+    for box_type, start, end in iter_payload_boxes(payload, offset):
+        if box_type != b'infe':
+            continue
+        items.append(parse_infe(payload[start:end]))
+        if len(items) == count:
+            break
+    return items
+
+def parse_infe(payload: bytes) -> ItemInfo:
+    version = payload[0]
+    if version < 2:
+        item_id = struct.unpack_from('>H', payload, 4)[0]
+        return ItemInfo(item_id, b'')
+    if version == 2:
+        item_id = struct.unpack_from('>H', payload, 4)[0]
+        offset = 8
+    else:
+        item_id = struct.unpack_from('>I', payload, 4)[0]
+        offset = 10
+    item_type = payload[offset:offset + 4]
+    strings = payload[offset + 4:].split(b'\x00')
+    name = strings[0].decode('utf-8', errors='replace') if strings else ''
+    content_type = strings[1].decode('utf-8', errors='replace') if item_type == b'mime' and len(strings) > 1 else ''
+    return ItemInfo(item_id, item_type, name, content_type)
+
+def parse_iloc(payload: bytes) -> ItemLocationTable:
+    version = payload[0]
+    offset_size = payload[4] >> 4
+    length_size = payload[4] & 0x0F
+    base_offset_size = payload[5] >> 4
+    index_size = payload[5] & 0x0F if version in (1, 2) else 0
+    offset = 6
+    if version < 2:
+        count = struct.unpack_from('>H', payload, offset)[0]
+        offset += 2
+    else:
+        count = struct.unpack_from('>I', payload, offset)[0]
+        offset += 4
+    items = []
+    for _ in range(count):
+        item_id, offset = _read_uint(payload, offset, 2 if version < 2 else 4)
+        location = ItemLocation(item_id)
+        if version in (1, 2):
+            method, offset = _read_uint(payload, offset, 2)
+            location.construction_method = method & 0x0F
+        location.data_reference_index, offset = _read_uint(payload, offset, 2)
+        location.base_offset, offset = _read_uint(payload, offset, base_offset_size)
+        extent_count, offset = _read_uint(payload, offset, 2)
+        for _ in range(extent_count):
+            extent_index = 0
+            if version in (1, 2) and index_size:
+                extent_index, offset = _read_uint(payload, offset, index_size)
+            extent_offset, offset = _read_uint(payload, offset, offset_size)
+            extent_length, offset = _read_uint(payload, offset, length_size)
+            location.extents.append((extent_index, extent_offset, extent_length))
+        items.append(location)
+    return ItemLocationTable(version, offset_size, length_size, base_offset_size, index_size, items)
+
+def read_item(f, location: ItemLocation, idat: bytes = b'') -> bytes:
+    """Concatenates an item's extents, from the file (construction method 0) or from idat (1)."""
+    if location.construction_method not in (0, 1):
+        raise ValueError('Unsupported iloc construction method')
+    chunks = []
+    for _, extent_offset, extent_length in location.extents:
+        offset = location.base_offset + extent_offset
+        if location.construction_method == 1:
+            chunks.append(idat[offset:offset + extent_length])
+        else:
+            f.seek(offset)
+            chunks.append(f.read(extent_length))
+    return b''.join(chunks)
+
+def make_box(box_type: bytes, payload: bytes) -> bytes:
+    if len(payload) + 8 > 0xFFFFFFFF:
+        return struct.pack('>I4sQ', 1, box_type, len(payload) + 16) + payload
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+def make_full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return make_box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+def build_infe(item: ItemInfo) -> bytes:
+    version = 2 if item.item_id <= 0xFFFF else 3
+    payload = struct.pack('>H' if version == 2 else '>I', item.item_id)
+    payload += b'\x00\x00' + item.item_type + item.name.encode('utf-8') + b'\x00'
+    if item.item_type == b'mime':
+        payload += item.content_type.encode('utf-8') + b'\x00'
+    return make_full_box(b'infe', version, 0, payload)
+
+def _uint_size(value: int) -> int:
+    return 4 if value <= 0xFFFFFFFF else 8
+
+def build_iloc(table: ItemLocationTable) -> bytes:
+    """Serializes table, widening the version and field sizes if the values no longer fit."""
+    items = table.items
+    version = table.version
+    if any(loc.construction_method for loc in items) and version == 0:
+        version = 1
+    if any(loc.item_id > 0xFFFF for loc in items) or len(items) > 0xFFFF:
+        version = 2
+    offsets = [offset for loc in items for _, offset, _ in loc.extents]
+    lengths = [length for loc in items for _, _, length in loc.extents]
+    offset_size = max(table.offset_size, _uint_size(max(offsets)) if offsets else 0)
+    length_size = max(table.length_size, _uint_size(max(lengths)) if lengths else 0)
+    base_offset_size = table.base_offset_size
+    if any(loc.base_offset for loc in items):
+        base_offset_size = max(base_offset_size, _uint_size(max(loc.base_offset for loc in items)))
+    index_size = table.index_size if version in (1, 2) else 0
+
+    id_size = 2 if version < 2 else 4
+    out = bytearray()
+    out += bytes([(offset_size << 4) | length_size, (base_offset_size << 4) | index_size])
+    out += len(items).to_bytes(id_size, 'big')
+    for loc in items:
+        out += loc.item_id.to_bytes(id_size, 'big')
+        if version in (1, 2):
+            out += loc.construction_method.to_bytes(2, 'big')
+        out += loc.data_reference_index.to_bytes(2, 'big')
+        out += loc.base_offset.to_bytes(base_offset_size, 'big')
+        out += len(loc.extents).to_bytes(2, 'big')
+        for extent_index, extent_offset, extent_length in loc.extents:
+            if index_size:
+                out += extent_index.to_bytes(index_size, 'big')
+            out += extent_offset.to_bytes(offset_size, 'big')
+            out += extent_length.to_bytes(length_size, 'big')
+    return make_full_box(b'iloc', version, 0, bytes(out))
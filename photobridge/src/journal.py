@@ -0,0 +1,124 @@
+import glob
+import itertools
+import json
+import os
+import threading
+
+import assembly
+import transfer
+
+JOURNAL_NAME = '.photobridge-journal'
+
+class Journal:
+    """
+    Write-ahead log of a --dir run: one JSON object per line, kept in the output directory. Every Motion Photo
+    (and every unmatched move) gets a `plan` record naming its sources, output and temp file, fsynced before
+    anything is written; then `commit` once the output has been renamed into place and `done` once the sources
+    are gone, or `abandon` if it failed. Only plans are fsynced: recover() works out from the files themselves
+    how far anything after the last durable record got.
+    """
+
+    def __init__(self, path: str, finished=()):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.entries = {}   # first source -> id of its open plan
+        self.file = open(path, 'w')
+        # Carried over from the runs this one resumes, so a second interruption still skips them
+        for output in sorted(finished):
+            self.file.write(json.dumps({'op': 'finished', 'output': output}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        assembly.fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+    def _write(self, record: dict, sync: bool = False):
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def plan(self, sources: list, output: str, kind: str = 'group'):
+        """Later records for this entry are made by its first source's path."""
+        output = os.path.abspath(output)
+        entry = next(self.ids)
+        self.entries[os.path.abspath(sources[0])] = entry
+        self._write({'op': 'plan', 'id': entry, 'kind': kind, 'sources': [os.path.abspath(p) for p in sources],
+                     'output': output, 'temp': transfer.temp_path(output)}, sync=True)
+
+    def _close_entry(self, op: str, source: str, keep: bool = False):
+        source = os.path.abspath(source)
+        entry = self.entries.get(source) if keep else self.entries.pop(source, None)
+        if entry is not None:
+            self._write({'op': op, 'id': entry})
+
+    def commit(self, source: str):
+        self._close_entry('commit', source, keep=True)
+
+    def done(self, source: str):
+        self._close_entry('done', source)
+
+    def abandon(self, source: str):
+        self._close_entry('abandon', source)
+
+    def close(self, finished: bool = False):
+        """With finished, the run completed and the journal is removed: there is nothing left to resume."""
+        self.file.close()
+        if finished:
+            os.unlink(self.path)
+
+def shard_path(path: str, index: int) -> str:
+    """The journal a --shards worker keeps next to the run's own; recovered along with it."""
+    return f'{path}.{index}'
+
+def shard_paths(path: str) -> list:
+    return sorted(p for p in glob.glob(glob.escape(path) + '.*') if p.rpartition('.')[2].isdigit())
+
+def read(path: str) -> tuple:
+    """(Motion Photos finished by earlier runs, {id: plan record with its last 'state'}) from a journal."""
+    finished = set()
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The line being written when the run died
+                break
+            if record['op'] == 'finished':
+                finished.add(record['output'])
+            elif record['op'] == 'plan':
+                entries[record['id']] = dict(record, state='plan')
+            elif record.get('id') in entries:
+                entries[record['id']]['state'] = record['op']
+    return finished, entries
+
+def recover(path: str) -> tuple:
+    """
+    Settles what an interrupted run left behind, per journal entry: a committed Motion Photo gets its remaining
+    sources removed; anything uncommitted has its temp file removed and its sources left for this run to redo.
+    A Motion Photo is known to be committed from its record or, if that record was lost, from its output
+    being on disk with sources already removed, which only ever happens after the rename. Running it twice
+    changes nothing more. Returns the finished outputs and counts of what was done.
+    """
+    finished, entries = read(path)
+    counts = {'completed': 0, 'rolled_back': 0}
+    for entry in entries.values():
+        if entry['state'] in ('done', 'abandon'):
+            if entry['state'] == 'done' and entry['kind'] == 'group':
+                finished.add(entry['output'])
+            continue
+        remaining = [source for source in entry['sources'] if os.path.exists(source)]
+        committed = entry['state'] == 'commit' or (
+            os.path.exists(entry['output']) and len(remaining) < len(entry['sources']))
+        if committed:
+            for source in remaining:
+                os.unlink(source)
+            if entry['kind'] == 'group':
+                finished.add(entry['output'])
+            counts['completed'] += 1
+        else:
+            if os.path.exists(entry['temp']):
+                os.unlink(entry['temp'])
+            counts['rolled_back'] += 1
+    return finished, counts
@@ -0,0 +1,132 @@
+import io
+import struct
+from dataclasses import dataclass
+
+import xmp
+
+SOI = b'\xFF\xD8'
+APP0 = 0xE0
+APP1 = 0xE1
+SOS = 0xDA
+EOI = 0xD9
+
+XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+EXTENDED_XMP_HEADER = b'http://ns.adobe.com/xmp/extension/\x00'
+EXIF_HEADER = b'Exif\x00\x00'
+
+MAX_SEGMENT_DATA = 0xFFFF - 2
+MAX_STANDARD_PACKET = MAX_SEGMENT_DATA - len(XMP_HEADER)
+EXTENDED_CHUNK_SIZE = 65400
+
+# Markers that are not followed by a length field
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+@dataclass
+class JpegSegment:
+    marker: int
+    data: bytes
+
+    def is_xmp(self) -> bool:
+        return self.marker == APP1 and self.data.startswith(XMP_HEADER)
+
+    def is_extended_xmp(self) -> bool:
+        return self.marker == APP1 and self.data.startswith(EXTENDED_XMP_HEADER)
+
+    def is_exif(self) -> bool:
+        return self.marker == APP1 and self.data.startswith(EXIF_HEADER)
+
+    def to_bytes(self) -> bytes:
+        if self.marker in STANDALONE_MARKERS:
+            return bytes([0xFF, self.marker])
+        return bytes([0xFF, self.marker]) + struct.pack('>H', len(self.data) + 2) + self.data
+
+def read_segments(f) -> tuple:
+    """Reads the marker chain up to (not including) SOS and returns (segments, offset of SOS)."""
+    if f.read(2) != SOI:
+        raise ValueError('Not a JPEG file (missing SOI marker)')
+    segments = []
+    while True:
+        offset = f.tell()
+        byte = f.read(1)
+        if byte != b'\xFF':
+            raise ValueError(f'Corrupt JPEG marker chain at offset {offset}')
+        marker = f.read(1)
+        while marker == b'\xFF':
+            marker = f.read(1)
+        if not marker:
+            raise ValueError('Unexpected end of JPEG before SOS')
+        marker = marker[0]
+        if marker in (SOS, EOI):
+            f.seek(-2, io.SEEK_CUR)
+            return segments, f.tell()
+        if marker in STANDALONE_MARKERS:
+            segments.append(JpegSegment(marker, b''))
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) != 2:
+            raise ValueError('Unexpected end of JPEG segment header')
+        length = struct.unpack('>H', length_bytes)[0]
+        if length < 2:
+            # Checked before reading: read(-1) or read(-2) would take in the rest of the file
+            raise ValueError(f'Invalid JPEG segment length {length} at offset {offset}')
+        data = f.read(length - 2)
+        if len(data) != length - 2:
+            raise ValueError(f'Truncated JPEG segment at offset {offset}')
+        segments.append(JpegSegment(marker, data))
+
+def _existing_xmp(segments: list) -> tuple:
+    standard = next((s for s in segments if s.is_xmp()), None)
+    root = xmp.parse_packet(standard.data[len(XMP_HEADER):]) if standard else xmp.empty_packet()
+
+    extended = None
+    guid = xmp.extended_guid(root)
+    if guid:
+        chunks = {}
+        total = 0
+        for segment in segments:
+            if not segment.is_extended_xmp():
+                continue
+            body = segment.data[len(EXTENDED_XMP_HEADER):]
+            if body[:32].decode('ascii', errors='replace') != guid:
+                continue
+            total, chunk_offset = struct.unpack('>II', body[32:40])
+            chunks[chunk_offset] = body[40:]
+        data = b''.join(chunks[k] for k in sorted(chunks))
+        if chunks and len(data) == total:
+            extended = xmp.parse_packet(data)
+    return root, extended
+
+def xmp_segments(elements: list, segments: list | None = None) -> list:
+    root, extended = _existing_xmp(segments or [])
+    root = xmp.merge_properties(root, elements, extended)
+    keep = {xmp.GCAMERA_NS} | {xmp.namespace_of(e.tag) for e in elements}
+    packet, extended_xmp, guid = xmp.serialize_packet(root, MAX_STANDARD_PACKET, keep)
+
+    result = [JpegSegment(APP1, XMP_HEADER + packet)]
+    if extended_xmp is not None:
+        for chunk_offset in range(0, len(extended_xmp), EXTENDED_CHUNK_SIZE):
+            chunk = extended_xmp[chunk_offset:chunk_offset + EXTENDED_CHUNK_SIZE]
+            header = EXTENDED_XMP_HEADER + guid.encode('ascii') + struct.pack('>II', len(extended_xmp), chunk_offset)
+            result.append(JpegSegment(APP1, header + chunk))
+    return result
+
+def build_tagged_header(f, elements: list) -> tuple:
+    """
+    Returns (header, resume_offset): the rewritten SOI..pre-SOS bytes carrying the merged XMP,
+    and the offset in f from which the original bytes can be copied through unchanged.
+    """
+    segments, resume_offset = read_segments(f)
+    new_xmp = xmp_segments(elements, segments)
+    kept = [s for s in segments if not (s.is_xmp() or s.is_extended_xmp())]
+
+    insert_at = 0
+    for index, segment in enumerate(kept):
+        if segment.marker == APP0 or segment.is_exif():
+            insert_at = index + 1
+    kept[insert_at:insert_at] = new_xmp
+    return SOI + b''.join(s.to_bytes() for s in kept), resume_offset
+
+def inject_xmp(jpeg_bytes: bytes, elements: list) -> bytes:
+    f = io.BytesIO(jpeg_bytes)
+    header, resume_offset = build_tagged_header(f, elements)
+    return header + jpeg_bytes[resume_offset:]
@@ -1,69 +1,244 @@
 import os
 import sys
+import json
+import shlex
+import shutil
 import argparse
 import subprocess
+import tempfile
 from pathlib import Path
 
-def convert_file(input_file: str) -> str | None:
-    input_path = Path(input_file)
-    if not input_path.is_file() or input_path.suffix.lower() != '.heic':
-        return None
+import inventory
+import metrics
+import scheduler
+import transfer
+
+# sips takes many inputs per call; one process per batch instead of one per file
+BATCH_SIZE = 32
+HEIF_CONVERT_COMMAND = 'heif-convert -q 100 {input} {output}'
+
+def print_log(message: str):
+    print(json.dumps({"type": "log", "message": message}))
+    sys.stdout.flush()
+
+class SipsBackend:
+    """macOS sips: lossless-quality JPEG, Exif and MakerNotes carried over."""
+    name = 'sips'
+    
+    @staticmethod
+    def available() -> bool:
+        return shutil.which('sips') is not None
+    
+    def convert(self, jobs: list) -> dict:
+        # sips writes <stem>.jpg into --out, so each batch shares one parent and a scratch directory
+        errors = {}
+        by_parent = {}
+        for source, target in jobs:
+            by_parent.setdefault(target.parent, []).append((source, target))
+        for parent, batch in by_parent.items():
+            with tempfile.TemporaryDirectory(dir=parent, prefix='.heic-') as scratch:
+                command = ['sips', '-s', 'format', 'jpeg', '-s', 'formatOptions', '100']
+                command += [str(source) for source, _ in batch] + ['--out', scratch]
+                metrics.count('converter_spawns')
+                result = subprocess.run(command, capture_output=True, text=True)
+                for source, target in batch:
+                    converted = Path(scratch) / f"{source.stem}.jpg"
+                    if converted.is_file() and converted.stat().st_size > 0:
+                        os.replace(converted, target)
+                    else:
+                        errors[source] = result.stderr.strip() or f"sips exited with status {result.returncode}"
+        return errors
+
+class PillowHeifBackend:
+    """pillow-heif (libheif) in-process, for machines without sips."""
+    name = 'pillow-heif'
+    
+    @staticmethod
+    def available() -> bool:
+        try:
+            import pillow_heif  # noqa: F401
+            import PIL  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    
+    def convert(self, jobs: list) -> dict:
+        import pillow_heif
+        from PIL import Image
+        pillow_heif.register_heif_opener()
+        errors = {}
+        for source, target in jobs:
+            try:
+                with Image.open(source) as image:
+                    options = {key: image.info[key] for key in ('exif', 'icc_profile', 'xmp') if image.info.get(key)}
+                    image.save(target, 'JPEG', quality=100, **options)
+            except Exception as e:
+                target.unlink(missing_ok=True)
+                errors[source] = str(e)
+        return errors
+
+class CommandBackend:
+    """Any converter taking one file per call, e.g. libheif's heif-convert; {input} and {output} are substituted."""
+    name = 'command'
+    
+    def __init__(self, template: str = HEIF_CONVERT_COMMAND):
+        self.template = template
     
-    output_path = input_path.with_suffix('.JPG')
-    command = ['sips', '-s', 'format', 'jpeg', '-s', 'formatOptions', '100', str(input_path), '--out', str(output_path)]
+    def available(self) -> bool:
+        return shutil.which(shlex.split(self.template)[0]) is not None
     
-    try:
-        subprocess.run(command, check=True, capture_output=True)
-        stat = input_path.stat()
-        os.utime(output_path, (stat.st_atime, stat.st_mtime))
-        input_path.unlink()
-        return str(output_path)
-    except subprocess.CalledProcessError:
+    def convert(self, jobs: list) -> dict:
+        errors = {}
+        for source, target in jobs:
+            command = [part.format(input=source, output=target) for part in shlex.split(self.template)]
+            metrics.count('converter_spawns')
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0 or not target.is_file():
+                target.unlink(missing_ok=True)
+                errors[source] = result.stderr.strip() or f"{command[0]} exited with status {result.returncode}"
+        return errors
+
+def get_backend(name: str = 'auto', command: str | None = None):
+    if command:
+        return CommandBackend(command)
+    candidates = {
+        'sips': [SipsBackend()],
+        'pillow-heif': [PillowHeifBackend()],
+        'heif-convert': [CommandBackend()],
+        'auto': [SipsBackend(), PillowHeifBackend(), CommandBackend()],
+    }[name]
+    return next((backend for backend in candidates if backend.available()), None)
+
+def _temp_target(target: Path) -> Path:
+    # Hidden and marked partial like transfer.temp_path, but keeping the extension converters pick the format by
+    return target.with_name(f".{target.stem}{transfer.PARTIAL_SUFFIX}{target.suffix}")
+
+def _convert_batch(backend, batch: list) -> dict:
+    """
+    Converts (source, target) pairs through temp files, so a failed conversion never touches target, then moves
+    each into place unless something already sits there, carries timestamps over and removes the converted sources.
+    """
+    temps = {source: _temp_target(target) for source, target in batch}
+    errors = backend.convert([(source, temps[source]) for source, _ in batch])
+    for source, target in batch:
+        temp = temps[source]
+        try:
+            if source not in errors:
+                stat = source.stat()
+                os.utime(temp, (stat.st_atime, stat.st_mtime))
+                transfer.commit_new(str(temp), str(target))
+                source.unlink()
+        except FileExistsError:
+            errors[source] = f"{target.name} already exists"
+        except OSError as e:
+            errors[source] = str(e)
+        finally:
+            temp.unlink(missing_ok=True)
+    return {str(source): message for source, message in errors.items()}
+
+def convert_files(paths: list, jobs: int = 1, backend='auto', log=print_log) -> dict:
+    """
+    Converts HEIC files to JPEG next to them (IMG.HEIC -> IMG.JPG) on a pool of `jobs` workers, BATCH_SIZE files
+    per converter call. backend is a backend or a get_backend name. A source whose JPEG already exists is left
+    as it is. Returns {source: output path or None}; failures are also reported through log.
+    """
+    if isinstance(backend, str):
+        backend = get_backend(backend)
+    sources = [Path(p) for p in paths if Path(p).is_file() and Path(p).suffix.lower() == '.heic']
+    if backend is None:
+        if sources:
+            log(f"No HEIC converter available; {len(sources)} HEIC files left as they are")
+        return {str(source): None for source in sources}
+    
+    results = {str(source): None for source in sources}
+    failed = 0
+    pending = []
+    for source in sources:
+        target = source.with_suffix('.JPG')
+        if target.exists():
+            # check_directory_for_duplicates renames these in --dir runs; --pairs and --photo runs get here
+            failed += 1
+            log(f"HEIC conversion failed for {source}: {target.name} already exists")
+        else:
+            pending.append((source, target))
+    batches = [pending[start:start + BATCH_SIZE] for start in range(0, len(pending), BATCH_SIZE)]
+    with scheduler.make_executor(jobs) as executor:
+        tasks = ((backend, batch) for batch in batches)
+        for (_, batch), errors, error in scheduler.run_ordered(executor, _convert_batch, tasks, max(jobs, 1) * 2):
+            for source, target in batch:
+                message = str(error) if error is not None else errors.get(str(source))
+                if message is None:
+                    results[str(source)] = str(target)
+                else:
+                    failed += 1
+                    results[str(source)] = None
+                    log(f"HEIC conversion failed for {source}: {message}")
+    if sources:
+        log(f"Converted {len(sources) - failed} of {len(sources)} HEIC files with {backend.name}")
+    return results
+
+def convert_file(input_file: str, backend='auto') -> str | None:
+    input_path = Path(input_file)
+    if not input_path.is_file() or input_path.suffix.lower() != '.heic':
         return None
+    return convert_files([input_file], backend=backend, log=lambda message: None).get(str(input_path))
 
-def convert_directory(input_directory: str):
-    dir_path = Path(input_directory)
-    if not dir_path.is_dir():
-        return
+def convert_directory(input_directory: str, jobs: int = 1, backend='auto', log=print_log, recurse: bool = True,
+                      files: inventory.Inventory | None = None) -> dict:
+    """Converts the HEIC files in files (or a fresh scan of input_directory) and updates files with the results."""
+    if files is None:
+        if not Path(input_directory).is_dir():
+            return {}
+        files = inventory.scan(input_directory, recurse)
     
-    for file_path in dir_path.rglob('*'):
-        if file_path.is_file() and file_path.suffix.lower() == '.heic':
-            convert_file(str(file_path))
+    results = convert_files(files.paths(['.heic']), jobs, backend, log)
+    for source, output in results.items():
+        if output is not None:
+            files.remove(source)
+            files.add(output)
+    return results
 
-def check_directory_for_duplicates(input_directory: str, recurse: bool = False):
-    dir_path = Path(input_directory)
-    if not dir_path.is_dir():
-        return
+def check_directory_for_duplicates(input_directory: str, recurse: bool = False,
+                                   files: inventory.Inventory | None = None):
+    """
+    Renames IMG.HEIC to IMG_1.HEIC when an IMG.JPG (or another IMG.HEIC) sits in the same directory,
+    so conversion can't overwrite it.
+    """
+    if files is None:
+        if not Path(input_directory).is_dir():
+            return
+        files = inventory.scan(input_directory, recurse)
     
-    search_pattern = '**/*' if recurse else '*'
     file_groups = {}
+    for entry in list(files.entries.values()):
+        file_groups.setdefault((entry.directory, entry.stem), []).append(entry)
     
-    for file_path in dir_path.glob(search_pattern):
-        if file_path.is_file():
-            base_filename = file_path.stem
-            file_groups.setdefault(base_filename, []).append(file_path)
-
-    for base_filename, file_list in file_groups.items():
-        heic_files = [f for f in file_list if f.suffix.lower() == '.heic']
-        jpg_files = [f for f in file_list if f.suffix.lower() == '.jpg']
+    for (directory, base_filename), file_list in file_groups.items():
+        heic_files = [f for f in file_list if f.extension == '.heic']
+        jpg_files = [f for f in file_list if f.extension == '.jpg']
         
         if len(heic_files) + len(jpg_files) > 1 and heic_files:
             for idx, heic_file in enumerate(heic_files):
-                new_name = f"{base_filename}_{idx + 1}{heic_file.suffix}"
-                new_path = heic_file.with_name(new_name)
-                heic_file.rename(new_path)
+                new_name = f"{base_filename}_{idx + 1}{os.path.splitext(heic_file.path)[1]}"
+                new_path = os.path.join(directory, new_name)
+                os.rename(heic_file.path, new_path)
+                files.renamed(heic_file.path, new_path)
 
 def create_arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--dir')
     parser.add_argument('--file')
+    parser.add_argument('--jobs', type=int, default=scheduler.default_jobs())
+    parser.add_argument('--backend', choices=['auto', 'sips', 'pillow-heif', 'heif-convert'], default='auto')
+    parser.add_argument('--command', help='converter command template with {input} and {output}')
     return parser
 
 if __name__ == "__main__":
     arg_parser = create_arg_parser()
     parsed_args = arg_parser.parse_args(sys.argv[1:])
+    selected_backend = get_backend(parsed_args.backend, parsed_args.command)
     
     if parsed_args.dir and Path(parsed_args.dir).exists():
-        convert_directory(parsed_args.dir)
+        convert_directory(parsed_args.dir, parsed_args.jobs, selected_backend)
     elif parsed_args.file and Path(parsed_args.file).exists():
-        convert_file(parsed_args.file)
\ No newline at end of file
+        convert_file(parsed_args.file, selected_backend)
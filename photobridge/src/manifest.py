@@ -0,0 +1,104 @@
+import json
+import os
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    output_path TEXT PRIMARY KEY,
+    output_size INTEGER NOT NULL,
+    output_mtime_ns INTEGER NOT NULL,
+    output_inode INTEGER NOT NULL,
+    photo_path TEXT NOT NULL,
+    photo_key TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    video_key TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_by_pair ON outputs (photo_path, video_path);
+"""
+
+def file_key(stat: os.stat_result) -> tuple:
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def _key_text(stat: os.stat_result) -> str:
+    return ':'.join(str(part) for part in file_key(stat))
+
+class Manifest:
+    """On-disk cache of extracted metadata and of the Motion Photos already produced, keyed by path + size + mtime + inode."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def cached_metadata(self, path: str, stat: os.stat_result) -> dict | None:
+        row = self.db.execute(
+            "SELECT size, mtime_ns, inode, metadata FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != file_key(stat):
+            return None
+        return json.loads(row[3])
+
+    def store_metadata(self, path: str, stat: os.stat_result, metadata: dict):
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, metadata) VALUES (?, ?, ?, ?, ?)",
+            (path, *file_key(stat), json.dumps(metadata)),
+        )
+
+    def forget(self, path: str):
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def moved(self, old_path: str, new_path: str):
+        # A rename keeps size, mtime and inode, so the cached metadata stays valid under the new path
+        if old_path != new_path:
+            self.db.execute("DELETE FROM files WHERE path = ?", (new_path,))
+            self.db.execute("UPDATE files SET path = ? WHERE path = ?", (new_path, old_path))
+
+    def is_output(self, path: str, stat: os.stat_result) -> bool:
+        row = self.db.execute(
+            "SELECT output_size, output_mtime_ns, output_inode FROM outputs WHERE output_path = ?", (path,)
+        ).fetchone()
+        return row is not None and tuple(row) == file_key(stat)
+
+    def existing_output(self, photo_path: str, video_path: str) -> str | None:
+        """Returns the Motion Photo already made from these exact photo and video bytes, if it is still on disk."""
+        try:
+            photo_key = _key_text(os.stat(photo_path))
+            video_key = _key_text(os.stat(video_path))
+        except OSError:
+            return None
+        rows = self.db.execute(
+            "SELECT output_path, output_size, output_mtime_ns, output_inode FROM outputs "
+            "WHERE photo_path = ? AND photo_key = ? AND video_path = ? AND video_key = ?",
+            (photo_path, photo_key, video_path, video_key),
+        ).fetchall()
+        for output_path, *key in rows:
+            try:
+                if file_key(os.stat(output_path)) == tuple(key):
+                    return output_path
+            except OSError:
+                continue
+        return None
+
+    def record_output(self, photo_path: str, photo_stat: os.stat_result, video_path: str,
+                      video_stat: os.stat_result, output_path: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (output_path, *file_key(os.stat(output_path)), photo_path, _key_text(photo_stat),
+             video_path, _key_text(video_stat), time.time()),
+        )
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,179 @@
+import bisect
+import os
+import re
+from array import array
+from datetime import date
+
+PHOTO, VIDEO = 0, 1
+NO_CODE = -1
+NO_SECONDS = -(1 << 62)
+DAY_SECONDS = 86400
+
+STEM_SUFFIX_PATTERN = re.compile(r'^(.*)_\d+$')
+
+_day_ordinals = {}
+
+def create_day(create_date: str | None) -> str:
+    parts = (create_date or '').split(None, 1)
+    return parts[0] if parts else ''
+
+def parse_create_date(create_date: str) -> tuple:
+    """
+    '2024:06:01 23:59:00' -> ('2024:06:01', seconds on a continuous scale). The day is the first word, as
+    get_date_part has it; seconds is NO_SECONDS when the rest can't be read. Any zone suffix is ignored:
+    photos carry local time and QuickTime UTC, which is what the date window is there to absorb.
+    """
+    parts = (create_date or '').split()
+    if not parts:
+        return '', NO_SECONDS
+    day = parts[0]
+    clock = parts[1] if len(parts) > 1 else '00:00:00'
+    try:
+        # A library spans a few thousand days at most, so each is worked out once
+        ordinal = _day_ordinals.get(day)
+        if ordinal is None:
+            ordinal = _day_ordinals[day] = date(int(day[0:4]), int(day[5:7]), int(day[8:10])).toordinal()
+        seconds = int(clock[0:2]) * 3600 + int(clock[3:5]) * 60 + int(clock[6:8])
+    except ValueError:
+        return day, NO_SECONDS
+    return day, ordinal * DAY_SECONDS + seconds
+
+def days_around(seconds: int, window_seconds: float) -> list:
+    """Every CreateDate day a timestamp within window_seconds of seconds can fall on."""
+    first, last = int(seconds - window_seconds) // DAY_SECONDS, int(seconds + window_seconds) // DAY_SECONDS
+    return [date.fromordinal(ordinal).strftime('%Y:%m:%d') for ordinal in range(first, last + 1)]
+
+def split_stem(path: str) -> tuple:
+    """(stem, stem without a trailing _N or None): a photo "IMG_1_2" answers to videos named "IMG_1" too."""
+    name = path[path.rfind(os.sep) + 1:] if os.altsep is None else os.path.basename(path)
+    dot = name.rfind('.')
+    stem = name[:dot] if 0 < dot < len(name) - 1 else name
+    suffixed = STEM_SUFFIX_PATTERN.match(stem) if '_' in stem else None
+    return stem, suffixed.group(1) if suffixed else None
+
+class MetadataTable:
+    """
+    What grouping needs from each file's metadata, as columns: photo or video, ContentIdentifier, CreateDate
+    day and seconds, stem and suffix-less stem. Strings are interned into one pool and stored as codes, so a
+    large run keeps a few machine words per file here and the matching below is sorts and binary searches.
+    """
+
+    def __init__(self):
+        self.kinds = array('b')
+        self.identifiers = array('q')
+        self.days = array('q')
+        self.seconds = array('q')
+        self.stems = array('q')
+        self.base_stems = array('q')
+        self.strings = []
+        self.codes = {}
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def _codes(self, values) -> array:
+        # Interning a whole column at once: a string's code is its position in the pool
+        codes = self.codes
+        column = array('q', [codes.setdefault(value, len(codes)) if value else NO_CODE for value in values])
+        self.strings.extend(list(codes)[len(self.strings):])
+        return column
+
+    @classmethod
+    def from_files(cls, files: list, times: bool = True) -> 'MetadataTable':
+        """Without times only the CreateDate days are read, which is all exact-day matching needs."""
+        table = cls()
+        stems = [split_stem(file['path']) for file in files]
+        table.kinds = array('b', [PHOTO if file['type'] == 'photo' else VIDEO for file in files])
+        table.identifiers = table._codes(file['metadata'].get('ContentIdentifier') for file in files)
+        if times:
+            dates = [parse_create_date(file['metadata'].get('CreateDate', '')) for file in files]
+            table.days = table._codes(day for day, _ in dates)
+            table.seconds = array('q', [seconds for _, seconds in dates])
+        else:
+            table.days = table._codes(create_day(file['metadata'].get('CreateDate')) for file in files)
+            table.seconds = array('q', [NO_SECONDS]) * len(files)
+        table.stems = table._codes(stem for stem, _ in stems)
+        table.base_stems = table._codes(base_stem for _, base_stem in stems)
+        return table
+
+    def photo_index(self) -> tuple:
+        """
+        Sorted (stem, day) keys packed into ints, and for each the first photo row with that stem (or that
+        suffix-less stem) and day: the photos a video without a ContentIdentifier may pair with.
+        """
+        span = len(self.strings) + 1
+        rows = len(self.kinds)
+        entries = []
+        for row in range(rows):
+            if self.kinds[row] != PHOTO or self.days[row] == NO_CODE:
+                continue
+            entries.append((self.stems[row] * span + self.days[row]) * rows + row)
+            if self.base_stems[row] != NO_CODE:
+                entries.append((self.base_stems[row] * span + self.days[row]) * rows + row)
+        entries.sort()
+        keys, photo_rows = array('q'), array('q')
+        for entry in entries:
+            key, row = divmod(entry, rows)
+            if not keys or keys[-1] != key:
+                keys.append(key)
+                photo_rows.append(row)
+        return keys, photo_rows
+
+    def match_videos(self, window_seconds: float = 0) -> dict:
+        """
+        Video row -> photo row for videos without a ContentIdentifier: the indexed photo with the same stem
+        and CreateDate day or, failing that and given a window, the one nearest in time within it.
+        """
+        span = len(self.strings) + 1
+        keys, photo_rows = self.photo_index()
+        matches = {}
+        unmatched = []
+        for row in range(len(self.kinds)):
+            if self.kinds[row] != VIDEO or self.identifiers[row] != NO_CODE or self.days[row] == NO_CODE:
+                continue
+            key = self.stems[row] * span + self.days[row]
+            position = bisect.bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                matches[row] = photo_rows[position]
+            elif window_seconds and self.seconds[row] != NO_SECONDS:
+                unmatched.append(row)
+
+        if unmatched:
+            # The same index, by stem and time: each video looks only at its stem's photos within the window
+            timeline = sorted((key // span, self.seconds[photo_row], photo_row)
+                              for key, photo_row in zip(keys, photo_rows) if self.seconds[photo_row] != NO_SECONDS)
+            for row in unmatched:
+                stem, seconds = self.stems[row], self.seconds[row]
+                position = bisect.bisect_left(timeline, (stem, seconds - window_seconds))
+                best = None
+                while position < len(timeline) and timeline[position][0] == stem \
+                        and timeline[position][1] <= seconds + window_seconds:
+                    distance = abs(timeline[position][1] - seconds)
+                    if best is None or distance < best[0]:
+                        best = (distance, timeline[position][2])
+                    position += 1
+                if best:
+                    matches[row] = best[1]
+        return matches
+
+    def photo_key(self, row: int):
+        if self.identifiers[row] != NO_CODE:
+            return self.strings[self.identifiers[row]]
+        if self.days[row] != NO_CODE:
+            return (self.strings[self.days[row]], self.strings[self.stems[row]])
+        return 'no_identifier'
+
+    def group_keys(self, window_seconds: float = 0) -> list:
+        """The group every row belongs in, keyed as group_files_by_contentidentifier keys its groups."""
+        matches = self.match_videos(window_seconds)
+        keys = []
+        for row in range(len(self.kinds)):
+            if self.identifiers[row] != NO_CODE:
+                keys.append(self.strings[self.identifiers[row]])
+            elif self.kinds[row] == PHOTO:
+                keys.append(self.photo_key(row))
+            elif row in matches:
+                keys.append(self.photo_key(matches[row]))
+            else:
+                keys.append('unmatched_videos')
+        return keys
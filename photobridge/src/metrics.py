@@ -0,0 +1,161 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+def percentile(values: list, fraction: float) -> float:
+    # Nearest-rank, same as benchmark.py
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+class Metrics:
+    """Stage timers, counters and latency samples. Safe to share between threads."""
+
+    def __init__(self, trace: bool = False):
+        self.lock = threading.Lock()
+        self.stages = defaultdict(lambda: [0.0, 0])    # name -> [seconds, calls]
+        self.counters = defaultdict(int)
+        self.samples = defaultdict(list)               # name -> [seconds]
+        self.spans = [] if trace else None             # Chrome trace events
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, start)
+
+    def add_time(self, name: str, seconds: float, start: float | None = None):
+        with self.lock:
+            totals = self.stages[name]
+            totals[0] += seconds
+            totals[1] += 1
+            if self.spans is not None and start is not None:
+                self.spans.append({'name': name, 'ph': 'X', 'ts': round(start * 1e6), 'dur': round(seconds * 1e6),
+                                   'pid': os.getpid(), 'tid': threading.get_ident()})
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            self.samples[name].append(seconds)
+
+    def snapshot(self) -> dict:
+        """Plain-data copy, so a worker (thread or process) can hand its numbers back with its result."""
+        with self.lock:
+            return {
+                'stages': {name: list(totals) for name, totals in self.stages.items()},
+                'counters': dict(self.counters),
+                'samples': {name: list(values) for name, values in self.samples.items()},
+                'spans': list(self.spans or []),
+            }
+
+    def merge(self, snapshot: dict):
+        with self.lock:
+            for name, (seconds, calls) in snapshot['stages'].items():
+                self.stages[name][0] += seconds
+                self.stages[name][1] += calls
+            for name, amount in snapshot['counters'].items():
+                self.counters[name] += amount
+            for name, values in snapshot['samples'].items():
+                self.samples[name].extend(values)
+            if self.spans is not None:
+                self.spans.extend(snapshot['spans'])
+
+    def histogram(self, name: str) -> dict:
+        with self.lock:
+            values = list(self.samples.get(name, []))
+        buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        for seconds in values:
+            milliseconds = seconds * 1000
+            index = next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_MS) if milliseconds <= bound),
+                         len(HISTOGRAM_BOUNDS_MS))
+            buckets[index] += 1
+        return {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p90_ms': round(percentile(values, 0.90) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'max_ms': round(max(values, default=0) * 1000, 3),
+            'bounds_ms': HISTOGRAM_BOUNDS_MS,
+            'buckets': buckets,
+        }
+
+    def write_chrome_trace(self, path: str):
+        with self.lock:
+            events = list(self.spans or [])
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+_process_metrics = Metrics()
+_local = threading.local()
+
+def current() -> Metrics:
+    """The collector for this thread: a capture() in progress, else the process-wide one."""
+    return getattr(_local, 'metrics', None) or _process_metrics
+
+def process_metrics() -> Metrics:
+    return _process_metrics
+
+def enable_tracing():
+    if _process_metrics.spans is None:
+        _process_metrics.spans = []
+
+@contextlib.contextmanager
+def capture():
+    """Collects everything recorded on this thread into a fresh Metrics, for handing back to the parent."""
+    previous = getattr(_local, 'metrics', None)
+    _local.metrics = Metrics(trace=_process_metrics.spans is not None)
+    try:
+        yield _local.metrics
+    finally:
+        _local.metrics = previous
+
+def stage(name: str):
+    return current().stage(name)
+
+def count(name: str, amount: int = 1):
+    current().count(name, amount)
+
+def observe(name: str, seconds: float):
+    current().observe(name, seconds)
+
+def format_table(summary: dict) -> str:
+    lines = [f"{'stage':<28}{'calls':>10}{'total s':>12}{'mean ms':>12}"]
+    for name, stage in summary['stages'].items():
+        lines.append(f"{name:<28}{stage['calls']:>10}{stage['seconds']:>12.3f}{stage['mean_ms']:>12.3f}")
+    for name, histogram in summary['latency'].items():
+        lines.append(f"{name + ' latency':<28}{histogram['count']:>10}  p50 {histogram['p50_ms']:.1f} ms"
+                     f"  p99 {histogram['p99_ms']:.1f} ms  max {histogram['max_ms']:.1f} ms")
+    for name, value in summary['counters'].items():
+        lines.append(f"{name:<28}{value:>10}")
+    lines.append(f"{'wall time':<28}{'':>10}{summary['wall_seconds']:>12.3f}")
+    return '\n'.join(lines)
+
+def summarize(collector: Metrics, wall_seconds: float) -> dict:
+    with collector.lock:
+        stages = {name: totals[:] for name, totals in collector.stages.items()}
+        counters = dict(collector.counters)
+        sample_names = list(collector.samples)
+    summary = {
+        'wall_seconds': round(wall_seconds, 3),
+        'stages': {name: {'seconds': round(seconds, 4), 'calls': calls,
+                          'mean_ms': round(seconds / max(calls, 1) * 1000, 3)}
+                   for name, (seconds, calls) in stages.items()},
+        'counters': counters,
+        'latency': {name: collector.histogram(name) for name in sample_names},
+    }
+    for name in ('bytes_read', 'bytes_written'):
+        if name in counters:
+            summary[f'{name}_mb_per_second'] = round(counters[name] / (1 << 20) / max(wall_seconds, 1e-9), 1)
+    return summary
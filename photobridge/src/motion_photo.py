@@ -0,0 +1,246 @@
+import mmap
+import os
+import re
+import struct
+
+import assembly
+import heif_xmp
+import isobmff
+import jpeg_xmp
+import transfer
+import xmp
+
+MOTION_PHOTO_NAME = re.compile(r'\.MP\.(jpe?g|heic|heif|png)$', re.IGNORECASE)
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_XMP_KEYWORD = b'XML:com.adobe.xmp'
+VIDEO_SIGNATURE = b'ftyp'
+QUICKTIME_BRAND = b'qt  '
+
+def is_motion_photo_name(path: str) -> bool:
+    return bool(MOTION_PHOTO_NAME.search(path))
+
+def _jpeg_xmp(mm) -> tuple | None:
+    """(offset, length) of the standard XMP packet, from the marker chain, which the map is walked in place for."""
+    if mm[:2] != jpeg_xmp.SOI:
+        raise ValueError('not a JPEG (no SOI marker)')
+    offset = 2
+    while offset + 4 <= len(mm):
+        if mm[offset] != 0xFF:
+            raise ValueError(f'corrupt JPEG marker chain at offset {offset}')
+        marker = mm[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (jpeg_xmp.SOS, jpeg_xmp.EOI):
+            return None
+        if marker in jpeg_xmp.STANDALONE_MARKERS:
+            offset += 2
+            continue
+        length = struct.unpack_from('>H', mm, offset + 2)[0]
+        data = offset + 4
+        if marker == jpeg_xmp.APP1 and mm[data:data + len(jpeg_xmp.XMP_HEADER)] == jpeg_xmp.XMP_HEADER:
+            packet = data + len(jpeg_xmp.XMP_HEADER)
+            return packet, offset + 2 + length - packet
+        offset += 2 + length
+    return None
+
+def _png_xmp(mm) -> tuple | None:
+    """(offset, length) of the XMP text in its uncompressed iTXt chunk, as exiftool writes it."""
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(mm):
+        length, chunk_type = struct.unpack_from('>I4s', mm, offset)
+        data = offset + 8
+        if chunk_type == b'IEND':
+            return None
+        if chunk_type == b'iTXt' and mm[data:data + len(PNG_XMP_KEYWORD) + 1] == PNG_XMP_KEYWORD + b'\x00':
+            # keyword, compression flag and method, then language and translated keyword, each NUL-terminated
+            if mm[data + len(PNG_XMP_KEYWORD) + 1] != 0:
+                return None
+            text = mm.find(b'\x00', mm.find(b'\x00', data + len(PNG_XMP_KEYWORD) + 3) + 1) + 1
+            return text, data + length - text
+        offset = data + length + 4
+    return None
+
+def _heif_xmp(mm) -> tuple | None:
+    """(offset, length) of the XMP item, through the meta box's iinf and iloc."""
+    if mm[4:8] != VIDEO_SIGNATURE:
+        raise ValueError('not an ISO-BMFF file (no ftyp box)')
+    meta = isobmff.find_box(mm, 0, len(mm), b'meta')
+    if meta is None:
+        raise ValueError('HEIF file without meta box')
+    payload = isobmff.read_payload(mm, meta)
+    children = {box_type: payload[start:end] for box_type, start, end in isobmff.iter_payload_boxes(payload, 4)}
+    if b'iinf' not in children or b'iloc' not in children:
+        return None
+    item = next((item for item in isobmff.parse_iinf(children[b'iinf'])
+                 if item.item_type == b'mime' and item.content_type == heif_xmp.XMP_CONTENT_TYPE), None)
+    location = item and next((location for location in isobmff.parse_iloc(children[b'iloc']).items
+                              if location.item_id == item.item_id), None)
+    if location is None or location.construction_method != 0 or len(location.extents) != 1:
+        return None
+    _, extent_offset, extent_length = location.extents[0]
+    return location.base_offset + extent_offset, extent_length
+
+def _values(root, namespace: str, name: str) -> list:
+    """Every value of a property, written as an attribute (exiftool's way) or as an element (ours)."""
+    tag = xmp.qname(namespace, name)
+    values = [element.get(tag) for element in root.iter() if element.get(tag) is not None]
+    values += [element.text.strip() for element in root.iter(tag) if element.text and element.text.strip()]
+    return values
+
+def _container_items(root) -> list:
+    """[{'Mime', 'Semantic', 'Length', 'Padding'}] from a Container:Directory, attributes or elements."""
+    items = []
+    for item in root.iter(xmp.qname(xmp.CONTAINER_NS, 'Item')):
+        fields = {}
+        for name in ('Mime', 'Semantic', 'Length', 'Padding'):
+            values = _values(item, xmp.ITEM_NS, name)
+            if values:
+                fields[name] = values[0]
+        items.append(fields)
+    return items
+
+def inspect(path: str) -> dict:
+    """
+    Reads a Motion Photo through a read-only map and checks it: the XMP packet is found, its MicroVideoOffset
+    (and the Container:Directory video Length, when there is one) agree, the offset lies inside the file and
+    lands on an ftyp box, and the video from there is well-formed boxes up to the end with a moov among them.
+    For HEIF the photo's boxes, and for PNG its IEND chunk, must also end exactly where the video starts.
+    'errors' lists what failed.
+    """
+    info = {'path': path, 'format': None, 'size': 0, 'xmp_offset': None, 'xmp_length': None,
+            'version': None, 'video_start': None, 'video_size': None, 'video_brand': None, 'errors': []}
+    errors = info['errors']
+    try:
+        with open(path, 'rb') as f:
+            info['size'] = size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                errors.append('empty file')
+                return info
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                _inspect(mm, info)
+    except (OSError, ValueError, SyntaxError, struct.error) as e:
+        errors.append(str(e))
+    return info
+
+def _inspect(mm, info: dict):
+    errors = info['errors']
+    if mm[:2] == jpeg_xmp.SOI:
+        info['format'], located = 'jpeg', _jpeg_xmp(mm)
+    elif mm[:len(PNG_SIGNATURE)] == PNG_SIGNATURE:
+        info['format'], located = 'png', _png_xmp(mm)
+    else:
+        info['format'], located = 'heif', _heif_xmp(mm)
+    if located is None:
+        errors.append('no XMP packet')
+        return
+    info['xmp_offset'], info['xmp_length'] = located
+    root = xmp.parse_packet(mm[located[0]:located[0] + located[1]])
+
+    offsets = _values(root, xmp.GCAMERA_NS, 'MicroVideoOffset')
+    video = next((item for item in _container_items(root) if item.get('Semantic') == 'MotionPhoto'), None)
+    info['version'] = 2 if video else 1
+    if video and offsets and int(video.get('Length', 0)) != int(offsets[0]):
+        errors.append(f"MicroVideoOffset {offsets[0]} disagrees with the Container:Directory video Length "
+                      f"{video.get('Length')}")
+    video_size = int(offsets[0]) if offsets else int(video['Length']) if video and video.get('Length') else None
+    if video_size is None:
+        errors.append('no MicroVideoOffset or Container:Directory video item')
+        return
+    info['video_size'] = video_size
+    if not 0 < video_size < len(mm):
+        errors.append(f"video offset {video_size} is outside the file ({len(mm)} bytes)")
+        return
+    info['video_start'] = start = len(mm) - video_size
+
+    if mm[start + 4:start + 8] != VIDEO_SIGNATURE:
+        errors.append(f"no ftyp box where the video should start (offset {start})")
+        return
+    info['video_brand'] = mm[start + 8:start + 12].decode('latin-1')
+    try:
+        boxes = [box.type for box in isobmff.iter_boxes(mm, start, len(mm))]
+        if b'moov' not in boxes:
+            errors.append('video has no moov box')
+    except ValueError as e:
+        errors.append(f"video: {e}")
+    if info['format'] == 'heif':
+        try:
+            # Raises on a box that runs past the video start, so a short offset shows here too
+            for _ in isobmff.iter_boxes(mm, 0, start):
+                pass
+        except ValueError as e:
+            errors.append(f"photo: {e}")
+    elif info['format'] == 'png' and mm[start - 8:start - 4] != b'IEND':
+        errors.append('photo: no IEND chunk right before the video')
+
+def split_paths(path: str, info: dict, output_dir: str | None = None) -> tuple:
+    """IMG_1.MP.JPG -> (IMG_1.JPG, IMG_1.MOV), in output_dir or next to the Motion Photo."""
+    directory, name = os.path.split(path)
+    stem, extension = os.path.splitext(name)
+    if stem.upper().endswith('.MP'):
+        stem = stem[:-3]
+    video_extension = '.MOV' if info.get('video_brand', '').encode('latin-1') == QUICKTIME_BRAND else '.MP4'
+    directory = output_dir or directory
+    return os.path.join(directory, stem + extension), os.path.join(directory, stem + video_extension)
+
+def extract(path: str, output_dir: str | None = None) -> dict:
+    """
+    Splits a Motion Photo that inspect() passes into its photo (everything before the video, tags included)
+    and its video. Both are copied range by range in the kernel, each to a temp name renamed into place.
+    Files already at either name are left alone and reported as errors, with nothing written.
+    """
+    info = inspect(path)
+    if info['errors']:
+        return info
+    info['photo_path'], info['video_path'] = split_paths(path, info, output_dir)
+    existing = [output for output in (info['photo_path'], info['video_path']) if os.path.lexists(output)]
+    if existing:
+        info['errors'] += [f"{output} already exists" for output in existing]
+        return info
+    written = []
+    src_fd = os.open(path, os.O_RDONLY)
+    try:
+        for output, offset, count in ((info['photo_path'], 0, info['video_start']),
+                                      (info['video_path'], info['video_start'], info['video_size'])):
+            temp = transfer.temp_path(output)
+            dst_fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                assembly.copy_range(src_fd, dst_fd, offset, count)
+                os.fsync(dst_fd)
+            except BaseException:
+                os.close(dst_fd)
+                os.unlink(temp)
+                raise
+            os.close(dst_fd)
+            try:
+                transfer.commit_new(temp, output)
+            except FileExistsError:
+                # Created since the check above; the half of this pair already written goes too
+                os.unlink(temp)
+                for done in written:
+                    os.unlink(done)
+                info['errors'].append(f"{output} already exists")
+                return info
+            written.append(output)
+    finally:
+        os.close(src_fd)
+    return info
+    info['photo_path'], info['video_path'] = split_paths(path, info, output_dir)
+    src_fd = os.open(path, os.O_RDONLY)
+    try:
+        for output, offset, count in ((info['photo_path'], 0, info['video_start']),
+                                      (info['video_path'], info['video_start'], info['video_size'])):
+            temp = transfer.temp_path(output)
+            dst_fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                assembly.copy_range(src_fd, dst_fd, offset, count)
+                os.fsync(dst_fd)
+            except BaseException:
+                os.close(dst_fd)
+                os.unlink(temp)
+                raise
+            os.close(dst_fd)
+            transfer.commit(temp, output)
+    finally:
+        os.close(src_fd)
+    return info
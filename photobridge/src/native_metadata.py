@@ -0,0 +1,251 @@
+import argparse
+import datetime
+import json
+import os
+import plistlib
+import struct
+import sys
+from pathlib import Path
+
+import isobmff
+
+QUICKTIME_EPOCH_OFFSET = (66 * 365 + 17) * 24 * 3600
+CONTENT_IDENTIFIER_KEY = b'com.apple.quicktime.content.identifier'
+APPLE_MAKERNOTE_HEADER = b'Apple iOS\x00'
+
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4, 16: 8}
+TIFF_INT_FORMATS = {1: 'B', 3: 'H', 4: 'I', 6: 'b', 8: 'h', 9: 'i', 13: 'I', 16: 'Q'}
+
+EXIF_IFD_POINTER = 0x8769
+EXIF_CREATE_DATE = 0x9004
+EXIF_MAKER_NOTE = 0x927C
+APPLE_RUN_TIME = 0x0003
+APPLE_CONTENT_IDENTIFIER = 0x0011
+APPLE_LIVE_PHOTO_VIDEO_INDEX = 0x0017
+
+class UnsupportedFile(Exception):
+    pass
+
+def _read_ifd(data: bytes, ifd_offset: int, endian: str, base: int = 0) -> dict:
+    """Returns {tag: (type, count, raw value bytes)}. Value offsets are relative to base."""
+    if ifd_offset + 2 > len(data):
+        raise UnsupportedFile('IFD offset out of range')
+    count = struct.unpack_from(endian + 'H', data, ifd_offset)[0]
+    entries = {}
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(data):
+            break
+        tag, value_type, value_count = struct.unpack_from(endian + 'HHI', data, entry)
+        size = TIFF_TYPE_SIZES.get(value_type, 1) * value_count
+        if size <= 4:
+            raw = data[entry + 8:entry + 8 + size]
+        else:
+            value_offset = base + struct.unpack_from(endian + 'I', data, entry + 8)[0]
+            raw = data[value_offset:value_offset + size]
+        entries[tag] = (value_type, value_count, raw)
+    return entries
+
+def _tiff_value(entry: tuple, endian: str):
+    value_type, count, raw = entry
+    if value_type == 2:
+        return raw.split(b'\x00', 1)[0].decode('utf-8', errors='replace').strip()
+    if value_type in TIFF_INT_FORMATS and count >= 1:
+        fmt = TIFF_INT_FORMATS[value_type]
+        return struct.unpack_from(endian + fmt, raw)[0]
+    return raw
+
+def _parse_apple_makernote(note: bytes, metadata: dict):
+    if not note.startswith(APPLE_MAKERNOTE_HEADER) or len(note) < 16:
+        return
+    endian = '>' if note[12:14] == b'MM' else '<'
+    entries = _read_ifd(note, 14, endian)
+    if APPLE_CONTENT_IDENTIFIER in entries:
+        metadata['ContentIdentifier'] = _tiff_value(entries[APPLE_CONTENT_IDENTIFIER], endian)
+    if APPLE_LIVE_PHOTO_VIDEO_INDEX in entries:
+        metadata['LivePhotoVideoIndex'] = _tiff_value(entries[APPLE_LIVE_PHOTO_VIDEO_INDEX], endian)
+    if APPLE_RUN_TIME in entries:
+        try:
+            run_time = plistlib.loads(entries[APPLE_RUN_TIME][2])
+        except Exception:
+            raise UnsupportedFile('Unreadable Apple RunTime plist')
+        if isinstance(run_time, dict) and 'timescale' in run_time:
+            metadata['RunTimeScale'] = run_time['timescale']
+
+def parse_exif(tiff: bytes) -> dict:
+    """Reads CreateDate and the Apple MakerNote fields from a TIFF-structured Exif block."""
+    if tiff[:4] not in (b'MM\x00*', b'II*\x00'):
+        raise UnsupportedFile('Not a TIFF header')
+    endian = '>' if tiff[:2] == b'MM' else '<'
+    ifd0 = _read_ifd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    metadata = {}
+    if EXIF_IFD_POINTER not in ifd0:
+        return metadata
+    exif_ifd = _read_ifd(tiff, _tiff_value(ifd0[EXIF_IFD_POINTER], endian), endian)
+    if EXIF_CREATE_DATE in exif_ifd:
+        metadata['CreateDate'] = _tiff_value(exif_ifd[EXIF_CREATE_DATE], endian)
+    if EXIF_MAKER_NOTE in exif_ifd:
+        _parse_apple_makernote(exif_ifd[EXIF_MAKER_NOTE][2], metadata)
+    return metadata
+
+def read_jpeg(f) -> dict:
+    if f.read(2) != b'\xFF\xD8':
+        raise UnsupportedFile('Not a JPEG')
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise UnsupportedFile('Corrupt JPEG marker chain')
+        if marker[1] in (0xDA, 0xD9):
+            return {}
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b'Exif\x00\x00'):
+                return parse_exif(data[6:])
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+def read_heif(f, file_size: int) -> dict:
+    meta = isobmff.find_box(f, 0, file_size, b'meta')
+    if meta is None:
+        raise UnsupportedFile('HEIF without meta box')
+    payload = isobmff.read_payload(f, meta)
+    items = {}
+    locations = {}
+    idat = b''
+    for box_type, start, end in isobmff.iter_payload_boxes(payload, 4):
+        if box_type == b'iinf':
+            items = {item.item_id: item for item in isobmff.parse_iinf(payload[start:end])}
+        elif box_type == b'iloc':
+            locations = {loc.item_id: loc for loc in isobmff.parse_iloc(payload[start:end]).items}
+        elif box_type == b'idat':
+            idat = payload[start:end]
+
+    exif_item = next((item for item in items.values() if item.item_type == b'Exif'), None)
+    if exif_item is None or exif_item.item_id not in locations:
+        return {}
+    data = isobmff.read_item(f, locations[exif_item.item_id], idat)
+    tiff_offset = 4 + struct.unpack_from('>I', data, 0)[0]
+    return parse_exif(data[tiff_offset:])
+
+def _quicktime_date(seconds: int) -> str:
+    # Same conversion as exiftool: 1904 epoch, with a 1970 epoch assumed for small values
+    if seconds >= QUICKTIME_EPOCH_OFFSET:
+        seconds -= QUICKTIME_EPOCH_OFFSET
+    if seconds == 0:
+        return '0000:00:00 00:00:00'
+    moment = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+    return moment.strftime('%Y:%m:%d %H:%M:%S')
+
+def _read_keys_metadata(payload: bytes) -> dict:
+    # QuickTime 'meta' has no version/flags, but some writers add them; detect by the first child box
+    start = 4 if payload[4:8] not in (b'hdlr', b'keys', b'ilst') else 0
+    keys = []
+    values = {}
+    for box_type, box_start, box_end in isobmff.iter_payload_boxes(payload, start):
+        if box_type == b'keys':
+            offset = box_start + 8
+            while offset + 8 <= box_end:
+                size = struct.unpack_from('>I', payload, offset)[0]
+                if size < 8:
+                    break
+                keys.append(payload[offset + 8:offset + size])
+                offset += size
+        elif box_type == b'ilst':
+            for item_type, item_start, item_end in isobmff.iter_payload_boxes(payload[:box_end], box_start):
+                index = struct.unpack('>I', item_type)[0]
+                for data_type, data_start, data_end in isobmff.iter_payload_boxes(payload[:item_end], item_start):
+                    if data_type == b'data':
+                        values[index] = (struct.unpack_from('>I', payload, data_start)[0] & 0xFFFFFF,
+                                         payload[data_start + 8:data_end])
+                        break
+    result = {}
+    for index, key in enumerate(keys, start=1):
+        if index in values:
+            data_type, value = values[index]
+            result[key] = value.decode('utf-8', errors='replace') if data_type == 1 else value
+    return result
+
+def read_quicktime(f, file_size: int) -> dict:
+    moov = isobmff.find_box(f, 0, file_size, b'moov')
+    if moov is None:
+        raise UnsupportedFile('QuickTime file without moov box')
+    metadata = {}
+    for box in isobmff.iter_boxes(f, moov.payload_offset, moov.end):
+        if box.type == b'mvhd':
+            payload = isobmff.read_payload(f, box)
+            if payload[0] == 1:
+                created = struct.unpack_from('>Q', payload, 4)[0]
+            else:
+                created = struct.unpack_from('>I', payload, 4)[0]
+            metadata['CreateDate'] = _quicktime_date(created)
+        elif box.type == b'meta':
+            keys = _read_keys_metadata(isobmff.read_payload(f, box))
+            if CONTENT_IDENTIFIER_KEY in keys:
+                metadata['ContentIdentifier'] = keys[CONTENT_IDENTIFIER_KEY]
+    return metadata
+
+def read_metadata(path: str) -> dict:
+    """
+    Reads the pairing fields without exiftool, in the same record shape extract_metadata_batch returns.
+    Raises UnsupportedFile when the file needs exiftool.
+    """
+    file_path = os.path.realpath(path)
+    extension = Path(path).suffix.lower()
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = f.read(12)
+        f.seek(0)
+        try:
+            if head.startswith(b'\xFF\xD8'):
+                fields = read_jpeg(f)
+            elif head[4:8] == b'ftyp' and extension in ('.heic', '.heif'):
+                fields = read_heif(f, file_size)
+            elif head[4:8] in (b'ftyp', b'moov', b'wide', b'mdat', b'free') and extension in ('.mov', '.mp4'):
+                fields = read_quicktime(f, file_size)
+            else:
+                raise UnsupportedFile(f'No native reader for {path}')
+        except (struct.error, IndexError, ValueError) as e:
+            raise UnsupportedFile(str(e)) from e
+    if 'CreateDate' not in fields:
+        # exiftool may still find a date in XMP or elsewhere
+        raise UnsupportedFile(f'No CreateDate found natively in {path}')
+    record = {
+        'SourceFile': file_path,
+        'FilePath': file_path,
+        'FileName': Path(path).name,
+        'BaseName': Path(path).stem,
+    }
+    record.update(fields)
+    return record
+
+def compare_with_exiftool(paths: list) -> list:
+    from PhotoBridge import extract_metadata_files
+    fields = ['ContentIdentifier', 'CreateDate', 'LivePhotoVideoIndex', 'RunTimeScale']
+    reference = extract_metadata_files(paths, native=False)
+    mismatches = []
+    for path in paths:
+        try:
+            native = read_metadata(path)
+        except UnsupportedFile:
+            continue
+        expected = reference.get(native['FilePath'], {})
+        for name in fields:
+            if native.get(name) != expected.get(name):
+                mismatches.append({'path': path, 'field': name, 'native': native.get(name), 'exiftool': expected.get(name)})
+    return mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--compare', action='store_true', help='cross-check every file against exiftool')
+    parsed_args = parser.parse_args(sys.argv[1:])
+    if parsed_args.compare:
+        result = compare_with_exiftool(parsed_args.paths)
+        print(json.dumps(result, indent=2))
+        sys.exit(1 if result else 0)
+    for p in parsed_args.paths:
+        try:
+            print(json.dumps(read_metadata(p)))
+        except UnsupportedFile as e:
+            print(json.dumps({'SourceFile': p, 'Error': str(e)}))
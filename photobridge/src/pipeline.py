@@ -0,0 +1,83 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Items allowed to wait in front of each stage; a full queue makes the stage before it wait (backpressure)
+QUEUE_SIZE = 64
+
+_DONE = object()
+
+class Stage:
+    """
+    One step of an asyncio pipeline. `workers` copies of handle(stage, item) run at once, each taking items from
+    the queue in front of the stage and passing results on with `await stage.emit(item)`. Blocking calls go
+    through `await stage.run(fn, *args)`, on threads of the stage's own, so a slow disk or subprocess stage
+    never starves the others. flush(stage), if given, runs once every item has been handled.
+    """
+
+    def __init__(self, name: str, handle, workers: int = 1, flush=None):
+        self.name = name
+        self.handle = handle
+        self.workers = max(workers, 1)
+        self.flush = flush
+        self.queue = None
+        self.downstream = None
+        self.executor = None
+
+    async def emit(self, item):
+        if self.downstream is not None:
+            await self.downstream.queue.put(item)
+
+    async def run(self, fn, *args):
+        # Copies the caller's context along, as asyncio.to_thread does
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, fn, *args)
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            if item is _DONE:
+                return
+            await self.handle(self, item)
+
+    async def _drive(self):
+        await asyncio.gather(*(self._work() for _ in range(self.workers)))
+        if self.flush:
+            await self.flush(self)
+        if self.downstream is not None:
+            for _ in range(self.downstream.workers):
+                await self.downstream.queue.put(_DONE)
+
+async def run_stages(source, stages: list, queue_size: int = QUEUE_SIZE):
+    """Feeds every item of source to stages[0] and returns once all stages have drained."""
+    for stage, downstream in zip(stages, stages[1:] + [None]):
+        stage.queue = asyncio.Queue(queue_size)
+        stage.downstream = downstream
+        stage.executor = ThreadPoolExecutor(stage.workers, thread_name_prefix=stage.name)
+
+    async def feed():
+        for item in source:
+            await stages[0].queue.put(item)
+        for _ in range(stages[0].workers):
+            await stages[0].queue.put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())] + [asyncio.ensure_future(stage._drive()) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # A failing stage would leave the others blocked on their queues
+        for task in tasks:
+            task.cancel()
+        for stage in stages:
+            stage.executor.shutdown(wait=True)
+
+def parse_limits(spec: str | None, defaults: dict) -> dict:
+    """'extract=8,append=2' -> defaults with those stages' worker counts replaced."""
+    limits = dict(defaults)
+    for part in filter(None, (spec or '').split(',')):
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in limits or not value.strip().isdigit() or int(value) < 1:
+            raise ValueError(f"expected STAGE=N with STAGE one of {', '.join(limits)}, got {part!r}")
+        limits[name] = int(value)
+    return limits
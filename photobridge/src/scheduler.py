@@ -0,0 +1,48 @@
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+class InlineExecutor(Executor):
+    """Runs each task on submit; used for --jobs 1 so serial runs keep their old behaviour."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+def make_executor(jobs: int, kind: str = 'thread', initializer=None, initargs: tuple = ()) -> Executor:
+    if jobs <= 1:
+        return InlineExecutor()
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs)
+    return ThreadPoolExecutor(max_workers=jobs)
+
+def run_ordered(executor: Executor, fn, items, window: int):
+    """
+    Yields (item, result, error) in submission order while keeping at most `window` tasks in flight,
+    so callers can emit progress deterministically no matter which worker finishes first.
+    """
+    pending = deque()
+
+    def drain_one():
+        item, future = pending.popleft()
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    for item in items:
+        pending.append((item, executor.submit(fn, *item)))
+        if len(pending) >= window:
+            yield drain_one()
+        # Hand back finished work right away; items may be slow to produce (e.g. a scan still running)
+        while pending and pending[0][1].done():
+            yield drain_one()
+    while pending:
+        yield drain_one()
@@ -0,0 +1,366 @@
+import http.client
+import http.server
+import ipaddress
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+# Host headers the API answers to; anything else is a page in a browser that resolved its own name to us
+LOOPBACK_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """One submitted job: its spec, state and every event it has emitted so far."""
+
+    def __init__(self, job_id: str, spec: dict):
+        self.id = job_id
+        self.spec = spec
+        self.state = 'queued'          # queued, running, done, failed, cancelled
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self.percentage = 0.0
+        self.cancel_requested = False
+        self.changed = threading.Condition()
+
+    def emit(self, message: dict):
+        # Progress events are where a running job notices a cancel, between files or groups
+        if self.cancel_requested and message.get('type') == 'progress':
+            raise JobCancelled()
+        with self.changed:
+            if message.get('type') == 'progress':
+                self.percentage = message.get('percentage', self.percentage)
+            self.events.append(message)
+            self.changed.notify_all()
+
+    def set_state(self, state: str, error: str | None = None):
+        with self.changed:
+            self.state = state
+            self.error = error
+            if state == 'running':
+                self.started = time.time()
+            elif state != 'queued':
+                self.finished = time.time()
+            self.changed.notify_all()
+
+    @property
+    def finished_state(self) -> bool:
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def status(self) -> dict:
+        return {'id': self.id, 'state': self.state, 'error': self.error, 'spec': self.spec,
+                'percentage': self.percentage, 'events': len(self.events),
+                'created': self.created, 'started': self.started, 'finished': self.finished}
+
+class JobServer:
+    """
+    Runs submitted jobs on `max_jobs` threads, in submission order. run_job(spec, emit) does the work and reports
+    through emit; validate(spec), if given, returns an error message for specs that shouldn't be queued.
+    """
+
+    def __init__(self, run_job, max_jobs: int = 2, validate=None):
+        self.run_job = run_job
+        self.validate = validate
+        self.max_jobs = max(max_jobs, 1)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.ids = itertools.count(1)
+        self.started = time.time()
+        self.runners = [threading.Thread(target=self._runner, daemon=True) for _ in range(self.max_jobs)]
+        for runner in self.runners:
+            runner.start()
+
+    def submit(self, spec: dict) -> Job:
+        error = self.validate(spec) if self.validate else None
+        if error:
+            raise ValueError(error)
+        with self.lock:
+            job = Job(str(next(self.ids)), spec)
+            self.jobs[job.id] = job
+        self.pending.put(job)
+        return job
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel_requested = True
+        with job.changed:
+            if job.state == 'queued':
+                job.set_state('cancelled')
+        return job
+
+    def status(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+        states = {}
+        for job in jobs:
+            states[job.state] = states.get(job.state, 0) + 1
+        return {'uptime_seconds': round(time.time() - self.started, 3), 'max_jobs': self.max_jobs,
+                'jobs': states, 'pid': os.getpid()}
+
+    def _runner(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            with job.changed:
+                if job.state != 'queued':
+                    continue
+                job.set_state('running')
+            try:
+                self.run_job(job.spec, job.emit)
+                job.set_state('done')
+            except JobCancelled:
+                job.set_state('cancelled')
+            except Exception as e:
+                job.set_state('failed', f"{type(e).__name__}: {e}")
+
+    def shutdown(self):
+        for _ in self.runners:
+            self.pending.put(None)
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    POST /jobs (JSON spec) -> job status; GET /jobs, GET /jobs/ID, DELETE /jobs/ID (cancel), GET /status,
+    GET /jobs/ID/events[?from=N] -> the job's events as JSON lines, streamed until it finishes.
+    """
+    job_server = None
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+        if urlparse(f"//{self.headers.get('Host', '')}").hostname not in LOOPBACK_HOSTS:
+            self.send_json(403, {'error': 'only requests to localhost are served'})
+            return False
+        return True
+
+    def send_json(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self) -> tuple:
+        url = urlparse(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def job_or_404(self, job_id: str) -> Job | None:
+        job = self.job_server.jobs.get(job_id)
+        if job is None:
+            self.send_json(404, {'error': f"no job {job_id}"})
+        return job
+
+    def do_GET(self):
+        parts, query = self.route()
+        if parts == ['status']:
+            self.send_json(200, self.job_server.status())
+        elif parts == ['jobs']:
+            self.send_json(200, [job.status() for job in list(self.job_server.jobs.values())])
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.job_or_404(parts[1])
+            if job:
+                self.send_json(200, job.status())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self.job_or_404(parts[1])
+            if job:
+                self.stream_events(job, int(query.get('from', ['0'])[0]))
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        parts, _ = self.route()
+        if parts != ['jobs']:
+            self.send_json(404, {'error': 'not found'})
+            return
+        # A browser can't send this cross-origin without a preflight, which isn't answered
+        if self.headers.get_content_type() != 'application/json':
+            self.send_json(415, {'error': 'a job is sent as Content-Type: application/json'})
+            return
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(spec, dict):
+                raise ValueError('a job is a JSON object')
+            job = self.job_server.submit(spec)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(202, job.status())
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            job = self.job_server.cancel(parts[1])
+            if job is None:
+                self.send_json(404, {'error': f"no job {parts[1]}"})
+            else:
+                self.send_json(200, job.status())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def stream_events(self, job: Job, position: int):
+        # HTTP/1.0 without a length: the body is JSON lines and ends when the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            while True:
+                with job.changed:
+                    while position >= len(job.events) and not job.finished_state:
+                        job.changed.wait(timeout=1)
+                    events = job.events[position:]
+                    finished = job.finished_state
+                position += len(events)
+                for event in events:
+                    self.wfile.write(json.dumps(event).encode() + b'\n')
+                self.wfile.flush()
+                if finished and position >= len(job.events):
+                    break
+            self.wfile.write(json.dumps({'type': 'job', **job.status()}).encode() + b'\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def check_address(address: str):
+    """
+    Raises ValueError unless address is unix:/path (nothing there, or a socket left by an earlier server) or a
+    HOST:PORT that resolves to loopback only. Jobs move and delete files and the API has no authentication.
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.lexists(path) and not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise ValueError(f"{path} exists and is not a socket")
+        return
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ValueError(f"{address} is neither HOST:PORT nor unix:/path/to/socket")
+    try:
+        resolved = {info[4][0] for info in socket.getaddrinfo(host or '127.0.0.1', int(port), type=socket.SOCK_STREAM)}
+    except socket.gaierror as e:
+        raise ValueError(f"can't resolve {host}: {e}") from e
+    if not all(ipaddress.ip_address(ip.split('%')[0]).is_loopback for ip in resolved):
+        raise ValueError(f"{host} is not a loopback address; serve on localhost or a unix: socket")
+
+def make_http_server(address: str, job_server: JobServer):
+    """address is HOST:PORT on loopback or unix:/path/to/socket, as check_address allows."""
+    check_address(address)
+    handler = type('BoundHandler', (Handler,), {'job_server': job_server})
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.lexists(path):
+            os.unlink(path)
+        return ThreadingUnixHTTPServer(path, handler)
+    host, _, port = address.rpartition(':')
+    return http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+
+def serve(address: str, job_server: JobServer, ready=None):
+    httpd = make_http_server(address, job_server)
+    if ready:
+        ready(httpd)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        job_server.shutdown()
+        if address.startswith('unix:') and os.path.exists(address[len('unix:'):]):
+            os.unlink(address[len('unix:'):])
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def connect(address: str, timeout: float | None = None) -> http.client.HTTPConnection:
+    if address.startswith('unix:'):
+        return UnixHTTPConnection(address[len('unix:'):], timeout)
+    host, _, port = address.rpartition(':')
+    return http.client.HTTPConnection(host or '127.0.0.1', int(port), timeout=timeout)
+
+def request(address: str, method: str, path: str, body: dict | None = None):
+    connection = connect(address)
+    try:
+        data = json.dumps(body).encode() if body is not None else None
+        connection.request(method, path, body=data, headers={'Content-Type': 'application/json'} if data else {})
+        response = connection.getresponse()
+        payload = json.loads(response.read() or b'null')
+        if response.status >= 400:
+            raise RuntimeError(payload.get('error') if isinstance(payload, dict) else payload)
+        return payload
+    finally:
+        connection.close()
+
+def submit(address: str, spec: dict) -> dict:
+    return request(address, 'POST', '/jobs', spec)
+
+def status(address: str, job_id: str | None = None):
+    return request(address, 'GET', f'/jobs/{job_id}' if job_id else '/status')
+
+def cancel(address: str, job_id: str) -> dict:
+    return request(address, 'DELETE', f'/jobs/{job_id}')
+
+def events(address: str, job_id: str, position: int = 0):
+    """Yields the job's events as they happen; the last one is {"type": "job", ...} with its final status."""
+    connection = connect(address)
+    try:
+        connection.request('GET', f'/jobs/{job_id}/events?from={position}')
+        response = connection.getresponse()
+        if response.status >= 400:
+            raise RuntimeError(json.loads(response.read()).get('error'))
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    # Minimal client: server.py [--address A] submit '{"dir": ...}' | status [ID] | cancel ID | events ID
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', default=DEFAULT_ADDRESS)
+    parser.add_argument('command', choices=['submit', 'status', 'cancel', 'events'])
+    parser.add_argument('argument', nargs='?')
+    parsed_args = parser.parse_args()
+    try:
+        if parsed_args.command == 'submit':
+            print(json.dumps(submit(parsed_args.address, json.loads(parsed_args.argument or '{}'))))
+        elif parsed_args.command == 'status':
+            print(json.dumps(status(parsed_args.address, parsed_args.argument)))
+        elif parsed_args.command == 'cancel':
+            print(json.dumps(cancel(parsed_args.address, parsed_args.argument)))
+        else:
+            for event in events(parsed_args.address, parsed_args.argument):
+                print(json.dumps(event))
+                sys.stdout.flush()
+    except (OSError, RuntimeError) as e:
+        print(json.dumps({'type': 'log', 'message': f"Server request failed: {e}"}))
+        sys.exit(1)
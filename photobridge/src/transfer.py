@@ -0,0 +1,111 @@
+import errno
+import os
+import shutil
+import sys
+
+import assembly
+import metrics
+
+# Linux ioctl giving dst the same extents as src (btrfs, XFS with reflink=1, bcachefs, ...)
+FICLONE = 0x40049409
+PARTIAL_SUFFIX = '.partial'
+
+# Errors meaning "no reflink between these two files", not "the copy failed"
+NO_REFLINK_ERRNOS = assembly.UNSUPPORTED_ERRNOS | {errno.ENOTTY, errno.EPERM}
+LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EEXIST, errno.EOPNOTSUPP}
+
+def temp_path(path: str) -> str:
+    """Where a file bound for path is written before it is renamed into place: same directory, hidden."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}{PARTIAL_SUFFIX}')
+
+def commit(temp: str, path: str):
+    """Atomically replaces path with the (fsynced) temp file and makes the rename durable."""
+    os.replace(temp, path)
+    assembly.fsync_directory(os.path.dirname(path) or '.')
+
+def commit_new(temp: str, path: str):
+    """commit, except that an existing path is never replaced: FileExistsError, and temp is left to the caller."""
+    try:
+        # A hard link fails if path exists, where a rename would replace it
+        os.link(temp, path)
+    except OSError as e:
+        if e.errno == errno.EEXIST or e.errno not in LINK_FALLBACK_ERRNOS:
+            raise
+        # No hard links on this filesystem: checked first instead, which a file created meanwhile can beat
+        if os.path.lexists(path):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+        os.replace(temp, path)
+    else:
+        os.unlink(temp)
+    assembly.fsync_directory(os.path.dirname(path) or '.')
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in NO_REFLINK_ERRNOS:
+            return False
+        raise
+
+def copy_file(src_path: str, dst_path: str) -> str:
+    """Copies src to dst (reflink if the filesystem can, else kernel copy, else streamed) and fsyncs it."""
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            size = os.fstat(src_fd).st_size
+            if _reflink(src_fd, dst_fd):
+                strategy = 'reflink'
+            else:
+                methods = []
+                assembly.copy_range(src_fd, dst_fd, 0, size, methods)
+                strategy = methods[0] if methods else 'stream'
+                metrics.count('bytes_read', size)
+                metrics.count('bytes_written', size)
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src_path, dst_path)
+    return strategy
+
+def transfer(src_path: str, dst_path: str, keep_source: bool = False) -> str:
+    """
+    Puts src at dst the cheapest way that works: a rename (a hard link with keep_source) on the same filesystem,
+    otherwise a copy into a temp file next to dst that is renamed into place, then src is removed.
+    Returns the strategy used: rename, hardlink, reflink, copy_file_range, sendfile or stream.
+    """
+    strategy = None
+    try:
+        if keep_source:
+            os.link(src_path, dst_path)
+            strategy = 'hardlink'
+        else:
+            os.rename(src_path, dst_path)
+            strategy = 'rename'
+    except OSError as e:
+        # Another filesystem; for hard links also one without them, or dst already there
+        if e.errno not in (LINK_FALLBACK_ERRNOS if keep_source else {errno.EXDEV}):
+            raise
+
+    if strategy is None:
+        temp = temp_path(dst_path)
+        try:
+            strategy = copy_file(src_path, temp)
+            commit(temp, dst_path)
+        except BaseException:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+        if not keep_source:
+            os.unlink(src_path)
+    metrics.count(f'transfer_{strategy}')
+    return strategy
@@ -0,0 +1,121 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import inventory
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')   # wd, mask, cookie, len
+
+class PollingWatcher:
+    """Rescans the tree every interval and reports files whose size or mtime changed. Works everywhere."""
+    name = 'polling'
+
+    def __init__(self, directory: str, recurse: bool, interval: float = 1.0):
+        self.directory = directory
+        self.recurse = recurse
+        self.interval = interval
+        self.seen = self._snapshot()
+        self.next_scan = time.monotonic() + interval
+
+    def _snapshot(self) -> dict:
+        files = inventory.scan(self.directory, self.recurse)
+        return {path: (entry.size, entry.stat.st_mtime_ns) for path, entry in files.entries.items()}
+
+    def changes(self, timeout: float) -> set:
+        time.sleep(max(0.0, min(timeout, self.next_scan - time.monotonic())))
+        if time.monotonic() < self.next_scan:
+            return set()
+        self.next_scan = time.monotonic() + self.interval
+        current = self._snapshot()
+        changed = {path for path, key in current.items() if self.seen.get(path) != key}
+        self.seen = current
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Linux inotify through libc; new subdirectories are watched as they appear when recursing."""
+    name = 'inotify'
+
+    def __init__(self, directory: str, recurse: bool):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directory = os.path.abspath(directory)
+        self.recurse = recurse
+        self.watches = {}   # wd -> directory
+        self._add_tree(self.directory)
+
+    def _add_watch(self, directory: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        self.watches[wd] = directory
+
+    def _add_tree(self, directory: str) -> set:
+        """Watches directory (and, recursing, its subdirectories); returns the files already in it."""
+        self._add_watch(directory)
+        if not self.recurse:
+            return set()
+        found = set()
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for d in dirs:
+                self._add_watch(os.path.join(root, d))
+            found.update(os.path.join(root, f) for f in files)
+        return found
+
+    def changes(self, timeout: float) -> set:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: fall back to everything that is there
+                changed.update(inventory.scan(self.directory, self.recurse).paths())
+                continue
+            if wd not in self.watches or not name:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recurse and mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith('.'):
+                    # Files can land before the watch is in place, so report what is already there
+                    changed.update(self._add_tree(path))
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(directory: str, recurse: bool, poll_interval: float = 1.0, polling: bool = False):
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory, recurse)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory, recurse, poll_interval)
@@ -0,0 +1,183 @@
+import hashlib
+import io
+import re
+import xml.etree.ElementTree as ET
+
+X_NS = 'adobe:ns:meta/'
+RDF_NS = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+XMPNOTE_NS = 'http://ns.adobe.com/xmp/note/'
+GCAMERA_NS = 'http://ns.google.com/photos/1.0/camera/'
+CONTAINER_NS = 'http://ns.google.com/photos/1.0/container/'
+ITEM_NS = 'http://ns.google.com/photos/1.0/container/item/'
+
+NAMESPACES = {
+    'x': X_NS,
+    'rdf': RDF_NS,
+    'xmpNote': XMPNOTE_NS,
+    'GCamera': GCAMERA_NS,
+    'Container': CONTAINER_NS,
+    'Item': ITEM_NS,
+}
+
+PACKET_BEGIN = "<?xpacket begin='﻿' id='W5M0MpCehiHzreSzNTczkc9d'?>\n"
+PACKET_END = "<?xpacket end='w'?>"
+PADDING = (' ' * 99 + '\n') * 24
+
+XPACKET_PATTERN = re.compile(rb'<\?xpacket[^>]*\?>')
+
+for _prefix, _uri in NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+
+def qname(namespace: str, name: str) -> str:
+    return f'{{{namespace}}}{name}'
+
+def motion_photo_elements(video_offset: int, presentation_timestamp_us: int) -> list:
+    # Same tags, in the same order, as the exiftool -XMP-GCamera write in PhotoBridge.add_xmp_metadata
+    values = [
+        ('MicroVideo', 1),
+        ('MicroVideoOffset', video_offset),
+        ('MicroVideoPresentationTimestampUs', presentation_timestamp_us),
+        ('MicroVideoVersion', 1),
+        ('MotionPhoto', 1),
+        ('MotionPhotoPresentationTimestampUs', presentation_timestamp_us),
+        ('MotionPhotoVersion', 1),
+    ]
+    elements = []
+    for name, value in values:
+        element = ET.Element(qname(GCAMERA_NS, name))
+        element.text = str(value)
+        elements.append(element)
+    return elements
+
+def container_directory_elements(items: list) -> list:
+    """
+    Motion Photo v2 Container:Directory, one (mime, semantic, length, padding) per item in file order: the
+    primary image first, then the appended video, whose Length lets readers find it without scanning.
+    """
+    directory = ET.Element(qname(CONTAINER_NS, 'Directory'))
+    seq = ET.SubElement(directory, qname(RDF_NS, 'Seq'))
+    for mime, semantic, length, padding in items:
+        li = ET.SubElement(seq, qname(RDF_NS, 'li'), {qname(RDF_NS, 'parseType'): 'Resource'})
+        ET.SubElement(li, qname(CONTAINER_NS, 'Item'), {
+            qname(ITEM_NS, 'Mime'): mime,
+            qname(ITEM_NS, 'Semantic'): semantic,
+            qname(ITEM_NS, 'Length'): str(length),
+            qname(ITEM_NS, 'Padding'): str(padding),
+        })
+    return [directory]
+
+def parse_packet(packet: bytes) -> ET.Element:
+    body = XPACKET_PATTERN.sub(b'', packet).strip(b'\x00 \t\r\n')
+    for _, (prefix, uri) in ET.iterparse(io.BytesIO(body), events=['start-ns']):
+        if prefix and prefix not in NAMESPACES and not re.match(r'ns\d+$', prefix):
+            ET.register_namespace(prefix, uri)
+    root = ET.fromstring(body)
+    if root.tag == qname(RDF_NS, 'RDF'):
+        wrapper = ET.Element(qname(X_NS, 'xmpmeta'))
+        wrapper.append(root)
+        root = wrapper
+    return root
+
+def empty_packet() -> ET.Element:
+    root = ET.Element(qname(X_NS, 'xmpmeta'))
+    ET.SubElement(root, qname(RDF_NS, 'RDF'))
+    return root
+
+def _rdf(root: ET.Element) -> ET.Element:
+    rdf = root.find(qname(RDF_NS, 'RDF'))
+    if rdf is None:
+        rdf = ET.SubElement(root, qname(RDF_NS, 'RDF'))
+    return rdf
+
+def namespace_of(tag: str) -> str:
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
+def _description_is_empty(description: ET.Element) -> bool:
+    attributes = [a for a in description.attrib if a != qname(RDF_NS, 'about')]
+    return not attributes and len(description) == 0
+
+def merge_properties(root: ET.Element, elements: list, extended: ET.Element | None = None) -> ET.Element:
+    """Folds any extended XMP back into root and replaces every property in the elements' namespaces."""
+    rdf = _rdf(root)
+    if extended is not None:
+        for description in _rdf(extended).findall(qname(RDF_NS, 'Description')):
+            rdf.append(description)
+
+    replaced = {namespace_of(e.tag) for e in elements}
+
+    def is_replaced(tag: str) -> bool:
+        return tag == qname(XMPNOTE_NS, 'HasExtendedXMP') or namespace_of(tag) in replaced
+
+    for description in list(rdf.findall(qname(RDF_NS, 'Description'))):
+        for child in list(description):
+            if is_replaced(child.tag):
+                description.remove(child)
+        for attribute in list(description.attrib):
+            if is_replaced(attribute):
+                del description.attrib[attribute]
+        if _description_is_empty(description):
+            rdf.remove(description)
+
+    description = ET.SubElement(rdf, qname(RDF_NS, 'Description'), {qname(RDF_NS, 'about'): ''})
+    description.extend(elements)
+    return root
+
+def _serialize(root: ET.Element) -> bytes:
+    ET.indent(root, space=' ')
+    return ET.tostring(root, encoding='unicode').encode('utf-8')
+
+def wrap_packet(body: bytes, padding: bool = True) -> bytes:
+    return (PACKET_BEGIN.encode('utf-8') + body + b'\n'
+            + (PADDING.encode('utf-8') if padding else b'') + PACKET_END.encode('utf-8'))
+
+def serialize_packet(root: ET.Element, max_size: int | None = None,
+                     keep_namespaces: set | None = None) -> tuple:
+    """
+    Returns (standard_packet, extended_xmp, guid). When the packet would exceed max_size,
+    everything outside keep_namespaces is moved to an Extended XMP document keyed by its MD5 GUID.
+    """
+    packet = wrap_packet(_serialize(root))
+    if max_size is None or len(packet) <= max_size:
+        return packet, None, None
+    packet = wrap_packet(_serialize(root), padding=False)
+    if len(packet) <= max_size:
+        return packet, None, None
+
+    keep_namespaces = keep_namespaces or set()
+    standard = empty_packet()
+    standard.attrib.update(root.attrib)
+    extended = empty_packet()
+    for description in _rdf(root).findall(qname(RDF_NS, 'Description')):
+        about = description.get(qname(RDF_NS, 'about'), '')
+        kept = ET.SubElement(_rdf(standard), qname(RDF_NS, 'Description'), {qname(RDF_NS, 'about'): about})
+        moved = ET.SubElement(_rdf(extended), qname(RDF_NS, 'Description'), {qname(RDF_NS, 'about'): about})
+        for attribute, value in description.attrib.items():
+            if attribute != qname(RDF_NS, 'about'):
+                target = kept if namespace_of(attribute) in keep_namespaces else moved
+                target.set(attribute, value)
+        for child in description:
+            (kept if namespace_of(child.tag) in keep_namespaces else moved).append(child)
+        for target, parent in ((kept, standard), (moved, extended)):
+            if _description_is_empty(target):
+                _rdf(parent).remove(target)
+
+    extended_xmp = _serialize(extended)
+    guid = hashlib.md5(extended_xmp).hexdigest().upper()
+    note = ET.SubElement(_rdf(standard), qname(RDF_NS, 'Description'), {qname(RDF_NS, 'about'): ''})
+    ET.SubElement(note, qname(XMPNOTE_NS, 'HasExtendedXMP')).text = guid
+    packet = wrap_packet(_serialize(standard))
+    if len(packet) > max_size:
+        packet = wrap_packet(_serialize(standard), padding=False)
+    if len(packet) > max_size:
+        raise ValueError('XMP properties do not fit in a standard XMP packet')
+    return packet, extended_xmp, guid
+
+def extended_guid(root: ET.Element) -> str | None:
+    for description in _rdf(root).findall(qname(RDF_NS, 'Description')):
+        guid = description.get(qname(XMPNOTE_NS, 'HasExtendedXMP'))
+        if guid is None:
+            element = description.find(qname(XMPNOTE_NS, 'HasExtendedXMP'))
+            guid = element.text if element is not None else None
+        if guid:
+            return guid.strip()
+    return None
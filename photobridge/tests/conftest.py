@@ -0,0 +1,25 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+TESTS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(TESTS_DIR.parent / 'src'))
+
+GOLDEN_DIR = TESTS_DIR / 'golden'
+
+def pytest_addoption(parser):
+    parser.addoption('--update-golden', action='store_true', help='rewrite the golden files from this run')
+
+@pytest.fixture
+def golden(request):
+    """golden(name, value): value must equal tests/golden/<name>.json, or, with --update-golden, becomes it."""
+    def check(name: str, value):
+        path = GOLDEN_DIR / f'{name}.json'
+        if request.config.getoption('--update-golden'):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(value, indent=2, sort_keys=True) + '\n')
+        assert path.exists(), f'no golden file {path}; run pytest with --update-golden to write it'
+        assert value == json.loads(path.read_text())
+    return check
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import random
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+import corpus
+import exiftool_pool
+import jpeg_xmp
+import xmp
+
+CREATE_DATE = '2024:06:01 09:00:00'
+CONTENT_IDENTIFIER = '5C1A2B3D-0E4F-4A5B-8C6D-7E8F9A0B1C2D'
+VIDEO_INDEX = 1_520_000_000
+RUN_TIME_SCALE = 1_000_000_000
+
+def _exiftool_works() -> bool:
+    try:
+        return subprocess.run([str(exiftool_pool.EXIFTOOL_PATH), '-ver'], capture_output=True).returncode == 0
+    except OSError:
+        return False
+
+requires_exiftool = pytest.mark.skipif(not _exiftool_works(), reason='exiftool (and perl) not available')
+
+def exiftool(*args) -> str:
+    command = [str(exiftool_pool.EXIFTOOL_PATH), '-config', str(exiftool_pool.CONFIG_PATH), *map(str, args)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def exiftool_tags(path, *tags) -> dict:
+    """exiftool's -G1 reading of the tags, values over 200 characters as their SHA-256 so goldens stay small."""
+    record = json.loads(exiftool('-j', '-G1', *tags, path))[0]
+    record.pop('SourceFile')
+    return {name: f'sha256:{hashlib.sha256(str(value).encode()).hexdigest()}' if len(str(value)) > 200 else value
+            for name, value in record.items()}
+
+def exiftool_validate(path) -> list:
+    """The -validate summary line, then every warning."""
+    return exiftool('-a', '-s3', '-validate', '-warning', path).splitlines()
+
+def exiftool_write_motion_photo(source, output, video_offset: int, presentation_timestamp_us: int):
+    """The exiftool write PhotoBridge.add_xmp_metadata does, for a reference to compare the native one with."""
+    shutil.copyfile(source, output)
+    exiftool('-overwrite_original', '-m', '-q', '-XMP-GCamera:MicroVideo=1', '-XMP-GCamera:MicroVideoVersion=1',
+             f'-XMP-GCamera:MicroVideoOffset={video_offset}',
+             f'-XMP-GCamera:MicroVideoPresentationTimestampUs={presentation_timestamp_us}',
+             '-XMP-GCamera:MotionPhoto=1', '-XMP-GCamera:MotionPhotoVersion=1',
+             f'-XMP-GCamera:MotionPhotoPresentationTimestampUs={presentation_timestamp_us}', output)
+
+def segment(marker: int, data: bytes) -> bytes:
+    return jpeg_xmp.JpegSegment(marker, data).to_bytes()
+
+JFIF_APP0 = segment(jpeg_xmp.APP0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+
+def exif_app1(content_identifier: str | None = CONTENT_IDENTIFIER, create_date: str = CREATE_DATE) -> bytes:
+    return segment(jpeg_xmp.APP1, jpeg_xmp.EXIF_HEADER + corpus.exif_tiff(create_date, content_identifier,
+                                                                          VIDEO_INDEX, RUN_TIME_SCALE))
+
+def jpeg(*segments: bytes, scan_size: int = 2048, seed: int = 0) -> bytes:
+    """SOI, the given segments, then the corpus 8x8 baseline JPEG's own tables and scan."""
+    scan = random.Random(seed).randbytes(scan_size).replace(b'\xFF', b'\xFE')
+    return corpus.JPEG_HEAD[:2] + b''.join(segments) + corpus.JPEG_HEAD[2:] + scan + corpus.JPEG_TAIL
+
+def xmp_app1(body: str) -> bytes:
+    return segment(jpeg_xmp.APP1, jpeg_xmp.XMP_HEADER + xmp.wrap_packet(body.encode('utf-8')))
+
+def extended_xmp_app1s(standard_body: str, extended_body: str) -> list:
+    """A standard packet pointing at extended_body by its GUID, and extended_body cut into APP1 chunks."""
+    extended = extended_body.encode('utf-8')
+    guid = hashlib.md5(extended).hexdigest().upper()
+    note = f'<rdf:Description rdf:about="" xmlns:xmpNote="{xmp.XMPNOTE_NS}" xmpNote:HasExtendedXMP="{guid}"/>'
+    segments = [xmp_app1(standard_body.replace('</rdf:RDF>', note + '</rdf:RDF>'))]
+    for offset in range(0, len(extended), 60000):
+        header = jpeg_xmp.EXTENDED_XMP_HEADER + guid.encode('ascii') + struct.pack('>II', len(extended), offset)
+        segments.append(segment(jpeg_xmp.APP1, header + extended[offset:offset + 60000]))
+    return segments
+
+def rdf(*descriptions: str) -> str:
+    return (f'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="{xmp.RDF_NS}">'
+            + ''.join(descriptions) + '</rdf:RDF></x:xmpmeta>')
@@ -0,0 +1,91 @@
+import os
+import random
+
+import pytest
+
+import assembly
+import corpus
+import jpeg_xmp
+import motion_photo
+import xmp
+from support import CONTENT_IDENTIFIER, CREATE_DATE, exiftool_tags, requires_exiftool
+
+@pytest.fixture
+def pair(tmp_path):
+    photo = tmp_path / 'IMG_0001.JPG'
+    photo.write_bytes(corpus.make_jpeg(CREATE_DATE, CONTENT_IDENTIFIER, 1_520_000_000, size=300_000,
+                                       rng=random.Random(1)))
+    video = tmp_path / 'IMG_0001.MOV'
+    video.write_bytes(corpus.make_mov(CREATE_DATE, CONTENT_IDENTIFIER, size=3_000_000, rng=random.Random(2)))
+    return photo, video
+
+def assemble(photo, video, output) -> list:
+    elements = xmp.motion_photo_elements(video.stat().st_size, 1_520_000)
+    written = assembly.assemble_jpeg_motion_photo(str(photo), str(video), str(output), elements)
+    assert written == output.stat().st_size
+    return elements
+
+def test_jpeg_motion_photo_is_tagged_photo_then_video(tmp_path, pair):
+    photo, video = pair
+    output = tmp_path / 'IMG_0001.MP.JPG'
+    elements = assemble(photo, video, output)
+    assert output.read_bytes() == jpeg_xmp.inject_xmp(photo.read_bytes(), elements) + video.read_bytes()
+    info = motion_photo.inspect(str(output))
+    assert info['errors'] == []
+    assert info['video_size'] == video.stat().st_size
+
+@requires_exiftool
+def test_exiftool_finds_the_video(tmp_path, pair):
+    photo, video = pair
+    output = tmp_path / 'IMG_0001.MP.JPG'
+    assemble(photo, video, output)
+    tags = exiftool_tags(output, '-XMP-GCamera:MicroVideoOffset', '-ContentIdentifier')
+    assert tags == {'XMP-GCamera:MicroVideoOffset': video.stat().st_size, 'Apple:ContentIdentifier': CONTENT_IDENTIFIER}
+
+@pytest.mark.parametrize('available', [{'copy_file_range': False}, {'copy_file_range': False, 'sendfile': False}])
+def test_falls_back_when_the_kernel_copy_is_missing(tmp_path, pair, monkeypatch, available):
+    for name, supported in available.items():
+        monkeypatch.setitem(assembly._kernel_copy_supported, name, supported)
+    photo, video = pair
+    output = tmp_path / 'IMG_0001.MP.JPG'
+    assemble(photo, video, output)
+    assert output.read_bytes().endswith(video.read_bytes())
+
+def test_copy_range_finishes_a_partial_kernel_copy(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.write_bytes(random.Random(3).randbytes(5 * assembly.CHUNK_SIZE // 2))
+    real = assembly._kernel_copy
+    # The kernel stops a third of the way in, as it may on some filesystems; the rest is streamed
+    monkeypatch.setattr(assembly, '_kernel_copy', lambda name, src, dst, offset, count:
+                        real(name, src, dst, offset, count // 3) if name == 'copy_file_range' else 0)
+    methods = []
+    src_fd = os.open(source, os.O_RDONLY)
+    dst_fd = os.open(tmp_path / 'copy', os.O_WRONLY | os.O_CREAT)
+    try:
+        os.write(dst_fd, b'head')
+        assembly.copy_range(src_fd, dst_fd, 10, source.stat().st_size - 10, methods)
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    assert (tmp_path / 'copy').read_bytes() == b'head' + source.read_bytes()[10:]
+    assert methods == (['copy_file_range', 'stream'] if assembly._kernel_copy_supported['copy_file_range']
+                       else ['stream'])
+
+def test_copy_range_refuses_a_short_source(tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'x' * 100)
+    src_fd = os.open(source, os.O_RDONLY)
+    dst_fd = os.open(tmp_path / 'copy', os.O_WRONLY | os.O_CREAT)
+    try:
+        with pytest.raises(OSError, match='short copy'):
+            assembly.copy_range(src_fd, dst_fd, 50, 100)
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+
+def test_append_video(tmp_path, pair):
+    _, video = pair
+    output = tmp_path / 'tagged.png'
+    output.write_bytes(b'tagged copy written by exiftool')
+    assert assembly.append_video(str(output), str(video)) == video.stat().st_size
+    assert output.read_bytes() == b'tagged copy written by exiftool' + video.read_bytes()
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+
+import pytest
+
+import corpus
+import dedup
+import journal
+import manifest
+import PhotoBridge
+import server
+import transfer
+
+PAIRS = 30
+
+def test_cancellation_holds_the_cancel_back():
+    events = []
+
+    def emit(message: dict):
+        # As a --serve job's emit does once DELETE has been called
+        if message.get('type') == 'progress' and len(events) >= 2:
+            raise server.JobCancelled()
+        events.append(message)
+    token = PhotoBridge._event_sink.set(emit)
+    try:
+        cancellation = PhotoBridge.Cancellation()
+        cancellation.progress("first", 10)
+        cancellation.raise_if_requested()
+        PhotoBridge.emit_log("between")
+        cancellation.progress("second", 20)
+        assert cancellation.requested
+        # Logs still go out while the run settles what it started; progress no longer does
+        cancellation.progress("third", 30)
+        PhotoBridge.emit_log("settled")
+        with pytest.raises(server.JobCancelled) as raised:
+            cancellation.raise_if_requested()
+        assert raised.value is cancellation.error
+    finally:
+        PhotoBridge._event_sink.reset(token)
+    assert [event['message'] for event in events] == ["first", "between", "settled"]
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Every manifest and dedup index opened during the test."""
+    opened = []
+    for cls in (manifest.Manifest, dedup.DedupIndex):
+        init = cls.__init__
+
+        def record(self, path, init=init):
+            init(self, path)
+            opened.append(self)
+        monkeypatch.setattr(cls, '__init__', record)
+    return opened
+
+def cancel_after(groups: int, results: list | None = None):
+    """
+    An event sink that cancels the job, as a DELETE does, once `groups` groups (or pairs) have been processed.
+    Result lines go to results.
+    """
+    processed = []
+
+    def emit(message: dict):
+        if message.get('type') == 'result' and results is not None:
+            results.append(message)
+        if message.get('type') != 'progress':
+            return
+        if len(processed) >= groups:
+            raise server.JobCancelled()
+        if message['message'].startswith(('Processing group', 'Processing pair')):
+            processed.append(message)
+    return emit
+
+@pytest.mark.parametrize('use_pipeline, jobs', [(False, 1), (False, 2), (True, 2)])
+def test_cancel_settles_started_groups_and_closes_connections(tmp_path, connections, use_pipeline, jobs):
+    source, output = tmp_path / 'import', tmp_path / 'output'
+    output.mkdir()
+    pairs = corpus.generate_corpus(str(source), PAIRS, photo_size=20_000, video_size=50_000,
+                                   missing_identifier_ratio=0, rollover_ratio=0)
+    spec = {'dir': str(source), 'output': str(output), 'jobs': jobs, 'pipeline': use_pipeline,
+            'manifest': str(tmp_path / 'manifest.sqlite'), 'dedup': 'skip'}
+    with pytest.raises(server.JobCancelled):
+        PhotoBridge.run_job(spec, cancel_after(2))
+
+    assert len(connections) == 2
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.db.execute('SELECT 1')
+
+    muxed = 0
+    for pair in pairs:
+        motion_photo = PhotoBridge.get_motion_photo_path(pair['photo'], str(output))
+        sources = [os.path.exists(pair['photo']), os.path.exists(pair['video'])]
+        # Whole pairs only: a Motion Photo with its sources gone, or the sources with no Motion Photo
+        assert sources == ([False, False] if motion_photo.exists() else [True, True]), pair['photo']
+        muxed += motion_photo.exists()
+    assert 2 <= muxed < PAIRS
+    assert not [name for name in os.listdir(output) if name.endswith(transfer.PARTIAL_SUFFIX)]
+    # Nothing was left half done for --resume to finish or roll back
+    assert journal.recover(str(output / journal.JOURNAL_NAME))[1] == {'completed': 0, 'rolled_back': 0}
+
+    PhotoBridge.run_job(dict(spec, resume=True), lambda message: None)
+    assert all(PhotoBridge.get_motion_photo_path(pair['photo'], str(output)).exists() for pair in pairs)
+    assert not any(os.path.exists(pair['photo']) or os.path.exists(pair['video']) for pair in pairs)
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_cancel_settles_started_pairs(tmp_path, jobs):
+    source, output = tmp_path / 'import', tmp_path / 'output'
+    output.mkdir()
+    pairs = corpus.generate_corpus(str(source), PAIRS, photo_size=20_000, video_size=50_000,
+                                   missing_identifier_ratio=0, rollover_ratio=0)
+    spec = {'pairs': [{'photo': pair['photo'], 'video': pair['video']} for pair in pairs], 'output': str(output),
+            'jobs': jobs}
+    results = []
+    with pytest.raises(server.JobCancelled):
+        PhotoBridge.run_job(spec, cancel_after(2, results))
+
+    muxed = []
+    for pair in pairs:
+        motion_photo = PhotoBridge.get_motion_photo_path(pair['photo'], str(output))
+        sources = [os.path.exists(pair['photo']), os.path.exists(pair['video'])]
+        assert sources == ([False, False] if motion_photo.exists() else [True, True]), pair['photo']
+        if motion_photo.exists():
+            muxed.append(str(motion_photo.absolute()))
+    assert 2 <= len(muxed) < PAIRS
+    # Every Motion Photo written has its result line, and nothing else does
+    assert [result['output'] for result in results] == muxed
+    assert all(result['success'] for result in results)
+    assert not [name for name in os.listdir(output) if name.endswith(transfer.PARTIAL_SUFFIX)]
@@ -0,0 +1,118 @@
+import os
+import shutil
+
+import pytest
+
+import corpus
+import dedup
+import PhotoBridge
+
+PAIRS = 3
+
+@pytest.fixture
+def pristine(tmp_path):
+    """A card's worth of pairs, copied into a new import folder for each run."""
+    directory = tmp_path / 'card'
+    pairs = corpus.generate_corpus(str(directory), PAIRS, photo_size=400_000, video_size=300_000,
+                                   missing_identifier_ratio=0, rollover_ratio=0)
+    return directory, pairs
+
+def import_copy(pristine, destination, rename: str | None = None) -> list:
+    """Copies the card into destination, IMG_ names replaced by rename, and returns the copied paths."""
+    directory, _ = pristine
+    destination.mkdir()
+    copied = []
+    for path in sorted(directory.iterdir()):
+        target = destination / (path.name.replace('IMG_', rename) if rename else path.name)
+        shutil.copy2(path, target)
+        copied.append(target)
+    return copied
+
+def run(directory, output, mode: str, use_pipeline: bool = False) -> list:
+    """Runs a --dir job and returns its log lines."""
+    events = []
+    PhotoBridge.run_job({'dir': str(directory), 'output': str(output), 'dedup': mode, 'pipeline': use_pipeline},
+                        events.append)
+    return [event['message'] for event in events if event['type'] == 'log']
+
+def dedup_line(logs: list) -> str:
+    return next(line for line in logs if line.startswith('Dedup:'))
+
+def motion_photos(output) -> dict:
+    return {path.name: path.stat() for path in output.iterdir() if '.MP.' in path.name}
+
+@pytest.mark.parametrize('use_pipeline', [False, True])
+def test_repeated_import_is_skipped(tmp_path, pristine, use_pipeline):
+    output = tmp_path / 'output'
+    output.mkdir()
+    import_copy(pristine, tmp_path / 'first')
+    logs = run(tmp_path / 'first', output, 'skip', use_pipeline)
+    assert dedup_line(logs) == (f"Dedup: 0 identical pairs skipped, {PAIRS} new pairs recorded, "
+                                "0 sampled matches rejected by the full hash, 0 stale entries dropped")
+    made = motion_photos(output)
+    assert len(made) == PAIRS
+
+    again = import_copy(pristine, tmp_path / 'again')
+    logs = run(tmp_path / 'again', output, 'skip', use_pipeline)
+    assert dedup_line(logs) == (f"Dedup: {PAIRS} identical pairs skipped, 0 new pairs recorded, "
+                                "0 sampled matches rejected by the full hash, 0 stale entries dropped")
+    # Already done: the sources go, and the Motion Photos aren't written again
+    assert not any(path.exists() for path in again)
+    assert {name: (stat.st_ino, stat.st_mtime_ns) for name, stat in motion_photos(output).items()} == {
+        name: (stat.st_ino, stat.st_mtime_ns) for name, stat in made.items()}
+
+@pytest.mark.parametrize('use_pipeline', [False, True])
+def test_hardlink_mode_links_the_existing_motion_photo(tmp_path, pristine, use_pipeline):
+    output = tmp_path / 'output'
+    output.mkdir()
+    import_copy(pristine, tmp_path / 'first')
+    run(tmp_path / 'first', output, 'hardlink', use_pipeline)
+
+    again = import_copy(pristine, tmp_path / 'again', rename='COPY_')
+    logs = run(tmp_path / 'again', output, 'hardlink', use_pipeline)
+    assert dedup_line(logs).startswith(f"Dedup: {PAIRS} identical pairs hard linked, 0 new pairs recorded")
+    assert not any(path.exists() for path in again)
+    for pair in pristine[1]:
+        name = os.path.basename(pair['photo'])
+        original = output / PhotoBridge.get_motion_photo_path(name, '').name
+        linked = output / PhotoBridge.get_motion_photo_path(name.replace('IMG_', 'COPY_'), '').name
+        assert linked.stat().st_ino == original.stat().st_ino
+        assert f"Hard linked {linked.absolute()} to {original.absolute()}" in logs
+
+@pytest.mark.parametrize('use_pipeline', [False, True])
+def test_sampled_match_with_other_content_is_muxed(tmp_path, pristine, use_pipeline):
+    output = tmp_path / 'output'
+    output.mkdir()
+    import_copy(pristine, tmp_path / 'first')
+    run(tmp_path / 'first', output, 'skip', use_pipeline)
+
+    again = import_copy(pristine, tmp_path / 'again', rename='EDIT_')
+    photo = next(path for path in again if path.name == 'EDIT_0000.JPG')
+    data = bytearray(photo.read_bytes())
+    # Between the sampled chunks at the start and in the middle, so only the full hash sees it
+    at = 100_000
+    assert dedup.SAMPLE_SIZE < at < len(data) // 2 - dedup.SAMPLE_SIZE // 2
+    data[at] ^= 0xFF
+    photo.write_bytes(bytes(data))
+
+    logs = run(tmp_path / 'again', output, 'skip', use_pipeline)
+    assert dedup_line(logs) == (f"Dedup: {PAIRS - 1} identical pairs skipped, 1 new pairs recorded, "
+                                "1 sampled matches rejected by the full hash, 0 stale entries dropped")
+    edited = output / 'EDIT_0000.MP.JPG'
+    assert edited.exists() and not (output / 'EDIT_0001.MP.JPG').exists()
+    assert bytes(data[at - 100:at + 100]) in edited.read_bytes()
+    assert not any(path.exists() for path in again)
+
+def test_a_changed_output_is_not_a_match(tmp_path, pristine):
+    output = tmp_path / 'output'
+    output.mkdir()
+    import_copy(pristine, tmp_path / 'first')
+    run(tmp_path / 'first', output, 'skip')
+    touched = output / 'IMG_0000.MP.JPG'
+    os.utime(touched, ns=(0, 0))
+
+    import_copy(pristine, tmp_path / 'again', rename='COPY_')
+    logs = run(tmp_path / 'again', output, 'skip')
+    assert dedup_line(logs) == (f"Dedup: {PAIRS - 1} identical pairs skipped, 1 new pairs recorded, "
+                                "0 sampled matches rejected by the full hash, 1 stale entries dropped")
+    assert (output / 'COPY_0000.MP.JPG').exists()
@@ -0,0 +1,107 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+import events
+import PhotoBridge
+
+class Stream(io.StringIO):
+    """Records each write, as a stand-in for stdout."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+    def messages(self) -> list:
+        return [json.loads(line) for line in self.getvalue().splitlines()]
+
+def log(text: str) -> dict:
+    return {'type': 'log', 'message': text}
+
+def progress(percentage: float) -> dict:
+    return {'type': 'progress', 'message': f'{percentage}%', 'percentage': percentage}
+
+def wait_for(condition, seconds: float = 5.0):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_progress_is_coalesced_and_nothing_else_is_dropped():
+    stream = Stream()
+    emitter = events.Emitter(stream, progress_rate=10)
+    sent = []
+    for step in range(2000):
+        emitter.emit(progress(step / 20))
+        if step % 7 == 0:
+            sent.append(log(f'line {step}'))
+            emitter.emit(sent[-1])
+    emitter.emit(progress(100))
+    summary = emitter.close()
+
+    written = stream.messages()
+    assert [message for message in written if message['type'] == 'log'] == sent
+    percentages = [message['percentage'] for message in written if message['type'] == 'progress']
+    # Far fewer than were sent, never going backwards, and the final one always
+    assert len(percentages) < 50 and percentages == sorted(percentages) and percentages[-1] == 100
+    assert written[-1] == {'type': 'metric', 'name': 'events', **summary}
+    assert summary['events'] == 2000 + len(sent) + 1
+    assert summary['lines'] == len(written)
+    assert summary['progress_coalesced'] == 2001 - len(percentages)
+    assert summary['writes'] == stream.writes < summary['lines']
+
+def test_events_from_many_threads_keep_their_order():
+    stream = Stream()
+    emitter = events.Emitter(stream, progress_rate=5, flush_seconds=0.001)
+
+    def send(name: str):
+        for step in range(500):
+            emitter.emit(progress(step / 5))
+            emitter.emit(log(f'{name} {step}'))
+    threads = [threading.Thread(target=send, args=(f'thread {index}',)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    emitter.close()
+
+    lines = [message['message'] for message in stream.messages() if message['type'] == 'log']
+    for index in range(4):
+        assert [line for line in lines if line.startswith(f'thread {index} ')] == [
+            f'thread {index} {step}' for step in range(500)]
+
+def test_a_quiet_run_is_flushed_in_the_background():
+    stream = Stream()
+    emitter = events.Emitter(stream, progress_rate=10, flush_seconds=0.01)
+    emitter.emit(progress(1))
+    emitter.emit(log('one line'))
+    # Held back by the rate, then let out by the flush thread rather than the next event
+    emitter.emit(progress(2))
+    wait_for(lambda: [message.get('percentage') for message in stream.messages()] == [1, None, 2])
+    emitter.close()
+
+@pytest.mark.parametrize('progress_rate', [0, 10])
+def test_events_file_gets_every_event_in_order(tmp_path, progress_rate):
+    path = tmp_path / 'events.ndjson'
+    sent = [log(f'line {step}') for step in range(events.BATCH_LINES * 3 + 5)]
+    with PhotoBridge.event_output(str(path), progress_rate) as emitter:
+        for message in sent:
+            PhotoBridge.emit_log(message['message'])
+        PhotoBridge.emit_progress('Complete!', 100)
+    written = [json.loads(line) for line in path.read_text().splitlines()]
+    assert written[:len(sent)] == sent
+    assert written[len(sent)] == {'type': 'progress', 'message': 'Complete!', 'percentage': 100}
+    assert written[-1]['name'] == 'events' and len(written) == len(sent) + 2
+    counts = emitter.counts
+    if progress_rate:
+        # Written in batches of up to BATCH_LINES, not a write per line
+        assert counts['writes'] < counts['lines'] // 10
+    else:
+        assert counts['writes'] == counts['lines'] == len(written)
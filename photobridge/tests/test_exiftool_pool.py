@@ -0,0 +1,72 @@
+import pytest
+
+import exiftool_pool
+import PhotoBridge
+from support import requires_exiftool
+
+pytestmark = requires_exiftool
+
+@pytest.fixture
+def pool():
+    pool = exiftool_pool.ExifToolPool(2)
+    yield pool
+    pool.close()
+
+@pytest.fixture
+def worker():
+    worker = exiftool_pool.ExifToolWorker()
+    yield worker
+    worker.stop()
+
+def kill(worker):
+    worker.process.kill()
+    worker.process.wait()
+
+def test_sentinels_split_one_command_from_the_next(worker, tmp_path):
+    version = worker.execute(['-ver'])
+    assert version.returncode == 0 and version.stderr == ''
+    assert version.stdout.strip().replace('.', '').isdigit()
+    # Output that looks like a sentinel, and a failure, don't run into the next command's answer
+    echoed = worker.execute(['-echo', '{ready1}', '-echo2', '{status1}', '-ver'])
+    assert echoed.returncode == 0
+    assert echoed.stdout.splitlines() == ['{ready1}', version.stdout.strip()]
+    assert echoed.stderr.strip() == '{status1}'
+    missing = worker.execute([str(tmp_path / 'missing.jpg')])
+    assert missing.returncode != 0 and 'File not found' in missing.stderr
+    assert worker.execute(['-ver']) == version
+    assert worker.spawn_count == 1
+
+def test_newlines_are_refused(worker):
+    with pytest.raises(ValueError):
+        worker.execute(['-ver\n-execute'])
+    assert worker.process is None
+
+def test_a_crashed_worker_is_restarted_by_execute(pool):
+    version = pool.execute(['-ver'])
+    worker = next(worker for worker in pool.workers if worker.process)
+    kill(worker)
+    assert pool.execute(['-ver']) == version
+    assert worker.is_alive()
+    assert pool.spawn_count == 2
+
+def test_health_check_replaces_dead_workers(pool):
+    pool.warm()
+    first, second = pool.workers
+    kill(first)
+    assert sorted(pool.health_check()) == [False, True]
+    assert first.is_alive() and second.is_alive()
+    assert pool.spawn_count == 3
+    assert pool.health_check() == [True, True]
+
+def test_health_check_leaves_unstarted_workers_alone(pool):
+    assert pool.health_check() == [True, True]
+    assert pool.spawn_count == 0
+
+def test_served_jobs_start_with_a_healthy_pool(monkeypatch, pool, tmp_path):
+    monkeypatch.setattr(exiftool_pool, '_pool', pool)
+    pool.warm()
+    kill(pool.workers[0])
+    events = []
+    PhotoBridge.run_served_job({'dir': str(tmp_path)}, events.append)
+    assert events[0]['message'] == "Restarted 1 exiftool worker(s) (3 started since launch)"
+    assert all(worker.is_alive() for worker in pool.workers)
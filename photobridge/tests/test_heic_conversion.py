@@ -0,0 +1,107 @@
+import shlex
+import sys
+import types
+
+import pytest
+
+import macos_heic_to_jpg
+
+HEIC = b'\x00\x00\x00\x18ftypheic' + b'heic image' * 10
+OLDER_JPG = b'\xff\xd8an unrelated photo\xff\xd9'
+
+# A stand-in converter: copies input to output, or writes half an output and fails for names containing BAD
+CONVERTER = '''
+import sys
+source, target = sys.argv[1:]
+data = open(source, 'rb').read()
+with open(target, 'wb') as f:
+    f.write(b'JPEG:' + data[:len(data) // 2 if 'BAD' in source else None])
+sys.exit(1 if 'BAD' in source else 0)
+'''
+
+def command_backend(tmp_path):
+    script = tmp_path / 'converter.py'
+    script.write_text(CONVERTER)
+    command = ' '.join(shlex.quote(part) for part in (sys.executable, str(script)))
+    return macos_heic_to_jpg.CommandBackend(command + ' {input} {output}')
+
+@pytest.fixture
+def card(tmp_path):
+    directory = tmp_path / 'card'
+    directory.mkdir()
+    for name in ('IMG_0001.HEIC', 'IMG_0002.HEIC', 'IMG_BAD.HEIC'):
+        (directory / name).write_bytes(HEIC)
+    return directory
+
+@pytest.fixture
+def fake_pillow_heif(monkeypatch):
+    """pillow_heif and PIL.Image enough for PillowHeifBackend: the save writes half the file, then fails on BAD."""
+    class FakeImage:
+        info = {'exif': b'Exif\x00\x00'}
+
+        def __init__(self, path):
+            self.path = str(path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def save(self, target, format, **options):
+            assert format == 'JPEG' and options == {'quality': 100, 'exif': b'Exif\x00\x00'}
+            with open(target, 'wb') as f:
+                f.write(b'JPEG:' + HEIC[:len(HEIC) // 2])
+                if 'BAD' in self.path:
+                    raise OSError('decoder error')
+                f.write(HEIC[len(HEIC) // 2:])
+
+    image = types.SimpleNamespace(open=FakeImage)
+    monkeypatch.setitem(sys.modules, 'pillow_heif', types.SimpleNamespace(register_heif_opener=lambda: None))
+    monkeypatch.setitem(sys.modules, 'PIL', types.SimpleNamespace(Image=image))
+    monkeypatch.setitem(sys.modules, 'PIL.Image', image)
+    return macos_heic_to_jpg.PillowHeifBackend()
+
+@pytest.fixture(params=['command', 'pillow-heif'])
+def backend(request, tmp_path):
+    if request.param == 'command':
+        return command_backend(tmp_path)
+    return request.getfixturevalue('fake_pillow_heif')
+
+def test_backend_converts_and_reports_failures(card, backend):
+    logs = []
+    results = macos_heic_to_jpg.convert_files(sorted(card.iterdir()), backend=backend, log=logs.append)
+    assert results == {str(card / 'IMG_0001.HEIC'): str(card / 'IMG_0001.JPG'),
+                       str(card / 'IMG_0002.HEIC'): str(card / 'IMG_0002.JPG'),
+                       str(card / 'IMG_BAD.HEIC'): None}
+    assert (card / 'IMG_0001.JPG').read_bytes() == b'JPEG:' + HEIC
+    # The failed source stays, and neither its half-written output nor a temp file is left behind
+    assert sorted(path.name for path in card.iterdir()) == ['IMG_0001.JPG', 'IMG_0002.JPG', 'IMG_BAD.HEIC']
+    assert logs[-1] == f"Converted 2 of 3 HEIC files with {backend.name}"
+
+def test_existing_jpeg_is_never_replaced(card, backend):
+    # --pairs and --photo runs don't rename clashing HEICs first, as --dir runs do
+    for name in ('IMG_0001.JPG', 'IMG_BAD.JPG'):
+        (card / name).write_bytes(OLDER_JPG)
+    logs = []
+    results = macos_heic_to_jpg.convert_files(sorted(card.glob('*.HEIC')), backend=backend, log=logs.append)
+    assert results[str(card / 'IMG_0001.HEIC')] is None and results[str(card / 'IMG_BAD.HEIC')] is None
+    assert (card / 'IMG_0001.JPG').read_bytes() == OLDER_JPG and (card / 'IMG_BAD.JPG').read_bytes() == OLDER_JPG
+    assert (card / 'IMG_0001.HEIC').exists() and (card / 'IMG_BAD.HEIC').exists()
+    assert f"HEIC conversion failed for {card / 'IMG_0001.HEIC'}: IMG_0001.JPG already exists" in logs
+    assert not [path for path in card.iterdir() if path.name.startswith('.')]
+
+def test_a_jpeg_appearing_during_conversion_is_kept(card, tmp_path):
+    backend = command_backend(tmp_path)
+    convert = backend.convert
+
+    def convert_then_clash(jobs):
+        errors = convert(jobs)
+        (card / 'IMG_0002.JPG').write_bytes(OLDER_JPG)
+        return errors
+    backend.convert = convert_then_clash
+    results = macos_heic_to_jpg.convert_files([card / 'IMG_0002.HEIC'], backend=backend, log=lambda message: None)
+    assert results == {str(card / 'IMG_0002.HEIC'): None}
+    assert (card / 'IMG_0002.JPG').read_bytes() == OLDER_JPG
+    assert sorted(path.name for path in card.iterdir()) == ['IMG_0001.HEIC', 'IMG_0002.HEIC', 'IMG_0002.JPG',
+                                                            'IMG_BAD.HEIC']
@@ -0,0 +1,192 @@
+import io
+import random
+import struct
+
+import pytest
+
+import assembly
+import corpus
+import heif_xmp
+import isobmff
+import motion_photo
+import xmp
+from support import (CONTENT_IDENTIFIER, CREATE_DATE, RUN_TIME_SCALE, VIDEO_INDEX, exiftool_tags,
+                     exiftool_validate, exiftool_write_motion_photo, requires_exiftool)
+
+VIDEO_OFFSET = 3_000_000
+EXIF = b'\x00\x00\x00\x06Exif\x00\x00' + corpus.exif_tiff(CREATE_DATE, CONTENT_IDENTIFIER, VIDEO_INDEX, RUN_TIME_SCALE)
+
+def build_heic(items: list, base_offsets: bool = False, iloc_version: int = 1, before_meta: bytes = b'',
+               after: bytes = b'') -> bytes:
+    """
+    A HEIC with (item_id, item_type, data, construction_method) items, the first one primary and the rest
+    describing it. Method 0 items go in an mdat after the meta box, located by extent offsets or, with
+    base_offsets, by a base offset plus an extent offset into the mdat; method 1 items go in idat.
+    """
+    ftyp = isobmff.make_box(b'ftyp', b'heic\x00\x00\x00\x00mif1heic')
+    primary = items[0][0]
+    wide = any(item_id > 0xFFFF for item_id, *_ in items)
+    iinf = isobmff.make_full_box(b'iinf', 0, 0, struct.pack('>H', len(items)) + b''.join(
+        isobmff.build_infe(isobmff.ItemInfo(item_id, item_type)) for item_id, item_type, *_ in items))
+    id_format = 'I' if wide else 'H'
+    iref = isobmff.make_full_box(b'iref', 1 if wide else 0, 0, b''.join(
+        isobmff.make_box(b'cdsc', struct.pack(f'>{id_format}H{id_format}', item_id, 1, primary))
+        for item_id, *_ in items[1:]))
+    stored = [(item_id, data) for item_id, _, data, method in items if method == 0]
+    idat = b''.join(data for _, _, data, method in items if method == 1)
+    head = (isobmff.make_full_box(b'hdlr', 0, 0, b'\x00' * 4 + b'pict' + b'\x00' * 13)
+            + isobmff.make_full_box(b'pitm', 0, 0, struct.pack('>H', primary)) + iinf + iref)
+
+    def meta(mdat_payload: int) -> bytes:
+        locations = []
+        position = idat_position = 0
+        for item_id, _, data, method in items:
+            if method == 1:
+                locations.append(isobmff.ItemLocation(item_id, 1, 0, 0, [(0, idat_position, len(data))]))
+                idat_position += len(data)
+            elif base_offsets:
+                locations.append(isobmff.ItemLocation(item_id, 0, 0, mdat_payload, [(0, position, len(data))]))
+                position += len(data)
+            else:
+                locations.append(isobmff.ItemLocation(item_id, 0, 0, 0, [(0, mdat_payload + position, len(data))]))
+                position += len(data)
+        iloc = isobmff.build_iloc(isobmff.ItemLocationTable(iloc_version, 4, 4, 4 if base_offsets else 0, 0,
+                                                            locations))
+        return isobmff.make_full_box(b'meta', 0, 0, head + iloc + (isobmff.make_box(b'idat', idat) if idat else b''))
+
+    mdat_payload = len(ftyp) + len(before_meta) + len(meta(0)) + 8
+    return (ftyp + before_meta + meta(mdat_payload) + isobmff.make_box(b'mdat', b''.join(d for _, d in stored))
+            + after)
+
+def image(size: int = 20_000) -> bytes:
+    return random.Random(size).randbytes(size)
+
+def read_items(data: bytes) -> tuple:
+    """({child box type: payload} of the meta box, {item_id: (ItemInfo, item bytes)})."""
+    f = io.BytesIO(data)
+    meta = isobmff.find_box(f, 0, len(data), b'meta')
+    payload = isobmff.read_payload(f, meta)
+    boxes = {box_type: payload[start:end] for box_type, start, end in isobmff.iter_payload_boxes(payload, 4)}
+    locations = {loc.item_id: loc for loc in isobmff.parse_iloc(boxes[b'iloc']).items}
+    items = {item.item_id: (item, isobmff.read_item(f, locations[item.item_id], boxes.get(b'idat', b'')))
+             for item in isobmff.parse_iinf(boxes[b'iinf'])}
+    return boxes, items
+
+def references(iref: bytes) -> list:
+    id_format = 'H' if iref[0] == 0 else 'I'
+    size = struct.calcsize(f'>{id_format}')
+    found = []
+    for box_type, start, end in isobmff.iter_payload_boxes(iref, 4):
+        from_id, count = struct.unpack_from(f'>{id_format}H', iref, start)
+        found += [(box_type, from_id, to_id) for to_id in struct.unpack_from(f'>{count}{id_format}', iref,
+                                                                             start + size + 2)]
+    return found
+
+def tag(data: bytes, video_offset: int = VIDEO_OFFSET) -> bytes:
+    elements = xmp.motion_photo_elements(video_offset, 1_520_000)
+    header, resume_offset = heif_xmp.build_tagged_header(io.BytesIO(data), len(data), elements)
+    return header + data[resume_offset:]
+
+def xmp_items(items: dict) -> list:
+    return [(info, payload) for info, payload in items.values() if heif_xmp._is_xmp_item(info)]
+
+LAYOUTS = {
+    'extent_offsets': lambda: build_heic([(1, b'hvc1', image(), 0), (2, b'Exif', EXIF, 0)]),
+    'base_offsets': lambda: build_heic([(1, b'hvc1', image(), 0), (2, b'Exif', EXIF, 0)], base_offsets=True),
+    'idat_item': lambda: build_heic([(1, b'hvc1', image(), 0), (2, b'Exif', EXIF, 1)]),
+    'iloc_version_0': lambda: build_heic([(1, b'hvc1', image(), 0), (2, b'Exif', EXIF, 0)], iloc_version=0),
+    'corpus': lambda: corpus.make_heic(CREATE_DATE, CONTENT_IDENTIFIER, VIDEO_INDEX, RUN_TIME_SCALE, 50_000,
+                                       random.Random(1)),
+}
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_items_survive_the_rewrite(layout):
+    source = LAYOUTS[layout]()
+    (boxes_before, before), (boxes, after) = read_items(source), read_items(tag(source))
+    for item_id, item in before.items():
+        assert after[item_id] == item, item_id
+    (info, packet), = xmp_items(after)
+    assert info.item_id == max(before) + 1
+    assert xmp.parse_packet(packet).find(f'.//{xmp.qname(xmp.GCAMERA_NS, "MicroVideoOffset")}').text == \
+        str(VIDEO_OFFSET)
+
+    primary = struct.unpack_from('>H', boxes[b'pitm'], 4)[0]
+    assert references(boxes[b'iref']) == references(boxes_before[b'iref']) + [(b'cdsc', info.item_id, primary)]
+    assert struct.unpack_from('>H', boxes[b'iinf'], 4)[0] == len(before) + 1 == len(after)
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_media_data_is_copied_unchanged(layout):
+    source = LAYOUTS[layout]()
+    header, resume_offset = heif_xmp.build_tagged_header(io.BytesIO(source), len(source),
+                                                         xmp.motion_photo_elements(VIDEO_OFFSET, 0))
+    meta = isobmff.find_box(io.BytesIO(source), 0, len(source), b'meta')
+    assert resume_offset == meta.end
+    assert header[:meta.offset] == source[:meta.offset]
+    # The rewritten meta, then a small mdat holding only the XMP packet
+    boxes = list(isobmff.iter_boxes(io.BytesIO(header), 0, len(header)))
+    assert [box.type for box in boxes] == [b'ftyp', b'meta', b'mdat']
+
+def test_tagging_twice_replaces_the_xmp_item():
+    once = tag(LAYOUTS['extent_offsets'](), 1000)
+    twice = tag(once, 2000)
+    (once_boxes, once_items), (twice_boxes, twice_items) = read_items(once), read_items(twice)
+    (first, _), = xmp_items(once_items)
+    (second, packet), = xmp_items(twice_items)
+    assert second.item_id == first.item_id
+    assert twice_boxes[b'iinf'] == once_boxes[b'iinf'] and twice_boxes[b'iref'] == once_boxes[b'iref']
+    assert xmp.parse_packet(packet).find(f'.//{xmp.qname(xmp.GCAMERA_NS, "MicroVideoOffset")}').text == '2000'
+    assert twice_items[2] == once_items[2]
+
+def test_item_ids_past_16_bits_widen_iref():
+    source = build_heic([(1, b'hvc1', image(), 0), (0xFFFF, b'Exif', EXIF, 0)])
+    boxes, after = read_items(tag(source))
+    (info, _), = xmp_items(after)
+    assert info.item_id == 0x10000
+    assert boxes[b'iref'][0] == 1
+    assert references(boxes[b'iref']) == [(b'cdsc', 0xFFFF, 1), (b'cdsc', 0x10000, 1)]
+    assert after[0xFFFF] == read_items(source)[1][0xFFFF]
+
+@pytest.mark.parametrize('source, message', [
+    (lambda: build_heic([(1, b'hvc1', image(), 0)], after=isobmff.make_box(b'moov', b'')), 'moov'),
+    (lambda: build_heic([(1, b'hvc1', image(), 0)], after=isobmff.make_box(b'moof', b'')), 'moof'),
+    (lambda: build_heic([(1, b'hvc1', image(), 0)], before_meta=isobmff.make_box(b'mdat', b'early')),
+     'media data before the meta box'),
+    (lambda: isobmff.make_box(b'ftyp', b'heic\x00\x00\x00\x00mif1') + isobmff.make_box(b'mdat', b''),
+     'without meta box'),
+    (lambda: isobmff.make_box(b'free', b'') + build_heic([(1, b'hvc1', image(), 0)]), 'missing ftyp'),
+])
+def test_unsupported_layouts_raise(source, message):
+    with pytest.raises(ValueError, match=message):
+        tag(source())
+
+@pytest.fixture
+def motion_photo_file(tmp_path):
+    photo = tmp_path / 'IMG_0001.HEIC'
+    photo.write_bytes(LAYOUTS['base_offsets']())
+    video = tmp_path / 'IMG_0001.MOV'
+    video.write_bytes(corpus.make_mov(CREATE_DATE, CONTENT_IDENTIFIER, 200_000, random.Random(2)))
+    output = tmp_path / 'IMG_0001.MP.HEIC'
+    assembly.assemble_heif_motion_photo(str(photo), str(video), str(output),
+                                        xmp.motion_photo_elements(video.stat().st_size, 1_520_000))
+    return photo, video, output
+
+def test_motion_photo_inspects_clean(motion_photo_file):
+    _, video, output = motion_photo_file
+    info = motion_photo.inspect(str(output))
+    assert info['errors'] == []
+    assert (info['format'], info['video_size']) == ('heif', video.stat().st_size)
+
+@requires_exiftool
+def test_exiftool_reads_the_rewritten_file(motion_photo_file):
+    photo, video, output = motion_photo_file
+    assert exiftool_tags(output, '-XMP-GCamera:all', '-Apple:ContentIdentifier', '-ExifIFD:CreateDate') == {
+        'Apple:ContentIdentifier': CONTENT_IDENTIFIER, 'ExifIFD:CreateDate': CREATE_DATE,
+        'XMP-GCamera:MicroVideo': 1, 'XMP-GCamera:MicroVideoOffset': video.stat().st_size,
+        'XMP-GCamera:MicroVideoPresentationTimestampUs': 1_520_000, 'XMP-GCamera:MicroVideoVersion': 1,
+        'XMP-GCamera:MotionPhoto': 1, 'XMP-GCamera:MotionPhotoPresentationTimestampUs': 1_520_000,
+        'XMP-GCamera:MotionPhotoVersion': 1}
+    # The same Motion Photo by way of exiftool, as PhotoBridge writes it when the native path can't
+    reference = output.with_name('IMG_0001.exiftool.HEIC')
+    exiftool_write_motion_photo(photo, reference, video.stat().st_size, 1_520_000)
+    assembly.append_video(str(reference), str(video))
+    assert exiftool_validate(output) == exiftool_validate(reference)
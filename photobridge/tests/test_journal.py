@@ -0,0 +1,147 @@
+import os
+
+import pytest
+
+import corpus
+import journal
+import PhotoBridge
+import transfer
+
+@pytest.fixture
+def run(tmp_path):
+    """A journal in tmp_path/output and a way to make pairs of sources for it."""
+    output = tmp_path / 'output'
+    output.mkdir()
+    path = str(output / journal.JOURNAL_NAME)
+
+    def pair(name: str) -> tuple:
+        sources = [tmp_path / f'{name}.JPG', tmp_path / f'{name}.MOV']
+        for source in sources:
+            source.write_bytes(name.encode())
+        return [str(source) for source in sources], str(output / f'{name}.MP.JPG')
+    return path, pair
+
+def snapshot(directory) -> dict:
+    return {str(path): path.read_bytes() for path in sorted(directory.rglob('*')) if path.is_file()}
+
+def test_recover_settles_each_entry(tmp_path, run):
+    path, pair = run
+    run_journal = journal.Journal(path)
+    entries = {name: pair(name) for name in ('committed', 'planned', 'renamed', 'written', 'done', 'abandoned')}
+    for sources, output in entries.values():
+        run_journal.plan(sources, output)
+
+    # Renamed into place and committed; the run died before removing the sources
+    sources, output = entries['committed']
+    open(output, 'wb').close()
+    run_journal.commit(sources[0])
+    # Still being written: only the temp file exists
+    sources, output = entries['planned']
+    open(transfer.temp_path(output), 'wb').close()
+    # Renamed and one source removed, but the commit record never reached the disk
+    sources, output = entries['renamed']
+    open(output, 'wb').close()
+    os.unlink(sources[0])
+    # Renamed, but no source removed: nothing proves the rename was the last step, so it is redone
+    sources, output = entries['written']
+    open(output, 'wb').close()
+    open(transfer.temp_path(output), 'wb').close()
+    # Finished before the crash
+    sources, output = entries['done']
+    open(output, 'wb').close()
+    run_journal.commit(sources[0])
+    for source in sources:
+        os.unlink(source)
+    run_journal.done(sources[0])
+    run_journal.abandon(entries['abandoned'][0][0])
+    run_journal.file.close()
+
+    finished, counts = journal.recover(path)
+    assert counts == {'completed': 2, 'rolled_back': 2}
+    assert finished == {os.path.abspath(entries[name][1]) for name in ('committed', 'renamed', 'done')}
+    for name in ('committed', 'renamed', 'done'):
+        sources, output = entries[name]
+        assert os.path.exists(output) and not any(map(os.path.exists, sources)), name
+    for name in ('planned', 'written', 'abandoned'):
+        sources, output = entries[name]
+        assert all(map(os.path.exists, sources)) and not os.path.exists(transfer.temp_path(output)), name
+
+def test_recover_twice_changes_nothing_more(tmp_path, run):
+    path, pair = run
+    run_journal = journal.Journal(path)
+    committed, planned = pair('committed'), pair('planned')
+    run_journal.plan(*committed)
+    run_journal.plan(*planned)
+    open(committed[1], 'wb').close()
+    run_journal.commit(committed[0][0])
+    open(transfer.temp_path(planned[1]), 'wb').close()
+    run_journal.file.close()
+
+    first = journal.recover(path)
+    files = snapshot(tmp_path)
+    second = journal.recover(path)
+    assert snapshot(tmp_path) == files
+    assert second[0] == first[0] == {os.path.abspath(committed[1])}
+
+def test_truncated_last_line_is_ignored(tmp_path, run):
+    path, pair = run
+    run_journal = journal.Journal(path)
+    committed, planned = pair('committed'), pair('planned')
+    run_journal.plan(*committed)
+    open(committed[1], 'wb').close()
+    run_journal.commit(committed[0][0])
+    run_journal.plan(*planned)
+    run_journal.file.close()
+    # The plan of the second pair was cut short by the crash
+    with open(path, 'rb+') as f:
+        f.truncate(os.path.getsize(path) - 20)
+
+    finished, counts = journal.recover(path)
+    assert (finished, counts) == ({os.path.abspath(committed[1])}, {'completed': 1, 'rolled_back': 0})
+    assert all(map(os.path.exists, planned[0]))
+
+def test_finished_outputs_are_carried_over(tmp_path, run):
+    path, pair = run
+    earlier = {str(tmp_path / 'output' / 'IMG_0001.MP.JPG'), str(tmp_path / 'output' / 'IMG_0002.MP.HEIC')}
+    run_journal = journal.Journal(path, earlier)
+    moved = pair('moved')
+    run_journal.plan(moved[0][:1], moved[1], kind='move')
+    run_journal.done(moved[0][0])
+    run_journal.close()
+
+    finished, counts = journal.recover(path)
+    # Moves of unmatched files aren't Motion Photos, so they aren't skipped by the next run
+    assert finished == earlier
+    assert counts == {'completed': 0, 'rolled_back': 0}
+    # And from the journal of the run that resumed, should it be interrupted too
+    journal.Journal(path, finished).close()
+    assert journal.recover(path)[0] == earlier
+
+@pytest.mark.parametrize('resume', [False, True])
+def test_a_new_run_settles_the_interrupted_one_first(tmp_path, resume):
+    card, output = tmp_path / 'card', tmp_path / 'output'
+    output.mkdir()
+    corpus.generate_corpus(str(card), 2, photo_size=20_000, video_size=30_000, missing_identifier_ratio=0)
+    interrupted = journal.Journal(str(output / journal.JOURNAL_NAME))
+    # One group committed with only its photo removed, one still being written
+    half_removed = [str(card / 'IMG_0000.JPG'), str(card / 'IMG_0000.MOV')]
+    interrupted.plan(half_removed, str(output / 'IMG_0000.MP.JPG'))
+    (output / 'IMG_0000.MP.JPG').write_bytes(b'the interrupted run\'s Motion Photo')
+    interrupted.commit(half_removed[0])
+    os.unlink(half_removed[0])
+    writing = [str(card / 'IMG_0001.JPG'), str(card / 'IMG_0001.MOV')]
+    interrupted.plan(writing, str(output / 'IMG_0001.MP.JPG'))
+    open(transfer.temp_path(str(output / 'IMG_0001.MP.JPG')), 'wb').close()
+    interrupted.file.close()
+
+    events = []
+    PhotoBridge.run_job({'dir': str(card), 'output': str(output), 'resume': resume}, events.append)
+    logs = [event['message'] for event in events if event['type'] == 'log']
+    expected = ("Resuming: 1 interrupted groups completed, 1 rolled back, 1 finished Motion Photos skipped" if resume
+                else f"Found the journal of an interrupted run in {output}: 1 interrupted groups completed, "
+                     "1 rolled back; starting over (--resume also skips its 1 finished Motion Photos)")
+    assert expected in logs
+    # The half-removed group's video isn't moved as unmatched, and no temp file is left behind
+    assert sorted(path.name for path in output.iterdir()) == ['IMG_0000.MP.JPG', 'IMG_0001.MP.JPG']
+    assert (output / 'IMG_0000.MP.JPG').read_bytes() == b'the interrupted run\'s Motion Photo'
+    assert not list(card.iterdir())
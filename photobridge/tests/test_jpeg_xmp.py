@@ -0,0 +1,121 @@
+import hashlib
+import io
+import random
+import struct
+
+import pytest
+
+import jpeg_xmp
+import xmp
+from support import (JFIF_APP0, exif_app1, exiftool_tags, exiftool_validate, exiftool_write_motion_photo,
+                     extended_xmp_app1s, jpeg, rdf, requires_exiftool, xmp_app1)
+
+VIDEO_OFFSET = 3_000_000
+PRESENTATION_TIMESTAMP_US = 1_520_000
+
+EXISTING = ('<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" '
+            f'xmlns:GCamera="{xmp.GCAMERA_NS}" xmp:Rating="5" GCamera:MicroVideoOffset="1"/>'
+            '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            '<dc:creator><rdf:Seq><rdf:li>Photo Bridge</rdf:li></rdf:Seq></dc:creator></rdf:Description>')
+# About 100 KB of words, so the merged packet can only be written with Extended XMP
+LONG_TEXT = ' '.join(f'{random.Random(7).getrandbits(40):x}{i}' for i in range(8000))
+LARGE = ('<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:description><rdf:Alt>'
+         f'<rdf:li xml:lang="x-default">{LONG_TEXT}</rdf:li></rdf:Alt></dc:description></rdf:Description>')
+
+CASES = {
+    'jfif': lambda: jpeg(JFIF_APP0),
+    'app0_exif': lambda: jpeg(JFIF_APP0, exif_app1()),
+    'existing_xmp': lambda: jpeg(JFIF_APP0, exif_app1(), xmp_app1(rdf(EXISTING))),
+    'extended_xmp': lambda: jpeg(exif_app1(), *extended_xmp_app1s(rdf(EXISTING), rdf(LARGE))),
+}
+
+def native_write(source: bytes) -> bytes:
+    return jpeg_xmp.inject_xmp(source, xmp.motion_photo_elements(VIDEO_OFFSET, PRESENTATION_TIMESTAMP_US))
+
+def segments(data: bytes) -> list:
+    return jpeg_xmp.read_segments(io.BytesIO(data))[0]
+
+def write_case(tmp_path, name: str) -> tuple:
+    source = tmp_path / f'{name}.jpg'
+    source.write_bytes(CASES[name]())
+    native = tmp_path / f'{name}.native.jpg'
+    native.write_bytes(native_write(source.read_bytes()))
+    return source, native
+
+@requires_exiftool
+@pytest.mark.parametrize('name', CASES)
+def test_matches_golden(tmp_path, golden, name):
+    _, native = write_case(tmp_path, name)
+    golden(f'jpeg_xmp/{name}', {'tags': exiftool_tags(native, '-XMP:all'), 'validate': exiftool_validate(native)})
+
+@requires_exiftool
+@pytest.mark.parametrize('name', CASES)
+def test_matches_exiftool_write(tmp_path, name):
+    source, native = write_case(tmp_path, name)
+    reference = tmp_path / f'{name}.exiftool.jpg'
+    exiftool_write_motion_photo(source, reference, VIDEO_OFFSET, PRESENTATION_TIMESTAMP_US)
+    assert exiftool_tags(native, '-XMP-GCamera:all') == exiftool_tags(reference, '-XMP-GCamera:all')
+    assert exiftool_validate(native) == exiftool_validate(reference)
+
+@pytest.mark.parametrize('name', CASES)
+def test_leaves_everything_else_alone(name):
+    source = CASES[name]()
+    output = native_write(source)
+    before, scan_offset = jpeg_xmp.read_segments(io.BytesIO(source))
+    after, output_scan_offset = jpeg_xmp.read_segments(io.BytesIO(output))
+    other = lambda found: [s for s in found if not (s.is_xmp() or s.is_extended_xmp())]
+    assert other(after) == other(before)
+    assert output[output_scan_offset:] == source[scan_offset:]
+    # The XMP goes right after APP0 and Exif, before the tables
+    xmp_at = next(i for i, s in enumerate(after) if s.is_xmp())
+    assert all(s.marker == jpeg_xmp.APP0 or s.is_exif() for s in after[:xmp_at])
+
+def test_existing_xmp_is_merged():
+    output = native_write(CASES['existing_xmp']())
+    standard = [s for s in segments(output) if s.is_xmp()]
+    assert len(standard) == 1
+    root = xmp.parse_packet(standard[0].data[len(jpeg_xmp.XMP_HEADER):])
+    values = {element.tag: element.text for element in root.iter()}
+    attributes = {name: value for element in root.iter() for name, value in element.attrib.items()}
+    assert attributes[xmp.qname('http://ns.adobe.com/xap/1.0/', 'Rating')] == '5'
+    assert 'Photo Bridge' in values.values()
+    assert values[xmp.qname(xmp.GCAMERA_NS, 'MicroVideoOffset')] == str(VIDEO_OFFSET)
+    assert xmp.qname(xmp.GCAMERA_NS, 'MicroVideoOffset') not in attributes
+
+def test_extended_xmp_chunks():
+    found = segments(native_write(CASES['extended_xmp']()))
+    standard = [s for s in found if s.is_xmp()]
+    chunks = [s.data[len(jpeg_xmp.EXTENDED_XMP_HEADER):] for s in found if s.is_extended_xmp()]
+    assert len(standard) == 1 and len(chunks) >= 2
+    assert all(len(s.to_bytes()) <= 0xFFFF + 2 for s in found)
+
+    root = xmp.parse_packet(standard[0].data[len(jpeg_xmp.XMP_HEADER):])
+    guid = xmp.extended_guid(root)
+    totals = {struct.unpack('>I', chunk[32:36])[0] for chunk in chunks}
+    offsets = [struct.unpack('>I', chunk[36:40])[0] for chunk in chunks]
+    extended = b''.join(chunk[40:] for chunk in chunks)
+    assert {chunk[:32].decode('ascii') for chunk in chunks} == {guid}
+    assert totals == {len(extended)}
+    assert offsets == list(range(0, len(extended), jpeg_xmp.EXTENDED_CHUNK_SIZE))
+    assert guid == hashlib.md5(extended).hexdigest().upper()
+
+    # The Motion Photo tags stay in the standard packet, where every reader looks; the long text moved out
+    standard_tags = {element.tag for element in root.iter()}
+    assert xmp.qname(xmp.GCAMERA_NS, 'MicroVideoOffset') in standard_tags
+    assert LONG_TEXT in ''.join(xmp.parse_packet(extended).itertext())
+    assert LONG_TEXT not in ''.join(root.itertext())
+
+@requires_exiftool
+def test_extended_xmp_reassembles_in_exiftool(tmp_path):
+    _, native = write_case(tmp_path, 'extended_xmp')
+    assert exiftool_tags(native, '-XMP-dc:Description') == exiftool_tags(tmp_path / 'extended_xmp.jpg',
+                                                                        '-XMP-dc:Description')
+
+@pytest.mark.parametrize('length', [0, 1])
+def test_segment_length_below_two_is_refused_before_reading(length):
+    data = jpeg(JFIF_APP0) + b'rest of the file' * 1000
+    at = data.index(JFIF_APP0) + len(JFIF_APP0)
+    f = io.BytesIO(data[:at] + b'\xff\xe1' + struct.pack('>H', length) + data[at:])
+    with pytest.raises(ValueError, match=f'Invalid JPEG segment length {length} at offset {at}'):
+        jpeg_xmp.read_segments(f)
+    assert f.tell() == at + 4
@@ -0,0 +1,127 @@
+import os
+import shutil
+
+import pytest
+
+import corpus
+import manifest
+import metrics
+import PhotoBridge
+
+RECORD = {'FileName': 'IMG_0001.JPG', 'CreateDate': '2024:06:01 09:00:00'}
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = manifest.Manifest(str(tmp_path / 'manifest.sqlite'))
+    yield cache
+    cache.db.close()
+
+def test_metadata_is_kept_between_runs(tmp_path):
+    path = tmp_path / 'IMG_0001.JPG'
+    path.write_bytes(b'photo')
+    cache = manifest.Manifest(str(tmp_path / 'manifest.sqlite'))
+    cache.store_metadata(str(path), os.stat(path), RECORD)
+    cache.close()
+    cache = manifest.Manifest(str(tmp_path / 'manifest.sqlite'))
+    assert cache.cached_metadata(str(path), os.stat(path)) == RECORD
+    cache.close()
+
+@pytest.mark.parametrize('change', ['size', 'mtime_ns', 'inode'])
+def test_a_changed_file_is_read_again(tmp_path, cache, change):
+    path = tmp_path / 'IMG_0001.JPG'
+    path.write_bytes(b'photo')
+    cache.store_metadata(str(path), os.stat(path), RECORD)
+    before = os.stat(path)
+    if change == 'size':
+        path.write_bytes(b'photo, edited')
+        os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns))
+    elif change == 'mtime_ns':
+        os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns + 1))
+    else:
+        # Same bytes and times under a new inode, as a copy back from a backup gives
+        shutil.copy2(path, tmp_path / 'copy')
+        os.replace(tmp_path / 'copy', path)
+    after = os.stat(path)
+    assert [manifest.file_key(after)[i] == manifest.file_key(before)[i] for i in range(3)] == [
+        part != change for part in ('size', 'mtime_ns', 'inode')]
+    assert cache.cached_metadata(str(path), after) is None
+
+def test_a_move_keeps_the_metadata(tmp_path, cache):
+    path = tmp_path / 'IMG_0001.MOV'
+    path.write_bytes(b'video')
+    cache.store_metadata(str(path), os.stat(path), RECORD)
+    moved = tmp_path / 'output.MOV'
+    os.rename(path, moved)
+    cache.moved(str(path), str(moved))
+    assert cache.cached_metadata(str(moved), os.stat(moved)) == RECORD
+    assert cache.cached_metadata(str(path), os.stat(moved)) is None
+
+@pytest.mark.parametrize('change', [None, 'photo', 'video', 'output', 'output removed'])
+def test_existing_output(tmp_path, cache, change):
+    photo, video, output = tmp_path / 'IMG_0001.JPG', tmp_path / 'IMG_0001.MOV', tmp_path / 'IMG_0001.MP.JPG'
+    for path in (photo, video, output):
+        path.write_bytes(path.name.encode())
+    cache.record_output(str(photo), os.stat(photo), str(video), os.stat(video), str(output))
+    assert cache.is_output(str(output), os.stat(output))
+    if change == 'output removed':
+        output.unlink()
+    elif change:
+        path = {'photo': photo, 'video': video, 'output': output}[change]
+        os.utime(path, ns=(0, 0))
+    expected = str(output) if change is None else None
+    assert cache.existing_output(str(photo), str(video)) == expected
+
+def run(directory, output, manifest_path) -> tuple:
+    """Runs a --dir job; returns its log lines and the files it read natively."""
+    events = []
+    with metrics.capture() as collected:
+        PhotoBridge.run_job({'dir': str(directory), 'output': str(output), 'manifest': str(manifest_path)},
+                            events.append)
+    logs = [event['message'] for event in events if event['type'] == 'log']
+    return logs, collected.counters.get('files_extracted_native', 0)
+
+def cache_line(logs: list) -> str:
+    return next(line for line in logs if line.startswith('Metadata cache:'))
+
+def test_second_run_reads_only_new_files(tmp_path):
+    card = tmp_path / 'card'
+    corpus.generate_corpus(str(card), 3, photo_size=20_000, video_size=30_000, missing_identifier_ratio=0)
+    (card / 'LONELY.MOV').write_bytes(corpus.make_mov('2024:06:01 09:00:00', 'NO-PHOTO', size=30_000))
+    manifest_path = tmp_path / 'manifest.sqlite'
+    # Motion Photos and the unmatched video stay in the tree the next run walks
+    logs, extracted = run(card, card, manifest_path)
+    assert cache_line(logs) == "Metadata cache: 0 cached, 7 extracted, 0 previous outputs skipped"
+    assert extracted == 7
+
+    corpus.generate_corpus(str(tmp_path / 'more'), 1, photo_size=20_000, video_size=30_000,
+                           missing_identifier_ratio=0, seed=9)
+    for path in (tmp_path / 'more').iterdir():
+        os.rename(path, card / path.name.replace('IMG_0000', 'IMG_0100'))
+    logs, extracted = run(card, card, manifest_path)
+    assert cache_line(logs) == "Metadata cache: 1 cached, 2 extracted, 3 previous outputs skipped"
+    assert extracted == 2
+    assert (card / 'IMG_0100.MP.JPG').exists() and (card / 'LONELY.MOV').exists()
+
+@pytest.mark.parametrize('touched', [None, 'IMG_0000.JPG'])
+def test_a_finished_pair_is_not_muxed_again(tmp_path, touched):
+    card, backup, output = tmp_path / 'card', tmp_path / 'backup', tmp_path / 'output'
+    corpus.generate_corpus(str(card), 2, photo_size=20_000, video_size=30_000, missing_identifier_ratio=0)
+    backup.mkdir()
+    output.mkdir()
+    # Hard links: the sources come back after the run with their size, mtime and inode unchanged
+    for path in card.iterdir():
+        os.link(path, backup / path.name)
+    run(card, output, tmp_path / 'manifest.sqlite')
+    made = {path.name: path.stat().st_mtime_ns for path in output.iterdir()}
+    for path in backup.iterdir():
+        os.link(path, card / path.name)
+    if touched:
+        os.utime(card / touched, ns=(0, 0))
+
+    logs, _ = run(card, output, tmp_path / 'manifest.sqlite')
+    reused = [line for line in logs if line.startswith('Already muxed into')]
+    assert len(reused) == (1 if touched else 2)
+    assert not list(card.iterdir())
+    remade = {path.name: path.stat().st_mtime_ns for path in output.iterdir()}
+    assert (remade['IMG_0000.MP.JPG'] != made['IMG_0000.MP.JPG']) == bool(touched)
+    assert remade['IMG_0001.MP.JPG'] == made['IMG_0001.MP.JPG']
@@ -0,0 +1,126 @@
+import random
+import re
+from collections import defaultdict
+from pathlib import Path
+
+import pytest
+
+import benchmark
+import PhotoBridge
+
+DAY = '2024:06:01 10:00:00'
+NEXT_DAY = '2024:06:02 10:00:00'
+
+def legacy_group_files_by_contentidentifier(files: list) -> dict:
+    # The pre-index implementation, kept as the reference the indexed grouping must agree with
+    groups = defaultdict(list)
+    photos = [f for f in files if f['type'] == 'photo']
+    for file in files:
+        content_identifier = file['metadata'].get('ContentIdentifier')
+        if content_identifier:
+            groups[content_identifier].append(file)
+        elif file['type'] == 'video':
+            video_filename = Path(file['path']).stem
+            pattern = re.compile(rf'^{re.escape(video_filename)}(_\d+)?$')
+            matching_photos = [p for p in photos if pattern.match(Path(p['path']).stem)]
+            matched = False
+            for photo in matching_photos:
+                video_date = PhotoBridge.get_date_part(file['metadata'].get('CreateDate', ''))
+                photo_date = PhotoBridge.get_date_part(photo['metadata'].get('CreateDate', ''))
+                if video_date and photo_date and video_date == photo_date:
+                    pid = photo['metadata'].get('ContentIdentifier')
+                    if pid:
+                        groups[pid].append(file)
+                    else:
+                        groups[(video_date, Path(photo['path']).stem)].append(file)
+                    matched = True
+                    break
+            if not matched:
+                groups['unmatched_videos'].append(file)
+        else:
+            date_part = PhotoBridge.get_date_part(file['metadata'].get('CreateDate', ''))
+            if date_part:
+                groups[(date_part, Path(file['path']).stem)].append(file)
+            else:
+                groups['no_identifier'].append(file)
+    return groups
+
+def entry(name: str, create_date: str | None = DAY, content_identifier: str | None = None) -> dict:
+    metadata = {}
+    if create_date is not None:
+        metadata['CreateDate'] = create_date
+    if content_identifier:
+        metadata['ContentIdentifier'] = content_identifier
+    kind = 'video' if name.endswith('.MOV') else 'photo'
+    return {'path': f'/import/{name}', 'metadata': metadata, 'type': kind}
+
+EDGE_CASES = [
+    # Paired by ContentIdentifier, and a tagged video with no photo at all
+    entry('IMG_0001.JPG', content_identifier='A'), entry('IMG_0001.MOV', content_identifier='A'),
+    entry('IMG_0099.MOV', content_identifier='ORPHAN'),
+    # By stem and day, to a photo with and without a ContentIdentifier
+    entry('IMG_0002.JPG'), entry('IMG_0002.MOV'),
+    entry('IMG_0003.JPG', content_identifier='B'), entry('IMG_0003.MOV'),
+    # _N stems: the video answers to suffixed photos, not the other way round
+    entry('IMG_0004_2.JPG', content_identifier='C'), entry('IMG_0004.MOV'),
+    entry('IMG_0005_10.JPG'), entry('IMG_0005.MOV'),
+    entry('IMG_0006.JPG'), entry('IMG_0006_1.MOV'),
+    entry('IMG_0007_1.JPG'), entry('IMG_0007_1.MOV'),
+    # Several photos for one stem: the first one in input order wins
+    entry('IMG_0008.JPG', content_identifier='D'), entry('IMG_0008_1.JPG', content_identifier='E'),
+    entry('IMG_0008_2.JPG'), entry('IMG_0008.MOV'),
+    entry('IMG_0009_3.JPG'), entry('IMG_0009_1.JPG', NEXT_DAY), entry('IMG_0009.MOV', NEXT_DAY),
+    # Missing, blank and mismatched dates
+    entry('IMG_0010.JPG', None), entry('IMG_0010.MOV', None),
+    entry('IMG_0011.JPG', None, content_identifier='F'), entry('IMG_0011.MOV'),
+    entry('IMG_0012.JPG'), entry('IMG_0012.MOV', '   '),
+    entry('IMG_0013.JPG', '  '), entry('IMG_0013.MOV', ''),
+    entry('IMG_0014.JPG'), entry('IMG_0014.MOV', NEXT_DAY),
+    # Names that mean something in a regular expression
+    entry('IMG+15 (copy).JPG'), entry('IMG+15 (copy).MOV'), entry('IMG.16.JPG'), entry('IMGx16.MOV'),
+]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_edge_cases_group_as_before(seed):
+    files = EDGE_CASES[:]
+    random.Random(seed).shuffle(files)
+    assert dict(PhotoBridge.group_files_by_contentidentifier(files)) == dict(
+        legacy_group_files_by_contentidentifier(files))
+
+@pytest.mark.parametrize('missing_identifier_ratio', [0.0, 0.3, 1.0])
+def test_synthetic_entries_group_as_before(missing_identifier_ratio):
+    files = benchmark.synthetic_entries(2000, missing_identifier_ratio)
+    assert dict(PhotoBridge.group_files_by_contentidentifier(files)) == dict(
+        legacy_group_files_by_contentidentifier(files))
+
+ROLLOVER = [
+    # The video's CreateDate crossed midnight; the photo's didn't
+    entry('IMG_0100.JPG', '2024:06:01 23:59:00'), entry('IMG_0100.MOV', '2024:06:02 00:30:00'),
+    # Candidates on the days either side: the nearer in time wins
+    entry('IMG_0101.JPG', '2024:06:01 20:00:00'), entry('IMG_0101_1.JPG', '2024:06:03 06:00:00'),
+    entry('IMG_0101.MOV', '2024:06:02 12:00:00'),
+    # Three and a half hours apart
+    entry('IMG_0102.JPG', '2024:06:01 21:00:00'), entry('IMG_0102.MOV', '2024:06:02 00:30:00'),
+    # Unreadable time of day: only the exact-day match applies
+    entry('IMG_0103.JPG', '2024:06:01 23:59:00'), entry('IMG_0103.MOV', '2024:06:02 xx:00:00'),
+]
+
+@pytest.mark.parametrize('date_window, expected', [
+    (2, {'IMG_0100.MOV': ('2024:06:01', 'IMG_0100'), 'IMG_0101.MOV': 'unmatched_videos',
+         'IMG_0102.MOV': 'unmatched_videos', 'IMG_0103.MOV': 'unmatched_videos'}),
+    (24, {'IMG_0100.MOV': ('2024:06:01', 'IMG_0100'), 'IMG_0101.MOV': ('2024:06:01', 'IMG_0101'),
+          'IMG_0102.MOV': ('2024:06:01', 'IMG_0102'), 'IMG_0103.MOV': 'unmatched_videos'}),
+])
+def test_date_window_rollover(date_window, expected):
+    files = EDGE_CASES + ROLLOVER
+    legacy = legacy_group_files_by_contentidentifier(files)
+    assert dict(PhotoBridge.group_files_by_contentidentifier(files)) == dict(legacy)
+    assert all(file in legacy['unmatched_videos'] for file in ROLLOVER if file['type'] == 'video')
+
+    windowed = PhotoBridge.group_files_by_contentidentifier(files, date_window)
+    by_name = {Path(file['path']).name: key for key, members in windowed.items() for file in members}
+    assert {name: by_name[name] for name in expected} == expected
+    # Everything an exact day already paired stays where it was
+    legacy_by_name = {Path(file['path']).name: key for key, members in legacy.items() for file in members}
+    assert {name: by_name[name] for name, key in legacy_by_name.items() if key != 'unmatched_videos'} == {
+        name: key for name, key in legacy_by_name.items() if key != 'unmatched_videos'}
@@ -0,0 +1,60 @@
+import os
+import random
+
+import pytest
+
+import assembly
+import corpus
+import jpeg_xmp
+import motion_photo
+import transfer
+import xmp
+from support import CONTENT_IDENTIFIER, CREATE_DATE
+
+@pytest.fixture
+def motion_photo_file(tmp_path):
+    photo = corpus.make_jpeg(CREATE_DATE, CONTENT_IDENTIFIER, 1_520_000_000, size=50_000, rng=random.Random(1))
+    video = corpus.make_mov(CREATE_DATE, CONTENT_IDENTIFIER, size=200_000, rng=random.Random(2))
+    (tmp_path / 'IMG_0001.JPG').write_bytes(photo)
+    (tmp_path / 'IMG_0001.MOV').write_bytes(video)
+    path = tmp_path / 'IMG_0001.MP.JPG'
+    assembly.assemble_jpeg_motion_photo(str(tmp_path / 'IMG_0001.JPG'), str(tmp_path / 'IMG_0001.MOV'), str(path),
+                                        xmp.motion_photo_elements(len(video), 1_520_000))
+    os.unlink(tmp_path / 'IMG_0001.JPG')
+    os.unlink(tmp_path / 'IMG_0001.MOV')
+    return path, jpeg_xmp.inject_xmp(photo, xmp.motion_photo_elements(len(video), 1_520_000)), video
+
+def test_extract_splits_photo_and_video(motion_photo_file):
+    path, photo, video = motion_photo_file
+    info = motion_photo.extract(str(path))
+    assert info['errors'] == []
+    assert (info['photo_path'], info['video_path']) == (str(path.with_name('IMG_0001.JPG')),
+                                                        str(path.with_name('IMG_0001.MOV')))
+    assert path.with_name('IMG_0001.JPG').read_bytes() == photo
+    assert path.with_name('IMG_0001.MOV').read_bytes() == video
+
+@pytest.mark.parametrize('existing', [['IMG_0001.JPG'], ['IMG_0001.MOV'], ['IMG_0001.JPG', 'IMG_0001.MOV']])
+def test_extract_leaves_existing_files_alone(motion_photo_file, existing):
+    path, _, _ = motion_photo_file
+    for name in existing:
+        path.with_name(name).write_bytes(b'kept')
+    info = motion_photo.extract(str(path))
+    assert info['errors'] == [f"{path.with_name(name)} already exists" for name in existing]
+    assert sorted(os.listdir(path.parent)) == sorted(existing + [path.name])
+    assert all(path.with_name(name).read_bytes() == b'kept' for name in existing)
+
+def test_extract_backs_out_when_a_file_appears_meanwhile(motion_photo_file, monkeypatch):
+    path, _, _ = motion_photo_file
+    commit_new = transfer.commit_new
+
+    def racing_commit(temp, output):
+        # Another process writes the video name after the check but before the rename
+        if output.endswith('.MOV'):
+            with open(output, 'wb') as f:
+                f.write(b'kept')
+        commit_new(temp, output)
+    monkeypatch.setattr(transfer, 'commit_new', racing_commit)
+    info = motion_photo.extract(str(path))
+    assert info['errors'] == [f"{path.with_name('IMG_0001.MOV')} already exists"]
+    assert sorted(os.listdir(path.parent)) == ['IMG_0001.MOV', 'IMG_0001.MP.JPG']
+    assert path.with_name('IMG_0001.MOV').read_bytes() == b'kept'
@@ -0,0 +1,99 @@
+import random
+import struct
+
+import pytest
+
+import corpus
+import isobmff
+import metrics
+import native_metadata
+import PhotoBridge
+from support import (CONTENT_IDENTIFIER, CREATE_DATE, JFIF_APP0, RUN_TIME_SCALE, VIDEO_INDEX, jpeg,
+                     requires_exiftool, rdf, xmp_app1)
+
+FIELDS = ['ContentIdentifier', 'CreateDate', 'LivePhotoVideoIndex', 'RunTimeScale']
+
+FIXTURES = {
+    'IMG_0001.JPG': lambda: corpus.make_jpeg(CREATE_DATE, CONTENT_IDENTIFIER, VIDEO_INDEX, RUN_TIME_SCALE, 50_000,
+                                             random.Random(1)),
+    'IMG_0002.JPG': lambda: corpus.make_jpeg('2023:12:31 23:59:59', None, -5, 600, 50_000, random.Random(2)),
+    'IMG_0003.HEIC': lambda: corpus.make_heic(CREATE_DATE, CONTENT_IDENTIFIER, VIDEO_INDEX, RUN_TIME_SCALE,
+                                              50_000, random.Random(3)),
+    'IMG_0004.HEIC': lambda: corpus.make_heic('2024:02:29 00:00:01', None, 0, 1, 50_000, random.Random(4)),
+    'IMG_0001.MOV': lambda: corpus.make_mov(CREATE_DATE, CONTENT_IDENTIFIER, 100_000, random.Random(5)),
+    'IMG_0002.MOV': lambda: corpus.make_mov('2023:12:31 23:59:59', None, 100_000, random.Random(6)),
+}
+
+def mov_without_mvhd() -> bytes:
+    return (isobmff.make_box(b'ftyp', b'qt  \x00\x00\x00\x00qt  ')
+            + isobmff.make_box(b'moov', isobmff.make_box(b'udta', b'')) + isobmff.make_box(b'mdat', b'\x00' * 64))
+
+# Nothing the native readers take a CreateDate from: exiftool gets these, and may still find a date elsewhere
+NO_CREATE_DATE = {
+    'JFIF_ONLY.JPG': lambda: jpeg(JFIF_APP0),
+    'XMP_DATE.JPG': lambda: jpeg(JFIF_APP0, xmp_app1(rdf(
+        '<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" '
+        'xmp:CreateDate="2024-06-01T09:00:00"/>'))),
+    'NO_EXIF.HEIC': lambda: strip_exif_item(corpus.make_heic(CREATE_DATE, CONTENT_IDENTIFIER)),
+    'NO_MVHD.MOV': mov_without_mvhd,
+}
+
+def strip_exif_item(heic: bytes) -> bytes:
+    # The Exif item's type renamed, so the reader finds no Exif item; sizes and offsets stay as they were
+    at = heic.index(b'Exif\x00', heic.index(b'iinf'))
+    return heic[:at] + b'exif' + heic[at + 4:]
+
+def write(tmp_path, fixtures: dict) -> list:
+    paths = []
+    for name, build in fixtures.items():
+        (tmp_path / name).write_bytes(build())
+        paths.append(str(tmp_path / name))
+    return paths
+
+@requires_exiftool
+def test_native_fields_match_exiftool(tmp_path):
+    paths = write(tmp_path, FIXTURES)
+    reference = PhotoBridge.extract_metadata_files(paths, native=False)
+    for path in paths:
+        native = native_metadata.read_metadata(path)
+        expected = reference[native['FilePath']]
+        assert {name: native.get(name) for name in FIELDS} == {name: expected.get(name) for name in FIELDS}, path
+        assert native['FileName'] == expected['FileName'] and native['BaseName'] == expected['BaseName']
+
+@requires_exiftool
+def test_compare_with_exiftool_finds_no_mismatches(tmp_path):
+    assert native_metadata.compare_with_exiftool(write(tmp_path, FIXTURES)) == []
+
+def test_fields_from_the_fixtures(tmp_path):
+    photo, _, heic, _, video, untagged_video = write(tmp_path, FIXTURES)
+    assert {name: native_metadata.read_metadata(photo).get(name) for name in FIELDS} == {
+        'ContentIdentifier': CONTENT_IDENTIFIER, 'CreateDate': CREATE_DATE,
+        'LivePhotoVideoIndex': VIDEO_INDEX, 'RunTimeScale': RUN_TIME_SCALE}
+    assert native_metadata.read_metadata(heic)['ContentIdentifier'] == CONTENT_IDENTIFIER
+    assert native_metadata.read_metadata(video)['CreateDate'] == CREATE_DATE
+    assert 'ContentIdentifier' not in native_metadata.read_metadata(untagged_video)
+
+@pytest.mark.parametrize('name', NO_CREATE_DATE)
+def test_no_create_date_is_unsupported(tmp_path, name):
+    with pytest.raises(native_metadata.UnsupportedFile):
+        native_metadata.read_metadata(write(tmp_path, {name: NO_CREATE_DATE[name]})[0])
+
+def test_corrupt_file_is_unsupported(tmp_path):
+    path = tmp_path / 'IMG_0001.JPG'
+    data = FIXTURES['IMG_0001.JPG']()
+    # The Exif IFD pointer aimed past the end of the segment
+    at = data.index(struct.pack('>HHI', 0x8769, 4, 1)) + 8
+    path.write_bytes(data[:at] + b'\x7F\xFF\xFF\xFF' + data[at + 4:])
+    with pytest.raises(native_metadata.UnsupportedFile):
+        native_metadata.read_metadata(str(path))
+
+@requires_exiftool
+def test_unsupported_files_fall_back_to_exiftool(tmp_path):
+    paths = write(tmp_path, NO_CREATE_DATE)
+    with metrics.capture() as collected:
+        records = PhotoBridge.extract_metadata_files(paths)
+    assert collected.counters['files_extracted_exiftool'] == len(paths)
+    assert 'files_extracted_native' not in collected.counters
+    assert sorted(record['FileName'] for record in records.values()) == sorted(NO_CREATE_DATE)
+    assert records[str(tmp_path / 'XMP_DATE.JPG')]['CreateDate'] == '2024:06:01 09:00:00'
+    assert records[str(tmp_path / 'NO_EXIF.HEIC')].get('CreateDate') is None
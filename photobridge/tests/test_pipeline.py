@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+import shutil
+
+import pytest
+
+import corpus
+import pipeline
+import PhotoBridge
+
+@pytest.fixture
+def card(tmp_path):
+    directory = tmp_path / 'card'
+    corpus.generate_corpus(str(directory), 30, photo_format='mixed', photo_size=20_000, video_size=30_000,
+                           missing_identifier_ratio=0.3, rollover_ratio=0.1, seed=5)
+    # A video with nothing to pair with goes the unmatched way
+    (directory / 'LONELY.MOV').write_bytes(corpus.make_mov('2024:06:01 09:00:00', 'NO-PHOTO', size=30_000))
+    return directory
+
+def contents(directory) -> dict:
+    return {path.name: hashlib.sha256(path.read_bytes()).hexdigest() for path in directory.iterdir()}
+
+@pytest.mark.parametrize('stage_jobs', [None, 'extract=1,tag=1,append=1,cleanup=1', 'extract=8,exiftool=2,append=3'])
+def test_pipeline_matches_the_serial_run(tmp_path, card, stage_jobs):
+    runs = {}
+    for name, options in (('serial', {'jobs': 1}), ('pipeline', {'jobs': 4, 'pipeline': True,
+                                                                 'stage_jobs': stage_jobs})):
+        source, output = tmp_path / name, tmp_path / f'{name}-output'
+        shutil.copytree(card, source)
+        output.mkdir()
+        PhotoBridge.run_job(dict(options, dir=str(source), output=str(output)), lambda message: None)
+        runs[name] = contents(source), contents(output)
+    assert runs['pipeline'] == runs['serial']
+    assert 'LONELY.MOV' in runs['pipeline'][1]
+
+def test_stage_jobs_are_parsed():
+    assert PhotoBridge.pipeline_limits(4, 'extract=8, append=2') == {
+        'extract': 8, 'exiftool': 4, 'tag': 4, 'append': 2, 'cleanup': 4}
+    assert PhotoBridge.pipeline_limits(32)['exiftool'] == 16
+    assert PhotoBridge.pipeline_limits(2, '') == PhotoBridge.pipeline_limits(2)
+
+@pytest.mark.parametrize('spec', ['extract', 'extract=', 'extract=0', 'extract=-1', 'extract=x', 'extract=1.5',
+                                  'pair=2', 'scan=1', 'extract=2,bogus=1'])
+def test_bad_stage_jobs_are_rejected(spec):
+    with pytest.raises(ValueError, match='expected STAGE=N'):
+        PhotoBridge.pipeline_limits(4, spec)
+    assert PhotoBridge.check_job({'dir': '.', 'pipeline': True, 'stage_jobs': spec}).startswith('expected STAGE=N')
+
+def test_stages_hand_items_on_in_turn():
+    seen = []
+
+    async def double(stage, item):
+        await stage.emit(await stage.run(lambda: item * 2))
+
+    async def collect(stage, item):
+        seen.append(item)
+
+    flushed = []
+
+    async def flush(stage):
+        flushed.append(len(seen))
+    asyncio.run(pipeline.run_stages(range(200), [pipeline.Stage('double', double, 4),
+                                                 pipeline.Stage('collect', collect, flush=flush)], queue_size=2))
+    assert sorted(seen) == [item * 2 for item in range(200)]
+    assert flushed == [200]
+
+def test_a_failing_stage_stops_the_pipeline():
+    async def fail(stage, item):
+        if item == 5:
+            raise RuntimeError('stage failed')
+        await stage.emit(item)
+
+    async def collect(stage, item):
+        pass
+    with pytest.raises(RuntimeError, match='stage failed'):
+        asyncio.run(pipeline.run_stages(range(100), [pipeline.Stage('fail', fail, 2),
+                                                     pipeline.Stage('collect', collect)], queue_size=2))
@@ -0,0 +1,90 @@
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+import server
+
+@pytest.fixture
+def http_server():
+    ran = []
+    job_server = server.JobServer(lambda spec, emit: ran.append(spec), max_jobs=1)
+    httpd = server.make_http_server('127.0.0.1:0', job_server)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd.server_address[1], job_server, ran
+    httpd.shutdown()
+    httpd.server_close()
+    job_server.shutdown()
+
+def send(port: int, method: str, path: str, body: bytes | None = None, headers: dict | None = None) -> tuple:
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+@pytest.mark.parametrize('address', ['0.0.0.0:8765', '8.8.8.8:8765', 'not-a-port'])
+def test_refuses_addresses_off_loopback(address):
+    with pytest.raises(ValueError):
+        server.check_address(address)
+    with pytest.raises(ValueError):
+        server.make_http_server(address, None)
+
+@pytest.mark.parametrize('address', ['127.0.0.1:8765', 'localhost:8765', ':8765'])
+def test_allows_loopback(address):
+    server.check_address(address)
+
+def test_unix_address_leaves_other_files_alone(tmp_path):
+    path = tmp_path / 'photos.jpg'
+    path.write_bytes(b'not a socket')
+    with pytest.raises(ValueError, match='not a socket'):
+        server.make_http_server(f'unix:{path}', None)
+    assert path.read_bytes() == b'not a socket'
+
+def test_unix_address_replaces_a_stale_socket(tmp_path):
+    path = tmp_path / 'pb.sock'
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()
+    httpd = server.make_http_server(f'unix:{path}', server.JobServer(lambda spec, emit: None, max_jobs=1))
+    try:
+        assert httpd.server_address == str(path)
+    finally:
+        httpd.server_close()
+
+def test_submits_json_jobs(http_server):
+    port, job_server, ran = http_server
+    status, job = send(port, 'POST', '/jobs', json.dumps({'dir': '/photos'}).encode(),
+                       {'Content-Type': 'application/json; charset=utf-8'})
+    assert status == 202
+    for _ in server.events(f'127.0.0.1:{port}', job['id']):
+        pass
+    assert ran == [{'dir': '/photos'}]
+
+@pytest.mark.parametrize('content_type', [None, 'text/plain', 'application/x-www-form-urlencoded'])
+def test_refuses_jobs_that_are_not_json(http_server, content_type):
+    port, job_server, ran = http_server
+    headers = {'Content-Type': content_type} if content_type else {}
+    status, body = send(port, 'POST', '/jobs', b'{"dir": "/photos"}', headers)
+    assert status == 415
+    assert job_server.jobs == {}
+
+@pytest.mark.parametrize('method', ['GET', 'POST', 'DELETE'])
+@pytest.mark.parametrize('host', ['evil.example', 'evil.example:8765', '192.168.1.2'])
+def test_refuses_other_host_headers(http_server, method, host):
+    port, job_server, _ = http_server
+    body = json.dumps({'dir': '/photos'}).encode() if method == 'POST' else None
+    status, _ = send(port, method, '/jobs' if method != 'DELETE' else '/jobs/1', body,
+                     {'Host': host, 'Content-Type': 'application/json'})
+    assert status == 403
+    assert job_server.jobs == {}
+
+@pytest.mark.parametrize('host', ['localhost', 'localhost:8765', '127.0.0.1', '[::1]:8765'])
+def test_allows_localhost_host_headers(http_server, host):
+    port, _, _ = http_server
+    assert send(port, 'GET', '/status', headers={'Host': host})[0] == 200
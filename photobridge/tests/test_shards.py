@@ -0,0 +1,58 @@
+import hashlib
+import random
+import shutil
+
+import pytest
+
+import corpus
+import PhotoBridge
+
+DATE = '2024:06:01 09:00:00'
+
+def extras() -> dict:
+    """Files only a look across shards, or no shard at all, can settle."""
+    rng = random.Random(7)
+    return {
+        # One ContentIdentifier under two unrelated names
+        'SUNSET.JPG': corpus.make_jpeg(DATE, 'CROSS-NAME', 1_000_000, size=20_000, rng=rng),
+        'CLIP_9.MOV': corpus.make_mov(DATE, 'CROSS-NAME', size=30_000, rng=rng),
+        # A _N photo and its untagged video
+        'IMG_0200_1.JPG': corpus.make_jpeg(DATE, None, size=20_000, rng=rng),
+        'IMG_0200.MOV': corpus.make_mov(DATE, None, size=30_000, rng=rng),
+        # Nothing to pair with
+        'LONELY.MOV': corpus.make_mov(DATE, 'NO-PHOTO', size=30_000, rng=rng),
+        'STILL.JPG': corpus.make_jpeg(DATE, 'NO-VIDEO', size=20_000, rng=rng),
+    }
+
+@pytest.fixture
+def card(tmp_path):
+    directory = tmp_path / 'card'
+    corpus.generate_corpus(str(directory), 24, photo_format='mixed', photo_size=20_000, video_size=30_000,
+                           missing_identifier_ratio=0.3, rollover_ratio=0.1, seed=3)
+    for name, data in extras().items():
+        (directory / name).write_bytes(data)
+    return directory
+
+def contents(directory) -> dict:
+    return {path.name: hashlib.sha256(path.read_bytes()).hexdigest() for path in directory.iterdir()}
+
+@pytest.mark.parametrize('use_pipeline', [False, True])
+def test_shards_match_a_single_process_run(tmp_path, card, use_pipeline):
+    runs = {}
+    for name, options in (('single', {'jobs': 1}), ('sharded', {'jobs': 3, 'shards': 3, 'pipeline': use_pipeline})):
+        source, output = tmp_path / name, tmp_path / f'{name}-output'
+        shutil.copytree(card, source)
+        output.mkdir()
+        events = []
+        PhotoBridge.run_job(dict(options, dir=str(source), output=str(output), date_window=2), events.append)
+        runs[name] = contents(source), contents(output), events
+
+    (single_left, single_output, _), (sharded_left, sharded_output, events) = runs['single'], runs['sharded']
+    assert sharded_output == single_output
+    assert sharded_left == single_left
+    assert any(event.get('message', '').startswith('Processing 54 files in 3 shards') for event in events)
+    assert PhotoBridge.shard_of('SUNSET.JPG', 3) != PhotoBridge.shard_of('CLIP_9.MOV', 3)
+    assert any(event.get('message', '').startswith('Reconciling ') for event in events)
+    # The cross-shard cases did end up where a single process puts them
+    assert {'SUNSET.MP.JPG', 'IMG_0200_1.MP.JPG', 'LONELY.MOV'} <= set(sharded_output)
+    assert not [name for name in sharded_output if name.startswith('.')]
@@ -0,0 +1,139 @@
+import errno
+import fcntl
+import os
+import random
+
+import pytest
+
+import assembly
+import metrics
+import transfer
+
+DATA = random.Random(1).randbytes(3 * assembly.CHUNK_SIZE // 2)
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'IMG_0001.MOV'
+    path.write_bytes(DATA)
+    os.utime(path, ns=(1_700_000_000_000_000_000, 1_700_000_000_000_000_000))
+    return path
+
+def fail_with(code: int, calls: list | None = None):
+    def fail(*args):
+        if calls is not None:
+            calls.append(args)
+        raise OSError(code, os.strerror(code))
+    return fail
+
+def no_reflink(monkeypatch):
+    monkeypatch.setattr(fcntl, 'ioctl', fail_with(errno.EOPNOTSUPP))
+
+def partials(directory) -> list:
+    return [path.name for path in directory.iterdir() if path.name.endswith(transfer.PARTIAL_SUFFIX)]
+
+def test_rename_on_the_same_filesystem(tmp_path, source):
+    target = tmp_path / 'out' / 'IMG_0001.MOV'
+    target.parent.mkdir()
+    inode = source.stat().st_ino
+    with metrics.capture() as collected:
+        assert transfer.transfer(str(source), str(target)) == 'rename'
+    assert not source.exists() and target.stat().st_ino == inode
+    assert collected.counters['transfer_rename'] == 1
+
+def test_hardlink_keeps_the_source(tmp_path, source):
+    target = tmp_path / 'linked.MOV'
+    assert transfer.transfer(str(source), str(target), keep_source=True) == 'hardlink'
+    assert source.exists() and os.path.samefile(source, target)
+
+@pytest.mark.parametrize('unsupported, expected', [
+    ({}, 'copy_file_range'),
+    ({'copy_file_range': False}, 'sendfile'),
+    ({'copy_file_range': False, 'sendfile': False}, 'stream'),
+])
+def test_copies_across_filesystems(tmp_path, source, monkeypatch, unsupported, expected):
+    # EXDEV is what rename gives for another filesystem; the reflink is refused as it is off btrfs/XFS
+    monkeypatch.setattr(os, 'rename', fail_with(errno.EXDEV))
+    no_reflink(monkeypatch)
+    for name, supported in unsupported.items():
+        monkeypatch.setitem(assembly._kernel_copy_supported, name, supported)
+    if expected != 'stream' and not assembly._kernel_copy_supported[expected]:
+        pytest.skip(f'no {expected} on this platform')
+    target = tmp_path / 'copy.MOV'
+    assert transfer.transfer(str(source), str(target)) == expected
+    assert target.read_bytes() == DATA and not source.exists()
+    assert target.stat().st_mtime_ns == 1_700_000_000_000_000_000
+    assert partials(tmp_path) == []
+
+def test_reflink_is_used_when_the_filesystem_has_it(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(os, 'rename', fail_with(errno.EXDEV))
+    clones = []
+
+    def ioctl(dst_fd, request, src_fd):
+        # Stands in for FICLONE, which leaves dst with src's contents
+        assert request == transfer.FICLONE
+        clones.append(request)
+        os.write(dst_fd, os.pread(src_fd, len(DATA), 0))
+    monkeypatch.setattr(fcntl, 'ioctl', ioctl)
+    target = tmp_path / 'clone.MOV'
+    assert transfer.transfer(str(source), str(target)) == 'reflink'
+    assert clones and target.read_bytes() == DATA
+
+@pytest.mark.parametrize('link_errno', [errno.EXDEV, errno.EPERM])
+def test_keep_source_copies_when_it_cannot_link(tmp_path, source, monkeypatch, link_errno):
+    monkeypatch.setattr(os, 'link', fail_with(link_errno))
+    no_reflink(monkeypatch)
+    target = tmp_path / 'copy.MOV'
+    target.write_bytes(b'an older copy')
+    transfer.transfer(str(source), str(target), keep_source=True)
+    # The copy replaces what was there, through a temp file
+    assert source.read_bytes() == DATA and target.read_bytes() == DATA
+    assert partials(tmp_path) == []
+
+def test_keep_source_replaces_an_existing_target(tmp_path, source):
+    target = tmp_path / 'copy.MOV'
+    target.write_bytes(b'an older copy')
+    assert transfer.transfer(str(source), str(target), keep_source=True) != 'hardlink'
+    assert source.read_bytes() == DATA and target.read_bytes() == DATA
+    assert not os.path.samefile(source, target)
+
+@pytest.mark.parametrize('keep_source', [False, True])
+def test_other_errors_are_raised(tmp_path, source, monkeypatch, keep_source):
+    calls = []
+    monkeypatch.setattr(os, 'link' if keep_source else 'rename', fail_with(errno.EACCES, calls))
+    with pytest.raises(PermissionError):
+        transfer.transfer(str(source), str(tmp_path / 'copy.MOV'), keep_source)
+    assert calls and source.read_bytes() == DATA
+    assert not (tmp_path / 'copy.MOV').exists()
+
+@pytest.mark.parametrize('failure', ['copy', 'reflink', 'commit'])
+def test_a_failed_copy_leaves_the_source_and_no_temp(tmp_path, source, monkeypatch, failure):
+    monkeypatch.setattr(os, 'rename', fail_with(errno.EXDEV))
+    if failure == 'copy':
+        no_reflink(monkeypatch)
+        monkeypatch.setattr(assembly, 'copy_range', fail_with(errno.ENOSPC))
+    elif failure == 'reflink':
+        # Not "no reflink here" but a real I/O error, which is passed on
+        monkeypatch.setattr(fcntl, 'ioctl', fail_with(errno.EIO))
+    else:
+        no_reflink(monkeypatch)
+        monkeypatch.setattr(os, 'replace', fail_with(errno.EIO))
+    target = tmp_path / 'copy.MOV'
+    with pytest.raises(OSError):
+        transfer.transfer(str(source), str(target))
+    assert source.read_bytes() == DATA
+    assert not target.exists() and partials(tmp_path) == []
+
+@pytest.mark.parametrize('link_errno', [None, errno.EPERM])
+def test_commit_new_refuses_to_replace(tmp_path, monkeypatch, link_errno):
+    if link_errno is not None:
+        monkeypatch.setattr(os, 'link', fail_with(link_errno))
+    temp, target = tmp_path / '.target.partial', tmp_path / 'target'
+    temp.write_bytes(b'new')
+    target.write_bytes(b'old')
+    with pytest.raises(FileExistsError):
+        transfer.commit_new(str(temp), str(target))
+    assert (temp.read_bytes(), target.read_bytes()) == (b'new', b'old')
+    target.unlink()
+    transfer.commit_new(str(temp), str(target))
+    assert target.read_bytes() == b'new'
+    assert os.listdir(tmp_path) == ['target']
@@ -0,0 +1,53 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import corpus
+import PhotoBridge
+
+PAIRS = 5
+TIMEOUT = 30
+
+def watch(directory, output_dir, polling: bool, until) -> dict:
+    """Runs watch_directory until until(state) holds for its local state, and returns that state."""
+    deadline = time.monotonic() + TIMEOUT
+    seen = {}
+
+    def stop() -> bool:
+        # Called from watch_directory's own loop, so its frame is the caller's
+        seen.update(sys._getframe(1).f_locals)
+        return until(seen) or time.monotonic() > deadline
+    PhotoBridge.watch_directory(str(directory), False, str(output_dir), settle_seconds=0.1, orphan_seconds=0.5,
+                                poll_interval=0.05, polling=polling, stop=stop)
+    return seen
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_outputs_are_forgotten_once_they_land(tmp_path, polling):
+    source = tmp_path / 'import'
+    source.mkdir()
+    written = []
+    # Arriving after the watch has started, as an import does
+    threading.Timer(0.3, lambda: written.extend(corpus.generate_corpus(
+        str(source), PAIRS, photo_size=20_000, video_size=50_000, missing_identifier_ratio=0))).start()
+
+    def finished(state) -> bool:
+        outputs = [PhotoBridge.get_motion_photo_path(pair['photo'], str(source)) for pair in written]
+        return len(outputs) == PAIRS and all(path.exists() for path in outputs) and not (
+            state['produced'] or state['in_flight'] or state['candidates'] or state['pending'])
+    state = watch(source, source, polling, finished)
+    assert finished(state)
+    # Nothing written by the watch was read back in as a new file
+    assert sorted(path.name for path in source.iterdir()) == sorted(
+        PhotoBridge.get_motion_photo_path(pair['photo'], str(source)).name for pair in written)
+
+def test_outputs_outside_the_watched_tree_are_not_tracked(tmp_path):
+    source, output = tmp_path / 'import', tmp_path / 'output'
+    source.mkdir()
+    threading.Timer(0.3, lambda: corpus.generate_corpus(str(source), PAIRS, photo_size=20_000, video_size=50_000,
+                                                       missing_identifier_ratio=0)).start()
+    state = watch(source, output, True, lambda state: len(list(output.glob('*.MP.*'))) == PAIRS
+                  and not state['in_flight'])
+    assert len(list(output.glob('*.MP.*'))) == PAIRS
+    assert state['produced'] == set()